@@ -0,0 +1,220 @@
+# backups.py
+"""Backups online da base de dados com a API de backup do SQLite.
+
+A cópia é feita aos lotes de BACKUP_PAGINAS páginas, com uma pequena pausa entre
+lotes. A ligação de origem mantém uma transação de leitura aberta durante toda a
+cópia: em WAL isso fixa um snapshot consistente sem bloquear os escritores (sem
+ela, cada escrita de outra ligação obrigaria o backup a recomeçar do início).
+A cópia vai para um ficheiro .tmp não comprimido (a API de backup escreve numa
+base de dados real), é verificada com PRAGMA integrity_check e só depois é
+comprimida (gzip) para o arquivo final, aos pedaços; o .tmp é apagado no fim.
+Espaço livre necessário em BACKUP_DIR durante o backup: o tamanho da BD mais o
+do arquivo comprimido. Ao lado de cada backup fica um .json com tamanhos,
+duração e sha256.
+"""
+import os
+import json
+import gzip
+import zlib
+import time
+import shutil
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import base_dados
+
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "/tmp/backups" if os.environ.get("VERCEL") else "backups")
+BACKUP_PAGINAS = int(os.environ.get("BACKUP_PAGINAS", "256"))          # páginas por lote
+BACKUP_PAUSA_MS = float(os.environ.get("BACKUP_PAUSA_MS", "2"))        # pausa entre lotes
+BACKUP_INTERVALO_HORAS = float(os.environ.get("BACKUP_INTERVALO_HORAS", "24"))  # 0 = sem agendamento
+BACKUP_MANTER_ULTIMOS = int(os.environ.get("BACKUP_MANTER_ULTIMOS", "7"))
+BACKUP_MANTER_DIARIOS = int(os.environ.get("BACKUP_MANTER_DIARIOS", "30"))    # um por dia durante N dias
+BACKUP_PEDACO = 1024 * 1024
+
+_lock = threading.Lock()  # um backup/restauro de cada vez
+
+class ErroBackup(Exception):
+    """Backup inexistente, corrompido ou que falhou a verificação."""
+
+def _caminho(nome: str) -> str:
+    if os.path.basename(nome) != nome or not nome.endswith(".db.gz"):
+        raise ErroBackup(f"Nome de backup inválido: {nome}")
+    return os.path.join(BACKUP_DIR, nome)
+
+def _verificar(conn: sqlite3.Connection):
+    resultado = [r[0] for r in conn.execute("PRAGMA integrity_check")]
+    if resultado != ["ok"]:
+        raise ErroBackup(f"integrity_check falhou: {'; '.join(resultado[:5])}")
+
+def _copiar(origem: sqlite3.Connection, destino: sqlite3.Connection) -> int:
+    """Copia aos lotes; devolve o número de páginas copiadas."""
+    paginas = [0]
+
+    def progresso(estado, restantes, total):
+        paginas[0] = total
+        if BACKUP_PAUSA_MS:
+            time.sleep(BACKUP_PAUSA_MS / 1000)  # dá a vez aos escritores entre lotes
+
+    origem.backup(destino, pages=BACKUP_PAGINAS, progress=progresso)
+    return paginas[0]
+
+def criar_backup(motivo: str = "manual") -> dict:
+    """Faz um backup verificado e comprimido; devolve os seus metadados."""
+    with _lock:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        inicio = time.perf_counter()
+        nome = f"carpintaria-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.db.gz"
+        final = os.path.join(BACKUP_DIR, nome)
+        temporario = final[:-3] + ".tmp"
+        origem = base_dados.abrir_conexao()
+        try:
+            origem.execute("BEGIN")
+            origem.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()  # abre o snapshot de leitura
+            # A cópia descomprimida tem de caber inteira antes de o gzip começar
+            tamanho = origem.execute("PRAGMA page_count").fetchone()[0] * origem.execute("PRAGMA page_size").fetchone()[0]
+            livre = shutil.disk_usage(BACKUP_DIR).free
+            if livre < tamanho:
+                raise ErroBackup(f"Espaço insuficiente em {BACKUP_DIR}: {livre} bytes livres, a cópia precisa de {tamanho}")
+            destino = sqlite3.connect(temporario)
+            try:
+                paginas = _copiar(origem, destino)
+                _verificar(destino)
+            finally:
+                destino.close()
+        finally:
+            origem.rollback()
+            origem.close()
+        copia_ms = (time.perf_counter() - inicio) * 1000
+
+        sha = hashlib.sha256()
+        try:
+            with open(temporario, "rb") as entrada, open(final + ".tmp", "wb") as bruto:
+                with gzip.GzipFile(fileobj=bruto, mode="wb", compresslevel=6) as saida:
+                    while pedaco := entrada.read(BACKUP_PEDACO):
+                        saida.write(pedaco)
+                        sha.update(pedaco)
+            os.replace(final + ".tmp", final)
+            bytes_bd = os.path.getsize(temporario)
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+
+        meta = {
+            "nome": nome,
+            "criado_em": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "motivo": motivo,
+            "paginas": paginas,
+            "bytes_bd": bytes_bd,
+            "bytes_comprimido": os.path.getsize(final),
+            "sha256": sha.hexdigest(),  # do ficheiro .db descomprimido
+            "copia_ms": round(copia_ms, 1),
+            "duracao_ms": round((time.perf_counter() - inicio) * 1000, 1),
+            "verificado": True
+        }
+        with open(final + ".json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        meta["removidos"] = aplicar_retencao()
+        return meta
+
+def listar_backups() -> list:
+    """Metadados de todos os backups, do mais recente para o mais antigo."""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    backups = []
+    for ficheiro in os.listdir(BACKUP_DIR):
+        if ficheiro.endswith(".db.gz.json") and os.path.exists(os.path.join(BACKUP_DIR, ficheiro[:-5])):
+            with open(os.path.join(BACKUP_DIR, ficheiro), encoding="utf-8") as f:
+                backups.append(json.load(f))
+    return sorted(backups, key=lambda b: b["nome"], reverse=True)
+
+def aplicar_retencao() -> list:
+    """Mantém os BACKUP_MANTER_ULTIMOS mais recentes e o último de cada dia nos últimos BACKUP_MANTER_DIARIOS dias."""
+    backups = listar_backups()
+    manter = {b["nome"] for b in backups[:BACKUP_MANTER_ULTIMOS]}
+    limite = (datetime.now() - timedelta(days=BACKUP_MANTER_DIARIOS)).strftime("%Y-%m-%d")
+    dias = set()
+    for b in backups:
+        dia = b["criado_em"][:10]
+        if dia >= limite and dia not in dias:
+            dias.add(dia)
+            manter.add(b["nome"])
+    removidos = []
+    for b in backups:
+        if b["nome"] not in manter:
+            for caminho in (_caminho(b["nome"]), _caminho(b["nome"]) + ".json"):
+                if os.path.exists(caminho):
+                    os.remove(caminho)
+            removidos.append(b["nome"])
+    return removidos
+
+def restaurar_backup(nome: str) -> dict:
+    """Repõe um backup na BD ativa, só depois de o verificar (sha256 + integrity_check).
+
+    Antes do restauro faz-se um backup de segurança do estado atual. A cópia para a BD
+    ativa usa também a API de backup, num só passo, por isso as outras ligações veem a
+    troca de uma vez.
+    """
+    caminho = _caminho(nome)
+    if not os.path.exists(caminho):
+        raise ErroBackup(f"Backup inexistente: {nome}")
+    with open(caminho + ".json", encoding="utf-8") as f:
+        meta = json.load(f)
+    inicio = time.perf_counter()
+    temporario = os.path.join(BACKUP_DIR, f"restauro-{os.getpid()}.db")
+    try:
+        with _lock:
+            sha = hashlib.sha256()
+            with gzip.open(caminho, "rb") as entrada, open(temporario, "wb") as saida:
+                while pedaco := entrada.read(BACKUP_PEDACO):
+                    saida.write(pedaco)
+                    sha.update(pedaco)
+            if sha.hexdigest() != meta["sha256"]:
+                raise ErroBackup(f"sha256 não confere para {nome}")
+            origem = sqlite3.connect(temporario)
+            try:
+                _verificar(origem)
+            finally:
+                origem.close()
+
+        seguranca = criar_backup(motivo=f"antes de restaurar {nome}")
+
+        with _lock:
+            origem = sqlite3.connect(temporario)
+            destino = base_dados.abrir_conexao()
+            try:
+                anterior = base_dados.ler_geracao_restauro(destino)
+                origem.backup(destino)
+                _verificar(destino)
+                # Avisa os outros workers: as ligações deles também ficaram inválidas
+                base_dados.marcar_restauro(destino, anterior)
+            finally:
+                destino.close()
+                origem.close()
+            base_dados.renovar_conexoes()
+    except (OSError, EOFError, zlib.error) as e:
+        raise ErroBackup(f"Backup ilegível ({nome}): {e}")
+    finally:
+        for sufixo in ("", "-wal", "-shm"):
+            if os.path.exists(temporario + sufixo):
+                os.remove(temporario + sufixo)
+    return {
+        "restaurado": nome,
+        "backup_seguranca": seguranca["nome"],
+        "duracao_ms": round((time.perf_counter() - inicio) * 1000, 1),
+        "verificado": True
+    }
+
+def estatisticas() -> dict:
+    backups = listar_backups()
+    ultimo = backups[0] if backups else None
+    return {
+        "ultimo_backup": ultimo["criado_em"][:16] if ultimo else None,
+        "total_backups": len(backups),
+        "bytes_total": sum(b["bytes_comprimido"] for b in backups),
+        "ultimo": ultimo,
+        "duracao_media_ms": round(sum(b["duracao_ms"] for b in backups) / len(backups), 1) if backups else None,
+        "intervalo_horas": BACKUP_INTERVALO_HORAS,
+        "em_curso": _lock.locked()
+    }
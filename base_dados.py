@@ -0,0 +1,454 @@
+# base_dados.py
+"""Camada de ligação ao SQLite da Carpintaria OS.
+
+Cada thread reutiliza a sua própria ligação (em vez de abrir e fechar uma por
+pedido), já configurada em modo WAL e com os pragmas afinados. Como a ligação
+vive muito tempo, a cache de statements do sqlite3 reaproveita as queries
+preparadas sempre que o texto SQL é o mesmo.
+"""
+import os
+import time
+import zlib
+import shutil
+import asyncio
+import sqlite3
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+if os.environ.get("DB_PATH"):
+    DB_PATH = os.environ["DB_PATH"]
+elif os.environ.get("VERCEL"):
+    DB_PATH = "/tmp/carpintaria.db"
+else:
+    DB_PATH = "carpintaria.db"
+
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_MMAP_BYTES = int(os.environ.get("DB_MMAP_BYTES", str(256 * 1024 * 1024)))
+DB_CACHE_KB = int(os.environ.get("DB_CACHE_KB", "16000"))
+DB_CACHED_STATEMENTS = int(os.environ.get("DB_CACHED_STATEMENTS", "256"))
+DB_MAX_THREADS = int(os.environ.get("DB_MAX_THREADS", "4"))
+# NORMAL: sem fsync por commit (seguro contra crash do processo); FULL: fsync a cada commit
+DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL").upper()
+
+# Group commit (fila de escrita): desligado por omissão
+DB_GRUPO_ATIVO = os.environ.get("DB_GRUPO_ATIVO", "0") == "1"
+DB_GRUPO_MS = float(os.environ.get("DB_GRUPO_MS", "5"))      # espera máxima para juntar escritas
+DB_GRUPO_MAX = int(os.environ.get("DB_GRUPO_MAX", "200"))    # linhas por transação
+DB_GRUPO_ACK = os.environ.get("DB_GRUPO_ACK", "commit")      # 'commit' ou 'fila'
+
+# Caches locais de cada worker: intervalo máximo entre verificações de PRAGMA data_version
+DB_COERENCIA_MS = float(os.environ.get("DB_COERENCIA_MS", "100"))
+
+# Pool dedicado às queries: os handlers async nunca tocam no SQLite no event loop
+_pool_db = ThreadPoolExecutor(max_workers=DB_MAX_THREADS, thread_name_prefix="carpintaria-db")
+
+_local = threading.local()
+_todas = []  # todas as ligações abertas, para fechar no shutdown
+_todas_lock = threading.Lock()
+_geracao_ligacoes = 0  # sobe quando as ligações das threads têm de ser reabertas (restauro)
+
+def _zlib_texto(dados):
+    """Função SQL zlib_texto(blob): texto de um corpo comprimido (usada pelo índice FTS dos documentos)."""
+    return zlib.decompress(dados).decode("utf-8") if dados else None
+
+def configurar_conexao(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Aplica os pragmas de desempenho a uma ligação nova e regista as funções SQL da app."""
+    conn.create_function("zlib_texto", 1, _zlib_texto, deterministic=True)
+    conn.execute("PRAGMA journal_mode=WAL")  # leitores não bloqueiam o escritor
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")  # NORMAL é seguro em WAL, sem fsync por commit
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_BYTES}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+def abrir_conexao(path: str = None) -> sqlite3.Connection:
+    """Abre uma ligação dedicada já configurada (quem a abre é responsável por fechá-la)."""
+    conn = sqlite3.connect(
+        path or DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=DB_CACHED_STATEMENTS,
+        check_same_thread=False  # cada ligação é usada por uma só thread, mas fechada no shutdown
+    )
+    return configurar_conexao(conn)
+
+def obter_conexao() -> sqlite3.Connection:
+    """Ligação reutilizada da thread atual (abre-a na primeira utilização)."""
+    versao_bd.atual()  # um restauro feito noutro worker também obriga a reabrir (ver VersaoBD)
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != DB_PATH or getattr(_local, "geracao", 0) != _geracao_ligacoes:
+        if conn is not None:
+            with _todas_lock:
+                if conn in _todas:
+                    _todas.remove(conn)
+            conn.close()
+        conn = abrir_conexao()
+        _local.conn, _local.path, _local.geracao = conn, DB_PATH, _geracao_ligacoes
+        with _todas_lock:
+            _todas.append(conn)
+    return conn
+
+def renovar_conexoes():
+    """Cada thread reabre a sua ligação no próximo uso (o schema e as tabelas virtuais em cache
+    nas ligações antigas não sobrevivem a um restauro feito por baixo delas)."""
+    global _geracao_ligacoes
+    _geracao_ligacoes += 1
+
+def ler_geracao_restauro(conn: sqlite3.Connection) -> int:
+    """Quantos restauros de backup já foram feitos sobre esta BD (0 se nenhum)."""
+    try:
+        linha = conn.execute("SELECT geracao FROM _restauros").fetchone()
+    except sqlite3.OperationalError:  # BD (ou backup) anterior à primeira restauração
+        return 0
+    return linha[0] if linha else 0
+
+def marcar_restauro(conn: sqlite3.Connection, anterior: int):
+    """Grava na BD restaurada a geração seguinte à que havia antes: os outros workers veem-na
+    mudar (VersaoBD) e reabrem as suas ligações, tal como o worker que restaurou."""
+    conn.execute("CREATE TABLE IF NOT EXISTS _restauros (geracao INTEGER NOT NULL)")
+    conn.execute("DELETE FROM _restauros")
+    conn.execute("INSERT INTO _restauros (geracao) VALUES (?)", (anterior + 1,))
+    conn.commit()
+
+@contextmanager
+def transacao():
+    """Ligação da thread com commit no fim do bloco e rollback em caso de erro."""
+    conn = obter_conexao()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def fechar_conexoes():
+    """Fecha todas as ligações abertas pelas threads (chamado no shutdown)."""
+    with _todas_lock:
+        for conn in _todas:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        _todas.clear()
+    _local.__dict__.clear()
+
+def restaurar_semente(semente: str) -> bool:
+    """Copia a base de dados pré-construída para DB_PATH se este ainda não existir (arranque a frio)."""
+    if os.path.exists(DB_PATH) or not os.path.exists(semente):
+        return False
+    temporario = f"{DB_PATH}.semente"
+    shutil.copyfile(semente, temporario)
+    os.replace(temporario, DB_PATH)  # atómico: outra instância nunca vê um ficheiro a meio
+    return True
+
+# --- ACESSO ASSÍNCRONO ---
+async def na_thread_db(funcao, *args):
+    """Corre `funcao(*args)` no pool de threads da base de dados (cada thread tem a sua ligação)."""
+    return await asyncio.get_running_loop().run_in_executor(_pool_db, funcao, *args)
+
+def _consultar(sql: str, params: tuple):
+    return obter_conexao().execute(sql, params).fetchall()
+
+def _consultar_um(sql: str, params: tuple):
+    return obter_conexao().execute(sql, params).fetchone()
+
+def _executar(sql: str, params: tuple):
+    with transacao() as conn:
+        cursor = conn.execute(sql, params)
+        return cursor.lastrowid, cursor.rowcount
+
+def _executar_muitos(sql: str, linhas: list):
+    with transacao() as conn:
+        return conn.executemany(sql, linhas).rowcount
+
+async def consultar(sql: str, params: tuple = ()) -> list:
+    """SELECT fora do event loop; devolve todas as linhas."""
+    return await na_thread_db(_consultar, sql, params)
+
+async def consultar_um(sql: str, params: tuple = ()):
+    """SELECT fora do event loop; devolve a primeira linha (ou None)."""
+    return await na_thread_db(_consultar_um, sql, params)
+
+async def executar(sql: str, params: tuple = ()):
+    """Escrita numa transação própria; devolve (lastrowid, rowcount)."""
+    return await na_thread_db(_executar, sql, params)
+
+async def executar_muitos(sql: str, linhas: list) -> int:
+    """executemany numa só transação; devolve o número de linhas afetadas."""
+    return await na_thread_db(_executar_muitos, sql, linhas)
+
+# --- GROUP COMMIT ---
+def _gravar_grupo(escritas: list) -> list:
+    """Grava várias escritas numa só transação; cada uma num savepoint, para que uma falha não leve as outras."""
+    resultados = []
+    with transacao() as conn:
+        # SAVEPOINT fora de uma transação abre (e o RELEASE confirma) uma transação por escrita:
+        # o BEGIN explícito faz do grupo inteiro um só commit
+        conn.execute("BEGIN IMMEDIATE")
+        for sql, params in escritas:
+            conn.execute("SAVEPOINT escrita")
+            try:
+                resultados.append(conn.execute(sql, params).lastrowid)
+                conn.execute("RELEASE escrita")
+            except sqlite3.Error as e:
+                conn.execute("ROLLBACK TO escrita")
+                conn.execute("RELEASE escrita")
+                resultados.append(e)
+    return resultados
+
+class FilaEscrita:
+    """Write-behind com group commit: junta escritas durante `janela_ms` (ou até `maximo`) numa transação.
+
+    Com ack='commit' quem escreve só recebe resposta depois do COMMIT do seu grupo (o que isso
+    garante depende de DB_SYNCHRONOUS: FULL faz fsync, NORMAL sobrevive a crash do processo mas
+    não a falha de energia). Com ack='fila' a resposta é imediata e um crash antes do commit
+    perde as escritas ainda na fila (no máximo `maximo` linhas / `janela_ms` de escritas).
+    """
+
+    def __init__(self, ativo: bool = DB_GRUPO_ATIVO, janela_ms: float = DB_GRUPO_MS,
+                 maximo: int = DB_GRUPO_MAX, ack: str = DB_GRUPO_ACK):
+        self.ativo = ativo
+        self.janela = janela_ms / 1000
+        self.maximo = maximo
+        self.ack = ack
+        self.fila = None
+        self.tarefa = None
+        self.grupos = 0
+        self.escritas = 0
+
+    async def escrever(self, sql: str, params: tuple = ()):
+        """INSERT/UPDATE pela fila; devolve o lastrowid (ou None com ack='fila')."""
+        if not self.ativo:
+            return (await executar(sql, params))[0]
+        if self.tarefa is None or self.tarefa.done():
+            self.fila = asyncio.Queue()
+            self.tarefa = asyncio.create_task(self._ciclo())
+        futuro = asyncio.get_running_loop().create_future()
+        await self.fila.put((sql, params, futuro))
+        if self.ack == "fila":
+            return None
+        resultado = await futuro
+        if isinstance(resultado, Exception):
+            raise resultado
+        return resultado
+
+    async def _ciclo(self):
+        """Um grupo de cada vez; None na fila pede para gravar o que houver e terminar."""
+        terminar = False
+        while not terminar:
+            item = await self.fila.get()
+            if item is None:
+                return
+            grupo = [item]
+            limite = asyncio.get_running_loop().time() + self.janela
+            while len(grupo) < self.maximo:
+                restante = limite - asyncio.get_running_loop().time()
+                if restante <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.fila.get(), restante)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    terminar = True
+                    break
+                grupo.append(item)
+            await self._gravar(grupo)
+
+    async def _gravar(self, grupo: list):
+        try:
+            resultados = await na_thread_db(_gravar_grupo, [(sql, params) for sql, params, _ in grupo])
+        except Exception as e:
+            resultados = [e] * len(grupo)
+        self.grupos += 1
+        self.escritas += len(grupo)
+        for (_, _, futuro), resultado in zip(grupo, resultados):
+            if isinstance(resultado, Exception) and self.ack == "fila":
+                print(f"Erro numa escrita da fila (já confirmada ao cliente): {resultado}")
+            if not futuro.done():
+                futuro.set_result(resultado)
+
+    async def parar(self):
+        """Grava o que ainda está na fila (chamado no shutdown)."""
+        if self.tarefa is None or self.tarefa.done():
+            return
+        await self.fila.put(None)
+        await self.tarefa
+        self.tarefa = None
+
+    def estado(self) -> dict:
+        return {
+            "ativo": self.ativo, "ack": self.ack, "janela_ms": self.janela * 1000, "maximo": self.maximo,
+            "grupos": self.grupos, "escritas": self.escritas,
+            "media_por_grupo": round(self.escritas / self.grupos, 1) if self.grupos else 0,
+            "na_fila": self.fila.qsize() if self.fila else 0
+        }
+
+# --- COERÊNCIA ENTRE WORKERS ---
+class VersaoBD:
+    """Deteta commits feitos por qualquer ligação (deste ou de outro worker) com PRAGMA data_version.
+
+    data_version só muda quando *outra* ligação confirma uma transação, por isso usa-se uma
+    ligação própria que nunca escreve. Cada verificação custa poucos microssegundos (lê o
+    índice partilhado do WAL) e faz-se no máximo de DB_COERENCIA_MS em DB_COERENCIA_MS.
+    Garantia: uma escrita confirmada em qualquer worker invalida as caches dos outros no
+    máximo DB_COERENCIA_MS depois do COMMIT. Quando data_version muda lê-se também a geração
+    de restauro (ver marcar_restauro): se mudou, as ligações das threads deste worker são
+    reabertas e as caches recalculadas mesmo que a sua chave tenha ficado igual.
+    """
+
+    def __init__(self, intervalo_ms: float = DB_COERENCIA_MS):
+        self.intervalo = intervalo_ms / 1000
+        self.geracao = 0          # sobe sempre que data_version muda
+        self.restauro = None      # geração de restauro da BD vista por este worker
+        self._data_version = None
+        self._verificado_em = float("-inf")
+        self._conn = None
+        self._path = None
+        self._lock = threading.Lock()
+
+    def atual(self) -> int:
+        """Geração atual da BD vista por este worker (uma cache feita noutra geração está obsoleta)."""
+        if time.monotonic() - self._verificado_em < self.intervalo:
+            return self.geracao
+        with self._lock:
+            if self._conn is None or self._path != DB_PATH:
+                if self._conn is not None:
+                    self._conn.close()
+                self._conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
+                self._path = DB_PATH
+            valor = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if valor != self._data_version:
+                self._data_version = valor
+                self.geracao += 1
+                restauro = ler_geracao_restauro(self._conn)
+                if self.restauro is not None and restauro != self.restauro:
+                    renovar_conexoes()
+                self.restauro = restauro
+            self._verificado_em = time.monotonic()
+        return self.geracao
+
+    def fechar(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def estado(self) -> dict:
+        return {"pid": os.getpid(), "geracao": self.geracao, "data_version": self._data_version,
+                "restauro": self.restauro, "geracao_ligacoes": _geracao_ligacoes,
+                "intervalo_ms": self.intervalo * 1000}
+
+# Partilhada pelas caches da app e por obter_conexao (um restauro noutro worker reabre as ligações)
+versao_bd = VersaoBD()
+
+class CacheCoerente:
+    """Valor calculado a partir da BD e guardado em memória do worker até à próxima mudança.
+
+    `calcular(conn)` corre no pool da BD. Se for dada uma `chave` (SQL de um só valor, p.ex.
+    um contador mantido por triggers), uma mudança de geração só obriga a recalcular quando
+    a chave também mudou: escritas noutras tabelas custam apenas essa query.
+    """
+
+    def __init__(self, versao: VersaoBD, calcular, chave: str = None):
+        self.versao = versao
+        self.calcular = calcular
+        self.chave = chave
+        self.recalculos = 0
+        self._geracao = None
+        self._valor_chave = None
+        self._valor = None
+        self._lock = threading.Lock()
+
+    def obter_sincrono(self):
+        """Versão para código que já corre numa thread da BD."""
+        geracao = self.versao.atual()
+        with self._lock:
+            if geracao == self._geracao:
+                return self._valor
+            conn = obter_conexao()
+            # Depois de um restauro a chave pode coincidir com a de antes e o conteúdo não
+            valor_chave = (self.versao.restauro, conn.execute(self.chave).fetchone()[0]) if self.chave else None
+            if self._geracao is None or not self.chave or valor_chave != self._valor_chave:
+                self._valor = self.calcular(conn)
+                self.recalculos += 1
+            self._geracao, self._valor_chave = geracao, valor_chave
+            return self._valor
+
+    async def obter(self):
+        if self.versao.atual() == self._geracao:
+            return self._valor
+        return await na_thread_db(self.obter_sincrono)
+
+_lideres = {}  # nome -> descritor do ficheiro de lock (mantido aberto)
+
+def adquirir_lider(nome: str) -> bool:
+    """Lock de ficheiro exclusivo ao lado da BD: só um worker fica com ele (p.ex. para agendadores).
+
+    O lock é libertado pelo sistema quando o processo morre, por isso outro worker pode
+    assumir no arranque seguinte. Sem fcntl (Windows) corre sempre, como num só processo.
+    """
+    if nome in _lideres:
+        return True
+    try:
+        import fcntl
+    except ImportError:
+        _lideres[nome] = None
+        return True
+    fd = os.open(f"{DB_PATH}.{nome}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _lideres[nome] = fd  # fica aberto enquanto o processo viver
+    return True
+
+# --- MIGRAÇÕES ---
+def adicionar_coluna(tabela: str, coluna: str, tipo: str):
+    """Passo de migração que acrescenta uma coluna só se ainda não existir."""
+    def passo(conn):
+        colunas = {r[1] for r in conn.execute(f"PRAGMA table_info({tabela})")}
+        if coluna not in colunas:
+            conn.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}")
+    return passo
+
+def aplicar_migracoes(migracoes: list) -> list:
+    """Aplica, por ordem, as migrações com versão acima da registada em schema_versao.
+
+    Cada migração corre numa transação BEGIN IMMEDIATE própria e volta a verificar a
+    versão já com o lock, para que vários workers a arrancar em simultâneo não a
+    apliquem duas vezes. Sem migrações pendentes custa uma única query.
+    """
+    conn = obter_conexao()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_versao (
+            versao INTEGER PRIMARY KEY,
+            descricao TEXT,
+            aplicada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+    atual = conn.execute("SELECT COALESCE(MAX(versao), 0) FROM schema_versao").fetchone()[0]
+    aplicadas = []
+    for versao, descricao, passo in sorted(migracoes, key=lambda m: m[0]):
+        if versao <= atual:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM schema_versao WHERE versao = ?", (versao,)).fetchone():
+                conn.rollback()
+                continue
+            if callable(passo):
+                passo(conn)
+            else:
+                for sql in passo:
+                    conn.execute(sql)
+            conn.execute("INSERT INTO schema_versao (versao, descricao) VALUES (?, ?)", (versao, descricao))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        aplicadas.append(versao)
+    return aplicadas
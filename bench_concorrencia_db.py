@@ -0,0 +1,54 @@
+import asyncio
+import time
+import httpx
+
+# Benchmark: escritas pesadas na BD não devem atrasar páginas estáticas nem endpoints de estado.
+# Correr com o servidor ativo (python main.py) e comparar as latências com e sem carga.
+BASE_URL = "http://localhost:8000"
+ESCRITORES = 8           # clientes a gravar documentos em simultâneo
+ESCRITAS_POR_CLIENTE = 25
+TAMANHO_DOC = 2_000_000  # caracteres por documento: cada escrita pesa na BD, não no HTTP
+SONDAS = 100             # pedidos de leitura medidos durante a carga
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))] if valores else 0
+
+async def sondar(client, caminho, duracoes):
+    for _ in range(SONDAS):
+        inicio = time.perf_counter()
+        await client.get(f"{BASE_URL}{caminho}")
+        duracoes.append((time.perf_counter() - inicio) * 1000)
+        await asyncio.sleep(0.01)
+
+async def escrever(client, n):
+    conteudo = "Madeira de umbila. " * (TAMANHO_DOC // 19)
+    for i in range(ESCRITAS_POR_CLIENTE):
+        await client.post(f"{BASE_URL}/api/docs/guardar", json={
+            "filename": f"bench_{n}_{i}.txt", "titulo": f"Bench {n}-{i}", "conteudo": conteudo, "categoria": "Benchmark"
+        })
+
+async def medir(com_carga: bool):
+    limites = httpx.Limits(max_connections=ESCRITORES + 10)
+    async with httpx.AsyncClient(timeout=60.0, limits=limites) as client:
+        paginas, estado = [], []
+        tarefas = [sondar(client, "/", paginas), sondar(client, "/api/sync/status", estado)]
+        if com_carga:
+            tarefas += [escrever(client, n) for n in range(ESCRITORES)]
+        inicio = time.perf_counter()
+        await asyncio.gather(*tarefas)
+        total = time.perf_counter() - inicio
+    rotulo = "COM carga de escrita" if com_carga else "SEM carga"
+    print(f"--- {rotulo} ({total:.1f}s) ---")
+    print(f"Página '/':          p50={percentil(paginas, 0.5):.1f}ms  p95={percentil(paginas, 0.95):.1f}ms")
+    print(f"'/api/sync/status':  p50={percentil(estado, 0.5):.1f}ms  p95={percentil(estado, 0.95):.1f}ms")
+    if com_carga:
+        escritas = ESCRITORES * ESCRITAS_POR_CLIENTE
+        print(f"Escritas: {escritas} em {total:.1f}s ({escritas / total:.0f}/s)")
+
+async def main():
+    await medir(com_carga=False)
+    await medir(com_carga=True)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,39 +1,109 @@
 import os
-import sqlite3
+import sys
 import json
+import base64
+import hashlib
+import csv
+import io
 from datetime import datetime
-import uvicorn
-import httpx
 import asyncio
+import time
+import math
+import heapq
+import itertools
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import re
 import subprocess
 import tempfile
-import numpy as np
-import PyPDF2
+import importlib
+import sqlite3
+import threading
+import importlib.util
 from io import BytesIO
 from fastapi import FastAPI, HTTPException, Request, Depends, UploadFile, File
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import List, Optional
-try:
-    from smolagents import LiteLLMModel, CodeAgent
-    SMOLAGENTS_AVAILABLE = True
-except ImportError:
-    SMOLAGENTS_AVAILABLE = False
+import base_dados
+from base_dados import (obter_conexao, abrir_conexao, transacao, fechar_conexoes, na_thread_db,
+                        consultar, consultar_um, executar, aplicar_migracoes, adicionar_coluna, FilaEscrita,
+                        versao_bd, CacheCoerente, adquirir_lider)
+import revisoes
+import backups
+
+# --- DEPENDÊNCIAS PESADAS / OPCIONAIS ---
+# Importadas só no primeiro uso (arranque e reinício de workers mais rápidos). A disponibilidade
+# vê-se com find_spec, sem importar o módulo só para o testar.
+DEPENDENCIAS_OPCIONAIS = {
+    "smolagents": "Agentes (CodeAgent / LiteLLMModel)",
+    "litellm": "Fallback direto para provedores cloud",
+    "numpy": "Similaridade de embeddings (RAG)",
+    "PyPDF2": "Upload de PDFs para a Forja",
+    "deep_translator": "Tradução via Google",
+    "httpx": "Chamadas ao Ollama e APIs externas",
+}
+_tempos_import = {}  # módulo -> ms gastos no primeiro import
+
+def dependencia_disponivel(modulo: str) -> bool:
+    return modulo in sys.modules or importlib.util.find_spec(modulo) is not None
+
+def carregar(modulo: str):
+    """Importa (uma vez) uma dependência pesada e regista quanto custou."""
+    if modulo not in sys.modules:
+        inicio = time.perf_counter()
+        importlib.import_module(modulo)
+        _tempos_import[modulo] = round((time.perf_counter() - inicio) * 1000, 1)
+    return sys.modules[modulo]
+
+def cliente_http(**opcoes):
+    return carregar("httpx").AsyncClient(**opcoes)
+
+def cliente_http_sincrono(**opcoes):
+    return carregar("httpx").Client(**opcoes)
+
+SMOLAGENTS_AVAILABLE = dependencia_disponivel("smolagents")
 
 
 # --- CONFIGURAÇÕES ---
-if os.environ.get("VERCEL"):
-    DB_PATH = "/tmp/carpintaria.db"
-else:
-    DB_PATH = "carpintaria.db"
 OLLAMA_URL = "http://localhost:11434"
+# Modo serverless (Vercel): a BD parte de uma semente pré-construída em vez de correr as migrações todas
+SERVERLESS = bool(os.environ.get("VERCEL") or os.environ.get("CARPINTARIA_SERVERLESS"))
+DB_SEMENTE = os.environ.get("DB_SEMENTE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "api", "carpintaria_seed.db"))
+CHAT_BATCH_MAX_CONCORRENCIA = int(os.environ.get("CHAT_BATCH_MAX_CONCORRENCIA", "8"))
+
+# Servidor: WEB_WORKERS > 1 (ou --workers N) arranca vários processos uvicorn sobre a mesma BD em WAL.
+# Filas, limites de concorrência LLM e caches passam a ser por worker; as caches seguem a BD (VersaoBD).
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+WEB_PORTA = int(os.environ.get("WEB_PORTA", "8000"))
+
+# Controlo de admissão das chamadas LLM
+LLM_MAX_CONCORRENCIA = int(os.environ.get("LLM_MAX_CONCORRENCIA", "2"))
+LLM_MAX_FILA = int(os.environ.get("LLM_MAX_FILA", "32"))
+LLM_PRAZO_ESPERA = float(os.environ.get("LLM_PRAZO_ESPERA", "30"))  # segundos
+
+# Warm pool do Ollama: modelos pré-carregados no arranque e mantidos em RAM
+OLLAMA_WARM_MODELS = [m.strip() for m in os.environ.get("OLLAMA_WARM_MODELS", "").split(",") if m.strip()]
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_WARM_INTERVAL = int(os.environ.get("OLLAMA_WARM_INTERVAL", "120"))  # segundos entre verificações
+OLLAMA_MAX_RAM_GB = float(os.environ.get("OLLAMA_MAX_RAM_GB", "0"))  # 0 = sem limite
 
 def init_db():
-    """Inicializa a base de dados SQLite se não existir."""
-    conn = sqlite3.connect(DB_PATH)
+    """Inicializa a base de dados SQLite: aplica as migrações pendentes e os dados iniciais."""
+    aplicadas = aplicar_migracoes(MIGRACOES)
+    if aplicadas:
+        print(f"Migrações aplicadas: {aplicadas}")
+
+    with transacao() as conn:
+        cursor = conn.cursor()
+        # Dados Iniciais (Opcional)
+        cursor.execute("SELECT COUNT(*) FROM crm")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute("INSERT INTO crm (nome, status) VALUES ('Admin Carpintaria', 'Master')")
+
+def _migracao_tabelas_base(conn):
     cursor = conn.cursor()
-    
     # Tabela CRM
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS crm (
@@ -84,19 +154,241 @@ def init_db():
         )
     ''')
     
-    # Dados Iniciais (Opcional)
-    cursor.execute("SELECT COUNT(*) FROM crm")
-    if cursor.fetchone()[0] == 0:
-        cursor.execute("INSERT INTO crm (nome, status) VALUES ('Admin Carpintaria', 'Master')")
-    
-    conn.commit()
-    conn.close()
+    # Cache de roteiros do Ateliê (chave = hash do provider/modelo/conteúdo)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS roteiros_cache (
+            hash TEXT PRIMARY KEY,
+            model TEXT,
+            roteiro TEXT,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Cache de traduções (por origem, destino e hash do texto)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS traducoes_cache (
+            source TEXT NOT NULL,
+            target TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            traducao TEXT,
+            backend TEXT,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (source, target, hash)
+        )
+    ''')
+
+    # Registo de Uso LLM (uma linha por pedido de chat)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS uso_llm (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            provider TEXT,
+            model_id TEXT,
+            agente TEXT,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            cached_tokens INTEGER,
+            embedding_ms REAL,
+            retrieval_ms REAL,
+            fila_ms REAL,
+            ttft_ms REAL,
+            total_ms REAL,
+            fallback INTEGER DEFAULT 0,
+            erro TEXT,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+# Contadores do dashboard: (nome, tabela, condição sobre a linha) — a condição usa NEW/OLD.
+CONTADORES = [
+    ("crm_total", "crm", None),
+    # IS NOT: um projeto sem status (NULL) conta como ativo e a condição nunca dá NULL
+    ("projetos_ativos", "projetos", "{r}.status IS NOT 'Concluído'"),
+    ("documentos_total", "documentos", None),
+    ("conhecimento_total", "conhecimento", None),
+]
+
+def _migracao_contadores(conn):
+    """Tabela de contadores + triggers que a mantêm; '_versao' sobe a cada alteração (para since=)."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS contadores (
+            nome TEXT PRIMARY KEY,
+            valor INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO contadores (nome, valor) VALUES ('_versao', 0)")
+    for nome, tabela, condicao in CONTADORES:
+        where_atual = f" WHERE {condicao.format(r=tabela)}" if condicao else ""
+        conn.execute(
+            f"INSERT OR REPLACE INTO contadores (nome, valor) SELECT ?, COUNT(*) FROM {tabela}{where_atual}", (nome,)
+        )
+        versao = "UPDATE contadores SET valor = valor + 1 WHERE nome = '_versao';"
+        for evento, linha, delta in (("INSERT", "NEW", "+ 1"), ("DELETE", "OLD", "- 1")):
+            quando = f" WHEN {condicao.format(r=linha)}" if condicao else ""
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{nome}_{evento.lower()} AFTER {evento} ON {tabela}{quando}
+                BEGIN
+                    UPDATE contadores SET valor = valor {delta} WHERE nome = '{nome}';
+                    {versao}
+                END
+            ''')
+        if condicao:
+            # A linha pode entrar ou sair da condição numa atualização
+            novo, antigo = condicao.format(r="NEW"), condicao.format(r="OLD")
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{nome}_update AFTER UPDATE ON {tabela}
+                WHEN ({novo}) IS NOT ({antigo})
+                BEGIN
+                    UPDATE contadores SET valor = valor + (CASE WHEN {novo} THEN 1 ELSE -1 END) WHERE nome = '{nome}';
+                    {versao}
+                END
+            ''')
+
+def _migracao_contadores_null(conn):
+    """Recria os triggers de projetos_ativos com IS NOT (status NULL) e volta a contar tudo."""
+    for evento in ("insert", "delete", "update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_projetos_ativos_{evento}")
+    _migracao_contadores(conn)
+
+def _migracao_revisoes(conn):
+    """Corpo dos documentos comprimido + tabela com a cadeia de revisões (ver revisoes.py)."""
+    for coluna, tipo in (("conteudo_z", "BLOB"), ("tamanho", "INTEGER"), ("revisao_atual", "INTEGER")):
+        adicionar_coluna("documentos", coluna, tipo)(conn)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS documentos_revisoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            documento_id INTEGER NOT NULL REFERENCES documentos(id) ON DELETE CASCADE,
+            numero INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            dados BLOB,
+            base_id INTEGER,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_revisoes_documento ON documentos_revisoes (documento_id, id DESC)")
+    revisoes.migrar_documentos(conn)
+
+# Sincronização incremental (PWA): tabelas seguidas e campos enviados em cada alteração
+SYNC_TABELAS = {
+    "crm": ["id", "nome", "email", "telefone", "empresa", "status", "criado_em"],
+    "projetos": ["id", "titulo", "descricao", "progresso", "status", "criado_em"],
+    # O corpo dos documentos não viaja no sync: o cliente pede-o a /api/docs/ler se precisar
+    "documentos": ["id", "filename", "titulo", "categoria", "tamanho", "revisao_atual", "atualizado_em"],
+    "conhecimento": ["id", "titulo", "tipo", "criado_em"],
+}
+
+def _migracao_sync(conn):
+    """Registo de alterações (uma linha por registo, com a última operação) mantido por triggers.
+
+    seq é a marca d'água: cresce a cada alteração e o cliente guarda a última que viu.
+    Apagar deixa uma tombstone (operacao 'd') até ser purgada por antiguidade.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS alteracoes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabela TEXT NOT NULL,
+            linha_id INTEGER NOT NULL,
+            operacao TEXT NOT NULL,
+            em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (tabela, linha_id)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_alteracoes_tombstones ON alteracoes (em) WHERE operacao = 'd'")
+    conn.execute("INSERT OR IGNORE INTO contadores (nome, valor) VALUES ('_sync_purgado', 0)")
+    for tabela in SYNC_TABELAS:
+        conn.execute(f"INSERT OR IGNORE INTO alteracoes (tabela, linha_id, operacao) SELECT '{tabela}', id, 'u' FROM {tabela}")
+        for evento, linha, operacao in (("INSERT", "NEW", "u"), ("UPDATE", "NEW", "u"), ("DELETE", "OLD", "d")):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_sync_{tabela}_{evento.lower()} AFTER {evento} ON {tabela}
+                BEGIN
+                    INSERT OR REPLACE INTO alteracoes (tabela, linha_id, operacao) VALUES ('{tabela}', {linha}.id, '{operacao}');
+                END
+            ''')
+
+# Migrações versionadas (nunca editar uma já publicada: acrescentar uma nova no fim).
+# Cada passo é uma lista de SQL ou uma função que recebe a ligação.
+MIGRACOES = [
+    (1, "tabelas base", _migracao_tabelas_base),
+    (2, "uso_llm.cached_tokens", adicionar_coluna("uso_llm", "cached_tokens", "INTEGER")),
+    (3, "índices de listagem e dashboard", [
+        # Listagem da Oficina (ORDER BY atualizado_em DESC) servida só pelo índice
+        "CREATE INDEX IF NOT EXISTS idx_documentos_atualizado ON documentos (atualizado_em DESC, filename, titulo, categoria)",
+        # Listagem da Forja (ORDER BY criado_em DESC)
+        "CREATE INDEX IF NOT EXISTS idx_conhecimento_criado ON conhecimento (criado_em DESC, id, titulo, tipo)",
+        # Contagem de projetos ativos (WHERE status != 'Concluído')
+        "CREATE INDEX IF NOT EXISTS idx_projetos_ativos ON projetos (status) WHERE status != 'Concluído'",
+        # Agregados do registo de uso por dia/modelo
+        "CREATE INDEX IF NOT EXISTS idx_uso_llm_criado ON uso_llm (criado_em, model_id)",
+    ]),
+    (4, "índices keyset (tempo, id) para as listagens paginadas", [
+        "DROP INDEX IF EXISTS idx_documentos_atualizado",
+        "CREATE INDEX IF NOT EXISTS idx_documentos_keyset ON documentos (atualizado_em DESC, id DESC, filename, titulo, categoria)",
+        "DROP INDEX IF EXISTS idx_conhecimento_criado",
+        "CREATE INDEX IF NOT EXISTS idx_conhecimento_keyset ON conhecimento (criado_em DESC, id DESC, titulo, tipo)",
+    ]),
+    (5, "contadores do dashboard mantidos por triggers", _migracao_contadores),
+    (6, "índices e pesquisa FTS do CRM", [
+        "CREATE INDEX IF NOT EXISTS idx_crm_keyset ON crm (criado_em DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_crm_status ON crm (status, criado_em DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_crm_empresa ON crm (empresa, criado_em DESC, id DESC)",
+        # Índice FTS5 (só prefixos de nome/empresa) sincronizado por triggers
+        "CREATE VIRTUAL TABLE IF NOT EXISTS crm_fts USING fts5(nome, empresa, content='crm', content_rowid='id', prefix='2 3')",
+        "INSERT INTO crm_fts (crm_fts) VALUES ('rebuild')",
+        """CREATE TRIGGER IF NOT EXISTS trg_crm_fts_insert AFTER INSERT ON crm BEGIN
+               INSERT INTO crm_fts (rowid, nome, empresa) VALUES (NEW.id, NEW.nome, NEW.empresa);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_crm_fts_delete AFTER DELETE ON crm BEGIN
+               INSERT INTO crm_fts (crm_fts, rowid, nome, empresa) VALUES ('delete', OLD.id, OLD.nome, OLD.empresa);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_crm_fts_update AFTER UPDATE OF nome, empresa ON crm BEGIN
+               INSERT INTO crm_fts (crm_fts, rowid, nome, empresa) VALUES ('delete', OLD.id, OLD.nome, OLD.empresa);
+               INSERT INTO crm_fts (rowid, nome, empresa) VALUES (NEW.id, NEW.nome, NEW.empresa);
+           END""",
+    ]),
+    (7, "documentos comprimidos com histórico de revisões", _migracao_revisoes),
+    (8, "registo de alterações para sync incremental", _migracao_sync),
+    (9, "pesquisa FTS dos documentos", [
+        # O corpo está comprimido: o índice lê-o através de uma view que o descomprime
+        """CREATE VIEW IF NOT EXISTS documentos_texto AS
+               SELECT id, titulo, zlib_texto(conteudo_z) AS conteudo, categoria FROM documentos""",
+        """CREATE VIRTUAL TABLE IF NOT EXISTS documentos_fts USING fts5(
+               titulo, conteudo, categoria, content='documentos_texto', content_rowid='id',
+               tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+           )""",
+        "INSERT INTO documentos_fts (documentos_fts) VALUES ('rebuild')",
+        """CREATE TRIGGER IF NOT EXISTS trg_documentos_fts_insert AFTER INSERT ON documentos BEGIN
+               INSERT INTO documentos_fts (rowid, titulo, conteudo, categoria)
+               VALUES (NEW.id, NEW.titulo, zlib_texto(NEW.conteudo_z), NEW.categoria);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_documentos_fts_delete AFTER DELETE ON documentos BEGIN
+               INSERT INTO documentos_fts (documentos_fts, rowid, titulo, conteudo, categoria)
+               VALUES ('delete', OLD.id, OLD.titulo, zlib_texto(OLD.conteudo_z), OLD.categoria);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_documentos_fts_update AFTER UPDATE OF titulo, conteudo_z, categoria ON documentos
+           BEGIN
+               INSERT INTO documentos_fts (documentos_fts, rowid, titulo, conteudo, categoria)
+               VALUES ('delete', OLD.id, OLD.titulo, zlib_texto(OLD.conteudo_z), OLD.categoria);
+               INSERT INTO documentos_fts (rowid, titulo, conteudo, categoria)
+               VALUES (NEW.id, NEW.titulo, zlib_texto(NEW.conteudo_z), NEW.categoria);
+           END""",
+    ]),
+    (10, "contador de versão da Forja (índice de embeddings de cada worker)", [
+        "INSERT OR IGNORE INTO contadores (nome, valor) VALUES ('_versao_conhecimento', 0)",
+    ] + [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_versao_conhecimento_{evento.lower()} AFTER {evento} ON conhecimento BEGIN
+               UPDATE contadores SET valor = valor + 1 WHERE nome = '_versao_conhecimento';
+           END"""
+        for evento in ("INSERT", "UPDATE", "DELETE")
+    ]),
+    (11, "contador de projetos ativos com status NULL", _migracao_contadores_null),
+    # Os ativos contam-se em 'contadores'; o índice parcial já não servia nenhuma query
+    (12, "remove idx_projetos_ativos", ["DROP INDEX IF EXISTS idx_projetos_ativos"]),
+]
 
 # --- HELPERS ---
 async def get_embedding(text: str):
     """Gera embeddings usando o motor Ollama local."""
     try:
-        async with httpx.AsyncClient() as client:
+        async with cliente_http() as client:
             res = await client.post(
                 f"{OLLAMA_URL}/api/embeddings",
                 json={
@@ -114,6 +406,7 @@ async def get_embedding(text: str):
 def cosine_similarity(v1, v2):
     """Calcula a similaridade de cosseno entre dois vetores."""
     if not v1 or not v2: return 0
+    np = carregar("numpy")
     a = np.array(v1)
     b = np.array(v2)
     norm_a = np.linalg.norm(a)
@@ -121,6 +414,91 @@ def cosine_similarity(v1, v2):
     if norm_a == 0 or norm_b == 0: return 0
     return np.dot(a, b) / (norm_a * norm_b)
 
+class RegistoUso:
+    """Escritor com buffer para a tabela uso_llm: agrupa linhas e grava-as numa só transação."""
+    COLUNAS = ("provider", "model_id", "agente", "prompt_tokens", "completion_tokens", "cached_tokens", "embedding_ms",
+               "retrieval_ms", "fila_ms", "ttft_ms", "total_ms", "fallback", "erro", "criado_em")
+
+    def __init__(self, max_buffer: int = 50, intervalo: float = 5.0):
+        self.max_buffer = max_buffer
+        self.intervalo = intervalo
+        self.buffer = []
+
+    def registar(self, metricas: dict):
+        linha = dict(metricas, criado_em=datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
+        self.buffer.append(tuple(linha.get(c) for c in self.COLUNAS))
+        if len(self.buffer) >= self.max_buffer:
+            em_fundo(self.despejar())
+
+    def _gravar(self, linhas):
+        with transacao() as conn:
+            conn.executemany(
+                f"INSERT INTO uso_llm ({', '.join(self.COLUNAS)}) VALUES ({', '.join('?' * len(self.COLUNAS))})",
+                linhas
+            )
+
+    async def despejar(self):
+        linhas, self.buffer = self.buffer, []
+        if not linhas:
+            return
+        try:
+            await na_thread_db(self._gravar, linhas)
+        except Exception as e:
+            print(f"Erro ao gravar registo de uso: {e}")
+
+    async def ciclo(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            await self.despejar()
+
+registo_uso = RegistoUso()
+
+# O event loop só guarda referências fracas às tarefas: sem esta referência, uma tarefa
+# de fundo pode ser recolhida pelo garbage collector a meio
+_tarefas_fundo = set()
+
+def em_fundo(coro) -> asyncio.Task:
+    """create_task para tarefas de fundo, mantendo-as vivas até terminarem."""
+    tarefa = asyncio.create_task(coro)
+    _tarefas_fundo.add(tarefa)
+    tarefa.add_done_callback(_tarefas_fundo.discard)
+    return tarefa
+
+# Inserções de alta frequência (leads, conhecimento): group commit opcional (DB_GRUPO_ATIVO=1)
+fila_escrita = FilaEscrita()
+
+def percentil(valores, p):
+    """Percentil por interpolação linear (valores já ordenados)."""
+    if not valores:
+        return None
+    k = (len(valores) - 1) * p
+    f = math.floor(k)
+    c = min(f + 1, len(valores) - 1)
+    return round(valores[f] + (valores[c] - valores[f]) * (k - f), 1)
+
+def gerar_semente(destino: str = DB_SEMENTE):
+    """Constrói a BD semente do modo serverless (schema + dados iniciais, já compactada)."""
+    temporario = f"{destino}.tmp"
+    if os.path.exists(temporario):
+        os.remove(temporario)
+    original = base_dados.DB_PATH
+    base_dados.DB_PATH = temporario
+    try:
+        init_db()
+        conn = obter_conexao()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+    finally:
+        fechar_conexoes()
+        base_dados.DB_PATH = original
+    for sufixo in ("-wal", "-shm"):
+        if os.path.exists(temporario + sufixo):
+            os.remove(temporario + sufixo)
+    os.replace(temporario, destino)
+    print(f"Semente gerada: {destino} ({os.path.getsize(destino)} bytes)")
+
+if SERVERLESS and base_dados.restaurar_semente(DB_SEMENTE):
+    print(f"BD restaurada da semente {DB_SEMENTE}")
 init_db()
 
 app = FastAPI(title="Carpintaria OS 2026")
@@ -142,6 +520,17 @@ class ChatMessage(BaseModel):
     api_key: Optional[str] = ""
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = 2048
+    executar_ferramentas: Optional[bool] = False
+
+class ChatBatchRequest(BaseModel):
+    mensagens: List[str]
+    agente: Optional[str] = "consultor"
+    model: Optional[str] = "llama3"
+    provider: Optional[str] = "gemini"
+    api_key: Optional[str] = ""
+    temperature: Optional[float] = 0.7
+    max_tokens: Optional[int] = 2048
+    concorrencia: Optional[int] = 4
 
 class LoginRequest(BaseModel):
     username: Optional[str] = "admin"
@@ -152,6 +541,17 @@ class TranslationRequest(BaseModel):
     source: Optional[str] = "auto"
     target: str
 
+class TranslationBatchRequest(BaseModel):
+    textos: List[str]
+    source: Optional[str] = "auto"
+    target: str
+
+class DocumentTranslationRequest(BaseModel):
+    texto: str
+    source: Optional[str] = "auto"
+    target: str
+    modo: Optional[str] = "paragrafo"  # 'paragrafo' ou 'frase'
+
 class DocSave(BaseModel):
     filename: Optional[str] = None
     titulo: str
@@ -159,6 +559,19 @@ class DocSave(BaseModel):
     categoria: str
     metadata: Optional[str] = "{}"
 
+class EdicaoTexto(BaseModel):
+    pos: int           # posição em caracteres no texto (já com as edições anteriores aplicadas)
+    apagar: int = 0    # caracteres a remover a partir de pos
+    inserir: str = ""
+
+class DocPatch(BaseModel):
+    filename: str
+    base_revisao: int
+    edicoes: List[EdicaoTexto]
+    titulo: Optional[str] = None
+    categoria: Optional[str] = None
+    metadata: Optional[str] = None
+
 # Routes for HTML pages
 @app.get("/sw.js")
 async def get_sw():
@@ -168,61 +581,97 @@ async def get_sw():
 async def get_manifest():
     return FileResponse("static/manifest.json", media_type="application/json")
 
+# O HTML vem do disco e não da BD: cada worker guarda-o em memória e relê-o só quando o
+# ficheiro muda (mtime/tamanho), o que vale igualmente para todos os workers
+_cache_paginas = {}  # caminho -> (mtime_ns, tamanho, html)
+
+def ler_pagina(caminho: str, erro: str) -> str:
+    try:
+        info = os.stat(caminho)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=erro)
+    em_cache = _cache_paginas.get(caminho)
+    if em_cache and em_cache[:2] == (info.st_mtime_ns, info.st_size):
+        return em_cache[2]
+    with open(caminho, "r", encoding="utf-8") as f:
+        html = f.read()
+    _cache_paginas[caminho] = (info.st_mtime_ns, info.st_size, html)
+    return html
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
-    with open("static/Entrada.html", "r", encoding="utf-8") as f:
-        return f.read()
+    return ler_pagina("static/Entrada.html", "Entrada file not found")
 
 @app.get("/office", response_class=HTMLResponse)
 async def read_office():
-    with open("static/Escritorio.html", "r", encoding="utf-8") as f:
-        return f.read()
+    return ler_pagina("static/Escritorio.html", "Office file not found")
 
 @app.get("/store", response_class=HTMLResponse)
 async def read_store():
-    if os.path.exists("static/dumbanengue.html"):
-        with open("static/dumbanengue.html", "r", encoding="utf-8") as f:
-            return f.read()
-    raise HTTPException(status_code=404, detail="Store file not found")
+    return ler_pagina("static/dumbanengue.html", "Store file not found")
 
 @app.get("/studio", response_class=HTMLResponse)
 async def read_studio():
-    if os.path.exists("static/Studio.html"):
-        with open("static/Studio.html", "r", encoding="utf-8") as f:
-            return f.read()
-    raise HTTPException(status_code=404, detail="Studio file not found")
+    return ler_pagina("static/Studio.html", "Studio file not found")
 
 @app.get("/academy", response_class=HTMLResponse)
 async def read_academy():
-    if os.path.exists("static/Academy.html"):
-        with open("static/Academy.html", "r", encoding="utf-8") as f:
-            return f.read()
-    raise HTTPException(status_code=404, detail="Academy file not found")
+    return ler_pagina("static/Academy.html", "Academy file not found")
 
 @app.get("/tradutor", response_class=HTMLResponse)
 async def read_tradutor():
-    if os.path.exists("static/Tradutor.html"):
-        with open("static/Tradutor.html", "r", encoding="utf-8") as f:
-            return f.read()
-    raise HTTPException(status_code=404, detail="Tradutor file not found")
-
-# API Endpoints
-@app.post("/api/chat")
-async def api_chat(chat: ChatMessage):
-    provider = chat.provider.lower()
-    model_name = chat.model # Hugging Face é case-sensitive
-    
-    # Instruções de Sistema específicas
-    system_instr = ""
-    if chat.agente == "dev":
-        system_instr = """És o Carpinteiro Digital (Senior Dev). Tens acesso a FERRAMENTAS:
+    return ler_pagina("static/Tradutor.html", "Tradutor file not found")
+
+def _carregar_indice_embeddings(conn) -> dict:
+    """Índice da Forja em memória: por dimensão, a matriz de embeddings já normalizados e os textos."""
+    np = carregar("numpy")
+    grupos = {}
+    for conteudo, embedding in conn.execute("SELECT conteudo, embedding FROM conhecimento WHERE embedding IS NOT NULL"):
+        vetor = json.loads(embedding)
+        if vetor:
+            vetores, textos = grupos.setdefault(len(vetor), ([], []))
+            vetores.append(vetor)
+            textos.append(conteudo)
+    indice = {}
+    for dimensao, (vetores, textos) in grupos.items():
+        matriz = np.array(vetores, dtype=np.float32)
+        normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+        normas[normas == 0] = 1  # vetor nulo fica com score 0
+        indice[dimensao] = (matriz / normas, textos)
+    return indice
+
+# Só é reconstruído quando a Forja muda (contador mantido pelos triggers da migração 10)
+_indice_embeddings = CacheCoerente(
+    versao_bd, _carregar_indice_embeddings,
+    chave="SELECT valor FROM contadores WHERE nome = '_versao_conhecimento'"
+)
+
+def _buscar_contexto_rag(query_embed) -> str:
+    """Procura na Forja de Conhecimento os 3 trechos mais próximos do embedding da pergunta."""
+    np = carregar("numpy")
+    matriz, textos = _indice_embeddings.obter_sincrono().get(len(query_embed), (None, None))
+    pergunta = np.array(query_embed, dtype=np.float32)
+    norma = np.linalg.norm(pergunta)
+    if matriz is None or norma == 0:
+        return ""
+    scores = matriz @ (pergunta / norma)
+    # Ordenar por score e pegar os melhores acima do threshold de relevância
+    melhores = [i for i in np.argsort(-scores)[:3] if scores[i] > 0.4]
+    if melhores:
+        return "\n\n[CONTEXTO DA FORJA DE CONHECIMENTO]:\n" + "\n---\n".join([textos[i] for i in melhores])
+    return ""
+
+# --- INSTRUÇÕES DOS AGENTES ---
+# Texto fixo por agente: vai sempre primeiro e sem alterações, para formar um prefixo
+# idêntico entre pedidos e beneficiar da cache de prompt do provedor (e do KV do Ollama)
+AGENTE_INSTRUCOES = {
+    "dev": """És o Carpinteiro Digital (Senior Dev). Tens acesso a FERRAMENTAS:
         - Para executar Python: @@EXECUTE_PYTHON[teu_codigo]@@
         - Para salvar arquivos: @@WRITE_FILE[nome.ext|||conteudo]@@
         - Para ler arquivos: @@READ_FILE[nome.ext]@@
         Sempre que precisares de testar código ou salvar um projeto, usa estes comandos no teu output.
-        """
-    elif chat.agente == "sac":
-        system_instr = """És o Assistente Virtual da Carpintaria Digital.
+        """,
+    "sac": """És o Assistente Virtual da Carpintaria Digital.
         O TEU OBJETIVO: Ajudar clientes a navegar no ecossistema Dumbanengue e tirar dúvidas sobre a Carpintaria Digital.
         
         REGRAS RÍGIDAS:
@@ -230,43 +679,197 @@ async def api_chat(chat: ChatMessage):
         2. Se o utilizador perguntar algo fora deste contexto, responde educadamente: "Peço desculpa, mas como assistente da Carpintaria Digital, apenas posso ajudar em questões relacionadas com o nosso sistema e serviços. Como posso ajudar com os nossos produtos?"
         3. Mantém um tom profissional, prestativo e moderno.
         4. Nunca inventes chaves de API ou dados de contacto que não conheças.
-        """
+        """,
+}
+
+def montar_mensagens(agente: str, contexto: str, mensagem: str) -> list:
+    """Mensagens por ordem de estabilidade: instruções do agente, contexto RAG e, por fim, o pedido."""
+    mensagens = []
+    if AGENTE_INSTRUCOES.get(agente):
+        mensagens.append({"role": "system", "content": f"INSTRUTIVO: {AGENTE_INSTRUCOES[agente]}"})
+    if contexto:
+        mensagens.append({"role": "system", "content": f"CONTEXTO DA FORJA: {contexto}"})
+    mensagens.append({"role": "user", "content": mensagem})
+    return mensagens
+
+def prompt_unico(mensagens: list) -> str:
+    """Junta as mensagens num só texto (para quem só aceita um prompt), mantendo o prefixo fixo."""
+    return "\n\n".join(m["content"] for m in mensagens)
+
+# --- AGENDADOR LLM (CONTROLO DE ADMISSÃO) ---
+# Prioridade por agente (menor = mais urgente): o SAC atende clientes, o dev pode esperar
+AGENTE_PRIORIDADES = {"sac": 0, "consultor": 1, "professor": 1, "tutor": 1, "dev": 2, "atelie": 2, "precomputacao": 3}
+PRIORIDADE_PADRAO = 1
+
+class AgendadorLLM:
+    """Fila de prioridade com limite de concorrência à frente das chamadas aos modelos."""
+
+    def __init__(self, max_concorrencia: int, max_fila: int, prazo: float):
+        self.max_concorrencia = max_concorrencia
+        self.max_fila = max_fila
+        self.prazo = prazo
+        self.ativos = 0
+        self.fila = []  # heap de (prioridade, seq, future)
+        self._seq = itertools.count()
+        self.duracao_media = 5.0  # média móvel (s) de cada geração, para estimar a espera
+        self.stats = {"admitidos": 0, "rejeitados": 0, "expirados": 0, "desalojados": 0, "fila_total_ms": 0.0}
+
+    def espera_estimada(self, prioridade: int) -> float:
+        a_frente = sum(1 for p, _, f in self.fila if p <= prioridade and not f.done())
+        if self.ativos < self.max_concorrencia and a_frente == 0:
+            return 0.0
+        return (a_frente + 1) * self.duracao_media / self.max_concorrencia
+
+    def _rejeitar(self, status: int, motivo: str, espera: float):
+        self.stats["rejeitados"] += 1
+        raise HTTPException(
+            status_code=status,
+            detail=motivo,
+            headers={"Retry-After": str(max(1, math.ceil(espera)))}
+        )
 
+    def _desalojar(self, prioridade: int) -> bool:
+        """Fila cheia: um pedido mais prioritário fica com o lugar do mais antigo dos menos prioritários."""
+        candidatos = [item for item in self.fila if item[0] > prioridade and not item[2].done()]
+        if not candidatos:
+            return False
+        pior = max(item[0] for item in candidatos)
+        vitima = min((item for item in candidatos if item[0] == pior), key=lambda item: item[1])
+        self.fila.remove(vitima)
+        heapq.heapify(self.fila)
+        self.stats["desalojados"] += 1
+        self.stats["rejeitados"] += 1
+        vitima[2].set_exception(HTTPException(
+            status_code=503, detail="Lugar na fila LLM cedido a um pedido prioritário. Tenta novamente mais tarde.",
+            headers={"Retry-After": str(max(1, math.ceil(self.espera_estimada(pior))))}
+        ))
+        return True
+
+    def _libertar(self):
+        # Passa a vaga diretamente ao próximo da fila (sem decrementar ativos)
+        while self.fila:
+            _, _, fut = heapq.heappop(self.fila)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.ativos -= 1
+
+    @asynccontextmanager
+    async def admitir(self, agente: str):
+        prioridade = AGENTE_PRIORIDADES.get(agente, PRIORIDADE_PADRAO)
+        inicio = time.perf_counter()
+        if self.ativos < self.max_concorrencia and not self.fila:
+            self.ativos += 1
+        else:
+            espera = self.espera_estimada(prioridade)
+            if len(self.fila) >= self.max_fila and not self._desalojar(prioridade):
+                self._rejeitar(503, "Fila de pedidos LLM cheia. Tenta novamente mais tarde.", espera)
+            if espera > self.prazo:
+                self._rejeitar(429, f"Espera estimada de {espera:.0f}s excede o prazo de {self.prazo:.0f}s.", espera)
+            fut = asyncio.get_running_loop().create_future()
+            heapq.heappush(self.fila, (prioridade, next(self._seq), fut))
+            try:
+                await asyncio.wait_for(fut, timeout=self.prazo)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if fut.done() and not fut.cancelled():
+                    self._libertar()  # a vaga chegou em simultâneo: devolve-a
+                else:
+                    self.fila = [item for item in self.fila if item[2] is not fut]
+                    heapq.heapify(self.fila)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self.stats["expirados"] += 1
+                self._rejeitar(503, "Tempo de espera na fila LLM esgotado.", self.espera_estimada(prioridade))
+        fila_ms = round((time.perf_counter() - inicio) * 1000, 1)
+        self.stats["admitidos"] += 1
+        self.stats["fila_total_ms"] += fila_ms
+        inicio_execucao = time.perf_counter()
+        try:
+            yield fila_ms
+        finally:
+            duracao = time.perf_counter() - inicio_execucao
+            self.duracao_media = 0.8 * self.duracao_media + 0.2 * duracao
+            self._libertar()
+
+agendador_llm = AgendadorLLM(LLM_MAX_CONCORRENCIA, LLM_MAX_FILA, LLM_PRAZO_ESPERA)
+
+# API Endpoints
+async def executar_chat(chat: ChatMessage) -> dict:
+    """Pipeline de chat (RAG + provedor) partilhado por /api/chat e /api/chat/batch."""
+    metricas = {
+        "provider": (chat.provider or "").lower(),
+        "model_id": chat.model,
+        "agente": chat.agente,
+        "fallback": False
+    }
+    inicio = time.perf_counter()
+    try:
+        return await _pipeline_chat(chat, metricas)
+    except Exception as e:
+        metricas["erro"] = str(e)[:500]
+        raise
+    finally:
+        metricas["total_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+        registo_uso.registar(metricas)
+
+async def _pipeline_chat(chat: ChatMessage, metricas: dict) -> dict:
+    provider = chat.provider.lower()
+    model_name = chat.model # Hugging Face é case-sensitive
+    
     # RAG Semântico: Se o agente for professor/tutor, procurar no conhecimento
     contexto = ""
     if chat.agente in ["professor", "tutor"]:
         try:
+            t0 = time.perf_counter()
             query_embed = await get_embedding(chat.mensagem)
+            metricas["embedding_ms"] = round((time.perf_counter() - t0) * 1000, 1)
             if query_embed:
-                conn = sqlite3.connect(DB_PATH)
-                cursor = conn.cursor()
-                cursor.execute("SELECT titulo, conteudo, embedding FROM conhecimento")
-                rows = cursor.fetchall()
-                
-                scored_chunks = []
-                for row in rows:
-                    if row[2]: # Se houver embedding
-                        chunk_embed = json.loads(row[2])
-                        score = cosine_similarity(query_embed, chunk_embed)
-                        if score > 0.4: # Threshold de relevância
-                            scored_chunks.append((score, row[1]))
-                
-                # Ordenar por score e pegar os melhores
-                scored_chunks.sort(key=lambda x: x[0], reverse=True)
-                if scored_chunks:
-                    contexto = "\n\n[CONTEXTO DA FORJA DE CONHECIMENTO]:\n" + "\n---\n".join([c[1] for c in scored_chunks[:3]])
-                conn.close()
+                t0 = time.perf_counter()
+                # Leitura e scoring no pool da BD: não bloqueia o event loop
+                contexto = await na_thread_db(_buscar_contexto_rag, query_embed)
+                metricas["retrieval_ms"] = round((time.perf_counter() - t0) * 1000, 1)
         except Exception as e:
             print(f"Erro no RAG Semântico: {e}")
             pass
 
-    # Prompt Final com Instruções e Contexto
-    prompt_final = chat.mensagem
-    if system_instr:
-        prompt_final = f"INSTRUTIVO: {system_instr}\n\n{prompt_final}"
-    if contexto:
-        prompt_final = f"CONTEXTO DA FORJA: {contexto}\n\n{prompt_final}"
-
+    mensagens = montar_mensagens(chat.agente, contexto, chat.mensagem)
+
+    async with agendador_llm.admitir(chat.agente) as fila_ms:
+        metricas["fila_ms"] = fila_ms
+        resultado = await _gerar_resposta(chat, provider, model_name, mensagens, metricas)
+    resultado["fila_ms"] = fila_ms
+    if metricas.get("cached_tokens") is not None:
+        resultado["cached_tokens"] = metricas["cached_tokens"]
+
+    # Executa no servidor as ferramentas pedidas pelo agente dev (evita uma ida por marcador)
+    if chat.agente == "dev" and chat.executar_ferramentas:
+        resposta = resultado.get("resposta")
+        texto = resposta if isinstance(resposta, str) else getattr(resposta, "content", None) or str(resposta)
+        resultado["ferramentas"] = await executar_marcadores(texto)
+    return resultado
+
+def _tokens_smolagents(model, resposta):
+    """Extrai (prompt, completion) tokens de uma resposta smolagents, conforme a versão."""
+    uso = getattr(resposta, "token_usage", None)
+    if uso is not None:
+        return getattr(uso, "input_tokens", None), getattr(uso, "output_tokens", None)
+    return getattr(model, "last_input_token_count", None), getattr(model, "last_output_token_count", None)
+
+def _tokens_em_cache(res):
+    """Tokens do prompt servidos da cache do provedor (Gemini/OpenRouter via LiteLLM), se reportados."""
+    res = getattr(res, "raw", None) or res  # ChatMessage do smolagents guarda a resposta LiteLLM em .raw
+    uso = getattr(res, "usage", None)
+    if uso is None and isinstance(res, dict):
+        uso = res.get("usage")
+    detalhes = getattr(uso, "prompt_tokens_details", None) if uso is not None else None
+    if detalhes is None and isinstance(uso, dict):
+        detalhes = uso.get("prompt_tokens_details")
+    if detalhes is None:
+        return None
+    return detalhes.get("cached_tokens") if isinstance(detalhes, dict) else getattr(detalhes, "cached_tokens", None)
+
+async def _gerar_resposta(chat: ChatMessage, provider: str, model_name: str, mensagens: list, metricas: dict) -> dict:
+    """Chama o provedor escolhido (smolagents/LiteLLM, Ollama ou simulação)."""
     # --- EXECUÇÃO REAL VIA SMOLAGENTS (Se disponível) ---
     if SMOLAGENTS_AVAILABLE:
         try:
@@ -294,8 +897,10 @@ async def api_chat(chat: ChatMessage):
             print(f"--- IA Request ---")
             print(f"Provider: {provider}, Model: {model_id}")
             print(f"Params: temp={chat.temperature}, tokens={chat.max_tokens}")
+            metricas["model_id"] = model_id
 
-            model = LiteLLMModel(
+            smolagents = carregar("smolagents")
+            model = smolagents.LiteLLMModel(
                 model_id=model_id,
                 api_key=api_key_to_use,
                 api_base=base_url,
@@ -307,11 +912,16 @@ async def api_chat(chat: ChatMessage):
             # em modelos sensíveis que não lidam bem com o system prompt do CodeAgent
             if chat.agente != "dev":
                 # Simples Chat Completion via LiteLLMModel
-                response_text = model(messages=[{"role": "user", "content": prompt_final}])
+                response_text = await asyncio.to_thread(model, messages=mensagens)
+                metricas["cached_tokens"] = _tokens_em_cache(response_text)
             else:
                 # O Agente pode usar ferramentas (como a mão do carpinteiro)
-                agent = CodeAgent(model=model, tools=[], add_base_tools=False)
-                response_text = agent.run(prompt_final)
+                # O CodeAgent só aceita uma tarefa em texto: mantém-se a ordem instruções -> contexto -> pedido
+                agent = smolagents.CodeAgent(model=model, tools=[], add_base_tools=False)
+                response_text = await asyncio.to_thread(agent.run, prompt_unico(mensagens))
+            if provider == "local":
+                _ollama_ultimo_uso[_nome_modelo_ollama(model_id)] = datetime.now().timestamp()
+            metricas["prompt_tokens"], metricas["completion_tokens"] = _tokens_smolagents(model, response_text)
             
             return {
                 "resposta": response_text, 
@@ -322,15 +932,22 @@ async def api_chat(chat: ChatMessage):
             print(f"Erro no Agente: {e}")
             # Tentar fallback direto via litellm se o agente falhar
             try:
-                import litellm
-                res = litellm.completion(
+                litellm = carregar("litellm")
+                res = await asyncio.to_thread(
+                    litellm.completion,
                     model=model_id,
-                    messages=[{"role": "user", "content": prompt_final}],
+                    messages=mensagens,
                     api_key=api_key_to_use,
                     temperature=chat.temperature,
                     max_tokens=chat.max_tokens if chat.max_tokens > 0 else 2048
                 )
                 response_text = res.choices[0].message.content
+                metricas["fallback"] = True
+                uso = getattr(res, "usage", None)
+                if uso is not None:
+                    metricas["prompt_tokens"] = getattr(uso, "prompt_tokens", None)
+                    metricas["completion_tokens"] = getattr(uso, "completion_tokens", None)
+                metricas["cached_tokens"] = _tokens_em_cache(res)
                 return {
                     "resposta": response_text,
                     "agente": chat.agente,
@@ -345,13 +962,15 @@ async def api_chat(chat: ChatMessage):
     # --- FALLBACK PARA LÓGICA ANTIGA (Caso smolagents falhe ou local sem ele) ---
     if provider == "local":
         try:
-            async with httpx.AsyncClient() as client:
+            async with cliente_http() as client:
+                # /api/chat com mensagens separadas: o Ollama reaproveita o KV do prefixo de sistema
                 ollama_res = await client.post(
-                    f"{OLLAMA_URL}/api/generate",
+                    f"{OLLAMA_URL}/api/chat",
                     json={
                         "model": model_name,
-                        "prompt": prompt_final,
+                        "messages": mensagens,
                         "stream": False,
+                        "keep_alive": OLLAMA_KEEP_ALIVE,
                         "options": {
                             "temperature": chat.temperature,
                             "num_predict": chat.max_tokens
@@ -360,7 +979,14 @@ async def api_chat(chat: ChatMessage):
                     timeout=60.0
                 )
                 if ollama_res.status_code == 200:
-                    response_text = ollama_res.json().get("response", "")
+                    dados = ollama_res.json()
+                    response_text = dados.get("message", {}).get("content", "")
+                    metricas["model_id"] = f"ollama/{model_name}"
+                    metricas["prompt_tokens"] = dados.get("prompt_eval_count")
+                    metricas["completion_tokens"] = dados.get("eval_count")
+                    # Sem streaming, o TTFT é o carregamento do modelo + avaliação do prompt
+                    metricas["ttft_ms"] = round((dados.get("load_duration", 0) + dados.get("prompt_eval_duration", 0)) / 1e6, 1)
+                    _ollama_ultimo_uso[_nome_modelo_ollama(model_name)] = datetime.now().timestamp()
                 else:
                     response_text = f"[Ollama Error]: Status {ollama_res.status_code}"
         except Exception as e:
@@ -378,6 +1004,103 @@ async def api_chat(chat: ChatMessage):
         "model_used": f"{provider}:{model_name}"
     }
 
+@app.post("/api/chat")
+async def api_chat(chat: ChatMessage):
+    return await executar_chat(chat)
+
+@app.get("/api/llm/agendador")
+async def llm_agendador_status():
+    admitidos = agendador_llm.stats["admitidos"]
+    return {
+        "ativos": agendador_llm.ativos,
+        "em_fila": len(agendador_llm.fila),
+        "max_concorrencia": agendador_llm.max_concorrencia,
+        "max_fila": agendador_llm.max_fila,
+        "prazo_s": agendador_llm.prazo,
+        "duracao_media_s": round(agendador_llm.duracao_media, 2),
+        "fila_media_ms": round(agendador_llm.stats["fila_total_ms"] / admitidos, 1) if admitidos else 0,
+        **agendador_llm.stats
+    }
+
+@app.get("/api/llm/uso")
+async def llm_uso(dias: int = 7):
+    """Agrega o registo de uso por modelo e por dia (p50/p95 de latência, tokens, fallbacks)."""
+    await registo_uso.despejar()
+    linhas = await consultar('''
+        SELECT date(criado_em), model_id, total_ms, ttft_ms, fila_ms,
+               prompt_tokens, completion_tokens, cached_tokens, fallback, erro
+        FROM uso_llm WHERE criado_em >= datetime('now', ?)
+        ORDER BY criado_em
+    ''', (f"-{dias} days",))
+    grupos = {}
+    for dia, model_id, total, ttft, fila, p_tok, c_tok, cached, fallback, erro in linhas:
+        g = grupos.setdefault((dia, model_id), {"total": [], "ttft": [], "fila": [], "prompt_tokens": 0,
+                                                "completion_tokens": 0, "cached_tokens": 0,
+                                                "tokens_com_cache_reportada": 0, "fallbacks": 0, "erros": 0})
+        g["total"].append(total or 0)
+        if ttft is not None: g["ttft"].append(ttft)
+        if fila is not None: g["fila"].append(fila)
+        g["prompt_tokens"] += p_tok or 0
+        g["completion_tokens"] += c_tok or 0
+        if cached is not None:
+            g["cached_tokens"] += cached
+            g["tokens_com_cache_reportada"] += p_tok or 0
+        g["fallbacks"] += 1 if fallback else 0
+        g["erros"] += 1 if erro else 0
+
+    resultado = []
+    for (dia, model_id), g in sorted(grupos.items()):
+        total, ttft, fila = sorted(g["total"]), sorted(g["ttft"]), sorted(g["fila"])
+        resultado.append({
+            "dia": dia,
+            "model_id": model_id,
+            "pedidos": len(total),
+            "total_p50_ms": percentil(total, 0.5),
+            "total_p95_ms": percentil(total, 0.95),
+            "ttft_p50_ms": percentil(ttft, 0.5),
+            "ttft_p95_ms": percentil(ttft, 0.95),
+            "fila_p95_ms": percentil(fila, 0.95),
+            "prompt_tokens": g["prompt_tokens"],
+            "completion_tokens": g["completion_tokens"],
+            "cached_tokens": g["cached_tokens"],
+            # Só conta pedidos em que o provedor reporta cache (Gemini/OpenRouter)
+            "cache_hit_rate": round(g["cached_tokens"] / g["tokens_com_cache_reportada"], 3) if g["tokens_com_cache_reportada"] else None,
+            "fallbacks": g["fallbacks"],
+            "erros": g["erros"]
+        })
+    return resultado
+
+@app.post("/api/chat/batch")
+async def api_chat_batch(batch: ChatBatchRequest):
+    """Gera respostas para vários prompts em paralelo, devolvendo NDJSON à medida que terminam."""
+    if not batch.mensagens:
+        raise HTTPException(status_code=400, detail="Nenhuma mensagem fornecida")
+    concorrencia = max(1, min(batch.concorrencia or 1, CHAT_BATCH_MAX_CONCORRENCIA))
+    semaforo = asyncio.Semaphore(concorrencia)
+    base = batch.dict(exclude={"mensagens", "concorrencia"})
+
+    async def processar(indice: int, mensagem: str):
+        async with semaforo:
+            inicio = time.perf_counter()
+            try:
+                res = await executar_chat(ChatMessage(mensagem=mensagem, **base))
+                item = {"indice": indice, "sucesso": True, **res}
+            except Exception as e:
+                item = {"indice": indice, "sucesso": False, "erro": str(e)}
+            item["duracao_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+            return item
+
+    async def gerar():
+        tarefas = [asyncio.create_task(processar(i, m)) for i, m in enumerate(batch.mensagens)]
+        try:
+            for tarefa in asyncio.as_completed(tarefas):
+                yield json.dumps(await tarefa, ensure_ascii=False) + "\n"
+        finally:
+            for tarefa in tarefas:
+                tarefa.cancel()
+
+    return StreamingResponse(gerar(), media_type="application/x-ndjson")
+
 
 @app.post("/api/auth/login")
 async def api_login(auth: LoginRequest):
@@ -407,16 +1130,265 @@ async def list_files(path: str = "."):
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+# --- TRADUTOR ---
+TRADUTOR_BACKEND = os.environ.get("TRADUTOR_BACKEND", "google")  # google | ollama | dicionario
+TRADUTOR_MODELO_OLLAMA = os.environ.get("TRADUTOR_MODELO_OLLAMA", "llama3")
+TRADUTOR_DICIONARIO = os.environ.get("TRADUTOR_DICIONARIO", "")  # JSON {"pt>en": {"texto": "tradução"}}
+TRADUTOR_MAX_THREADS = int(os.environ.get("TRADUTOR_MAX_THREADS", "4"))
+_pool_traducao = ThreadPoolExecutor(max_workers=TRADUTOR_MAX_THREADS, thread_name_prefix="tradutor")
+
+class BackendGoogle:
+    """Google Translate via deep_translator (bloqueante, corre no pool de threads)."""
+    nome = "google"
+
+    def __init__(self):
+        # Um GoogleTranslator por thread: translate() guarda o texto no próprio objeto antes do
+        # pedido, por isso partilhá-lo entre as threads do pool trocaria as traduções
+        self._local = threading.local()
+
+    def traduzir(self, textos: list, source: str, target: str) -> list:
+        tradutores = self._local.__dict__.setdefault("tradutores", {})
+        chave = (source, target)
+        if chave not in tradutores:
+            tradutores[chave] = carregar("deep_translator").GoogleTranslator(source=source, target=target)
+        return [tradutores[chave].translate(t) for t in textos]
+
+class BackendOllama:
+    """Tradução local (soberana) com um modelo do Ollama."""
+    nome = "ollama"
+
+    def __init__(self, model: str):
+        self.model = model
+
+    def traduzir(self, textos: list, source: str, target: str) -> list:
+        origem = "a língua detetada" if source == "auto" else f"'{source}'"
+        traducoes = []
+        with cliente_http_sincrono(timeout=60.0) as client:
+            for texto in textos:
+                res = client.post(f"{OLLAMA_URL}/api/generate", json={
+                    "model": self.model,
+                    "system": f"Traduz de {origem} para '{target}'. Responde apenas com a tradução, sem comentários.",
+                    "prompt": texto,
+                    "stream": False,
+                    "keep_alive": OLLAMA_KEEP_ALIVE,
+                    "options": {"temperature": 0}
+                })
+                res.raise_for_status()
+                traducoes.append(res.json().get("response", "").strip())
+        return traducoes
+
+class BackendDicionario:
+    """Substituto offline: consulta um dicionário JSON e devolve o original quando não conhece."""
+    nome = "dicionario"
+
+    def __init__(self, caminho: str = ""):
+        self.entradas = {}
+        if caminho and os.path.exists(caminho):
+            with open(caminho, "r", encoding="utf-8") as f:
+                self.entradas = json.load(f)
+
+    def traduzir(self, textos: list, source: str, target: str) -> list:
+        tabela = self.entradas.get(f"{source}>{target}", {})
+        return [tabela.get(t, t) for t in textos]
+
+def criar_backend_traducao(nome: str):
+    if nome == "ollama":
+        return BackendOllama(TRADUTOR_MODELO_OLLAMA)
+    if nome == "dicionario":
+        return BackendDicionario(TRADUTOR_DICIONARIO)
+    return BackendGoogle()
+
+backend_traducao = criar_backend_traducao(TRADUTOR_BACKEND)
+
+# Qualidade de cada backend: a cache só serve traduções de um backend pelo menos tão bom como o atual
+# (o que o dicionário offline gravou não tapa uma tradução a sério quando o Google volta)
+QUALIDADE_TRADUCAO = {"google": 2, "ollama": 2, "dicionario": 0}
+
+def _backends_aceites() -> list:
+    minimo = QUALIDADE_TRADUCAO.get(backend_traducao.nome, 0)
+    return [nome for nome, qualidade in QUALIDADE_TRADUCAO.items() if qualidade >= minimo]
+
+def _hash_texto(texto: str) -> str:
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+def _ler_traducoes_cache(source: str, target: str, hashes: list) -> dict:
+    encontrados = {}
+    backends = _backends_aceites()
+    conn = obter_conexao()
+    cursor = conn.cursor()
+    for i in range(0, len(hashes), 500):  # limite de variáveis do SQLite
+        bloco = hashes[i:i + 500]
+        cursor.execute(
+            f"SELECT hash, traducao FROM traducoes_cache WHERE source = ? AND target = ? "
+            f"AND backend IN ({','.join('?' * len(backends))}) AND hash IN ({','.join('?' * len(bloco))})",
+            (source, target, *backends, *bloco)
+        )
+        encontrados.update(cursor.fetchall())
+    return encontrados
+
+def _gravar_traducoes_cache(source: str, target: str, linhas: list):
+    with transacao() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO traducoes_cache (source, target, hash, traducao, backend) VALUES (?, ?, ?, ?, ?)",
+            [(source, target, h, t, backend_traducao.nome) for h, t in linhas]
+        )
+
+async def traduzir_textos(textos: list, source: str, target: str) -> list:
+    """Traduz uma lista de textos: deduplica, serve o que já está em cache e só envia o resto ao backend."""
+    loop = asyncio.get_running_loop()
+    unicos = list(dict.fromkeys(t for t in textos if t and t.strip()))
+    hashes = {t: _hash_texto(t) for t in unicos}
+    em_cache = await na_thread_db(_ler_traducoes_cache, source, target, list(hashes.values()))
+    em_falta = [t for t in unicos if hashes[t] not in em_cache]
+    if em_falta:
+        novas = await loop.run_in_executor(_pool_traducao, backend_traducao.traduzir, em_falta, source, target)
+        linhas = [(hashes[t], n) for t, n in zip(em_falta, novas)]
+        # Texto devolvido tal como entrou (p.ex. o dicionário não o conhecia) não é tradução: não fica em cache
+        traduzidas = [(h, n) for (h, n), t in zip(linhas, em_falta) if n != t]
+        if traduzidas:
+            await na_thread_db(_gravar_traducoes_cache, source, target, traduzidas)
+        em_cache.update(linhas)
+    return [em_cache.get(hashes[t], t) if t in hashes else t for t in textos]
+
 @app.post("/api/traduzir")
 async def api_translate_v2(req: TranslationRequest):
     try:
-        from deep_translator import GoogleTranslator
-        translator = GoogleTranslator(source=req.source, target=req.target)
-        translated_text = translator.translate(req.q)
+        translated_text = (await traduzir_textos([req.q], req.source, req.target))[0]
         return {"translatedText": translated_text}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+@app.post("/api/traduzir/lote")
+async def api_translate_batch(req: TranslationBatchRequest):
+    try:
+        return {"translatedTexts": await traduzir_textos(req.textos, req.source, req.target), "backend": backend_traducao.nome}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+# Tradução de documentos longos: segmenta, deduplica, traduz em paralelo e remonta
+TRADUTOR_MAX_SEGMENTO = int(os.environ.get("TRADUTOR_MAX_SEGMENTO", "4500"))  # limite de caracteres do provedor
+TRADUTOR_DOC_CONCORRENCIA = int(os.environ.get("TRADUTOR_DOC_CONCORRENCIA", "4"))
+TRADUTOR_DOC_TAXA = float(os.environ.get("TRADUTOR_DOC_TAXA", "5"))  # pedidos por segundo ao backend
+SEPARADOR_PARAGRAFO = re.compile(r"(\r?\n[ \t]*\r?\n\s*)")  # também CRLF
+SEPARADOR_FRASE = re.compile(r"(?<=[.!?…])(\s+)")
+
+class LimitadorTaxa:
+    """Espaça as chamadas para não passar de N pedidos por segundo."""
+
+    def __init__(self, por_segundo: float):
+        self.intervalo = 1.0 / por_segundo if por_segundo > 0 else 0
+        self._proximo = 0.0
+        self._lock = asyncio.Lock()
+
+    async def aguardar(self):
+        async with self._lock:
+            agora = time.monotonic()
+            espera = self._proximo - agora
+            self._proximo = max(agora, self._proximo) + self.intervalo
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+def _partir_no_limite(frase: str, limite: int) -> list:
+    """[texto, espaço, texto, ...] com cada texto <= limite, cortado no último espaço antes do
+    limite (ou a seco, se não houver nenhum)."""
+    partes = []
+    while len(frase) > limite:
+        espaco = None
+        for espaco in re.finditer(r"\s+", frase[:limite + 1]):
+            pass
+        if espaco and espaco.start() > 0:
+            partes += [frase[:espaco.start()], espaco.group()]
+            frase = frase[espaco.end():]
+        else:
+            partes += [frase[:limite], ""]
+            frase = frase[limite:]
+    return partes + [frase]
+
+def segmentar_documento(texto: str, modo: str = "paragrafo") -> list:
+    """Parte o texto em pedaços [(segmento, traduzir?)] cuja concatenação é o original.
+
+    Separadores e espaços à volta de cada segmento ficam como pedaços não traduzíveis,
+    para que a remontagem preserve a estrutura. Parágrafos acima do limite do provedor
+    são partidos em frases, e frases acima do limite num espaço antes dele.
+    """
+    pedacos = []
+    for i, parte in enumerate(SEPARADOR_PARAGRAFO.split(texto)):
+        if i % 2 == 1:
+            pedacos.append((parte, False))
+            continue
+        frases = SEPARADOR_FRASE.split(parte) if modo == "frase" or len(parte) > TRADUTOR_MAX_SEGMENTO else [parte]
+        frases = [p for j, frase in enumerate(frases)
+                  for p in (_partir_no_limite(frase, TRADUTOR_MAX_SEGMENTO) if j % 2 == 0 else [frase])]
+        for j, frase in enumerate(frases):
+            if j % 2 == 1 or not frase.strip():
+                pedacos.append((frase, False))
+                continue
+            inicio = frase[:len(frase) - len(frase.lstrip())]
+            fim = frase[len(frase.rstrip()):]
+            if inicio:
+                pedacos.append((inicio, False))
+            pedacos.append((frase.strip(), True))
+            if fim:
+                pedacos.append((fim, False))
+    return pedacos
+
+@app.post("/api/traduzir/documento")
+async def api_translate_document(req: DocumentTranslationRequest):
+    """Traduz um documento longo e transmite o progresso em NDJSON à medida que os segmentos terminam."""
+    pedacos = segmentar_documento(req.texto, req.modo)
+    posicoes = {}
+    for i, (segmento, traduzir) in enumerate(pedacos):
+        if traduzir:
+            posicoes.setdefault(segmento, []).append(i)
+    resultado = [p[0] for p in pedacos]
+    limitador = LimitadorTaxa(TRADUTOR_DOC_TAXA)
+    semaforo = asyncio.Semaphore(TRADUTOR_DOC_CONCORRENCIA)
+
+    async def traduzir_segmento(segmento: str):
+        async with semaforo:
+            await limitador.aguardar()
+            try:
+                return segmento, (await traduzir_textos([segmento], req.source, req.target))[0], None
+            except Exception as e:
+                return segmento, segmento, str(e)
+
+    async def gerar():
+        inicio = time.perf_counter()
+        hashes = {seg: _hash_texto(seg) for seg in posicoes}
+        em_cache = await na_thread_db(_ler_traducoes_cache, req.source, req.target, list(hashes.values()))
+        yield json.dumps({"tipo": "inicio", "segmentos": sum(map(len, posicoes.values())),
+                          "unicos": len(posicoes), "em_cache": len(em_cache)}, ensure_ascii=False) + "\n"
+
+        feitos = 0
+        for seg, h in hashes.items():
+            if h in em_cache:
+                feitos += 1
+                for i in posicoes[seg]:
+                    resultado[i] = em_cache[h]
+                yield json.dumps({"tipo": "segmento", "posicoes": posicoes[seg], "traducao": em_cache[h],
+                                  "feitos": feitos, "total": len(posicoes)}, ensure_ascii=False) + "\n"
+
+        tarefas = [asyncio.create_task(traduzir_segmento(seg)) for seg, h in hashes.items() if h not in em_cache]
+        try:
+            for tarefa in asyncio.as_completed(tarefas):
+                seg, traducao, erro = await tarefa
+                feitos += 1
+                for i in posicoes[seg]:
+                    resultado[i] = traducao
+                evento = {"tipo": "segmento", "posicoes": posicoes[seg], "traducao": traducao,
+                          "feitos": feitos, "total": len(posicoes)}
+                if erro:
+                    evento["erro"] = erro
+                yield json.dumps(evento, ensure_ascii=False) + "\n"
+        finally:
+            for tarefa in tarefas:
+                tarefa.cancel()
+
+        yield json.dumps({"tipo": "fim", "texto": "".join(resultado),
+                          "duracao_ms": round((time.perf_counter() - inicio) * 1000, 1)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(gerar(), media_type="application/x-ndjson")
+
 @app.post("/api/auth/logout")
 async def api_logout():
     return {"success": True}
@@ -424,117 +1396,782 @@ async def api_logout():
 @app.post("/api/crm/novo")
 async def api_crm_novo(request: Request):
     data = await request.json()
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
+    await fila_escrita.escrever(
         "INSERT INTO crm (nome, email, telefone, empresa, status) VALUES (?, ?, ?, ?, ?)",
         (data.get("nome"), data.get("email"), data.get("telefone"), data.get("empresa"), data.get("tipo", "Lead"))
     )
-    conn.commit()
-    conn.close()
     return {"success": True}
 
 @app.delete("/api/crm/apagar/{item_id}")
 async def api_crm_apagar(item_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM crm WHERE id = ?", (item_id,))
-    conn.commit()
-    conn.close()
+    await executar("DELETE FROM crm WHERE id = ?", (item_id,))
     return {"success": True}
 
+# --- LISTAGENS PAGINADAS (KEYSET) ---
+LISTAGEM_LOTE = 200  # linhas por query enquanto a resposta é transmitida
+LISTAGEM_MAX_LIMIT = int(os.environ.get("LISTAGEM_MAX_LIMIT", "1000"))
+
+class Listagem:
+    """Descrição de uma listagem: tabela, coluna temporal da ordenação e campos projetáveis."""
+
+    def __init__(self, tabela: str, coluna_tempo: str, campos: dict, padrao: list, where: str = "",
+                 contador: Optional[str] = None):
+        self.tabela = tabela
+        self.contador = contador  # nome em `contadores` com o total sem filtros
+        self.coluna_tempo = coluna_tempo
+        self.campos = campos  # nome no JSON -> coluna
+        self.padrao = padrao
+        self.where = where
+
+LISTAGEM_DOCUMENTOS = Listagem(
+    "documentos", "atualizado_em",
+    {"id": "id", "filename": "filename", "titulo": "titulo", "categoria": "categoria", "atualizado_em": "atualizado_em"},
+    ["filename", "titulo", "categoria"],
+    contador="documentos_total"
+)
+LISTAGEM_CRM = Listagem(
+    "crm", "criado_em",
+    {"id": "id", "nome": "nome", "tipo": "status", "status": "status", "telefone": "telefone",
+     "email": "email", "empresa": "empresa", "criado_em": "criado_em"},
+    ["id", "nome", "tipo", "telefone"],
+    contador="crm_total"
+)
+LISTAGEM_CONHECIMENTO = Listagem(
+    "conhecimento", "criado_em",
+    {"id": "id", "titulo": "titulo", "tipo": "tipo", "data": "criado_em"},
+    ["id", "titulo", "tipo", "data"],
+    contador="conhecimento_total"
+)
+
+def codificar_cursor(tempo, id_) -> str:
+    return base64.urlsafe_b64encode(json.dumps([tempo, id_]).encode()).decode().rstrip("=")
+
+def descodificar_cursor(cursor: str):
+    try:
+        tempo, id_ = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return tempo, int(id_)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+async def listar_keyset(listagem: Listagem, limit: Optional[int], cursor: Optional[str], fields: Optional[str],
+                        filtros: str = "", params: tuple = ()):
+    """Lista por ordem (tempo DESC, id DESC) a partir do cursor, transmitindo o array JSON em lotes.
+
+    Cabeçalhos: X-Total-Count (total da listagem) e X-Next-Cursor (ausente na última página).
+    Cada lote é uma query keyset servida pelo índice, nunca um OFFSET sobre a tabela.
+    """
+    nomes = [f.strip() for f in fields.split(",") if f.strip()] if fields else listagem.padrao
+    desconhecidos = [n for n in nomes if n not in listagem.campos]
+    if desconhecidos:
+        raise HTTPException(status_code=400, detail=f"Campos desconhecidos: {', '.join(desconhecidos)}")
+    if limit is not None:
+        limit = max(1, min(limit, LISTAGEM_MAX_LIMIT))
+
+    t = listagem.coluna_tempo
+    condicoes = [c for c in (listagem.where, filtros) if c]
+    where_base = " AND ".join(condicoes)
+    inicio = descodificar_cursor(cursor) if cursor else None
+
+    def clausula(chave):
+        partes = condicoes + ([f"({t}, id) < (?, ?)"] if chave else [])
+        return (" WHERE " + " AND ".join(partes)) if partes else "", params + (tuple(chave) if chave else ())
+
+    if listagem.contador and not where_base:
+        total = (await consultar_um("SELECT valor FROM contadores WHERE nome = ?", (listagem.contador,)))[0]
+    else:
+        total = (await consultar_um(
+            f"SELECT COUNT(*) FROM {listagem.tabela}" + (f" WHERE {where_base}" if where_base else ""), params
+        ))[0]
+
+    # Cursor seguinte: chave da última linha desta página, se existir pelo menos mais uma
+    proximo = None
+    if limit is not None:
+        where, p = clausula(inicio)
+        fronteira = await consultar(
+            f"SELECT {t}, id FROM {listagem.tabela}{where} ORDER BY {t} DESC, id DESC LIMIT 2 OFFSET ?",
+            p + (limit - 1,)
+        )
+        if len(fronteira) == 2:
+            proximo = codificar_cursor(*fronteira[0])
+
+    colunas = ", ".join(listagem.campos[n] for n in nomes)
+
+    async def gerar():
+        yield "["
+        chave, enviados, primeiro = inicio, 0, True
+        while limit is None or enviados < limit:
+            lote = LISTAGEM_LOTE if limit is None else min(LISTAGEM_LOTE, limit - enviados)
+            where, p = clausula(chave)
+            linhas = await consultar(
+                f"SELECT {colunas}, {t}, id FROM {listagem.tabela}{where} ORDER BY {t} DESC, id DESC LIMIT ?",
+                p + (lote,)
+            )
+            for linha in linhas:
+                item = dict(zip(nomes, linha[:len(nomes)]))
+                yield ("" if primeiro else ",") + json.dumps(item, ensure_ascii=False)
+                primeiro = False
+            enviados += len(linhas)
+            if len(linhas) < lote:
+                break
+            chave = linhas[-1][-2:]
+        yield "]"
+
+    headers = {"X-Total-Count": str(total)}
+    if proximo:
+        headers["X-Next-Cursor"] = proximo
+    return StreamingResponse(gerar(), media_type="application/json", headers=headers)
+
 # Dashboard & KPIs
+_cache_contadores = CacheCoerente(versao_bd, lambda conn: dict(conn.execute("SELECT nome, valor FROM contadores")))
+
+async def ler_contadores() -> dict:
+    """Contadores mantidos pelos triggers, em cache no worker até a BD mudar (ver VersaoBD)."""
+    return await _cache_contadores.obter()
+
 @app.get("/api/dashboard/stats")
-async def get_dashboard_stats():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT COUNT(*) FROM crm")
-    total_contactos = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM projetos WHERE status != 'Concluído'")
-    projetos_ativos = cursor.fetchone()[0]
-    
-    conn.close()
+async def get_dashboard_stats(since: Optional[int] = None):
+    contadores = await ler_contadores()
+    versao = contadores.get("_versao", 0)
+    if since is not None and since == versao:
+        # Nada mudou desde a última leitura do cliente
+        return {"alterado": False, "versao": versao}
     
     return {
-        "projetos_ativos": projetos_ativos,
-        "receita_mes": 750000,
-        "total_contactos": total_contactos,
-        "total_documentos": 12
+        "projetos_ativos": contadores.get("projetos_ativos", 0),
+        "receita_mes": 0,  # ainda não há faturação registada na BD
+        "total_contactos": contadores.get("crm_total", 0),
+        "total_documentos": contadores.get("documentos_total", 0),
+        "total_conhecimento": contadores.get("conhecimento_total", 0),
+        "alterado": True,
+        "versao": versao
     }
 
 # CRM
+CRM_COLUNAS_CSV = ["id", "nome", "email", "telefone", "empresa", "status", "criado_em"]
+CRM_LOTE_IMPORTACAO = int(os.environ.get("CRM_LOTE_IMPORTACAO", "1000"))
+
+def expressao_fts(q: Optional[str]) -> Optional[str]:
+    """Texto do utilizador -> expressão FTS5 segura: cada palavra vira "palavra"* (prefixo, AND implícito)."""
+    termos = [t.replace('"', '""') for t in (q or "").split() if t]
+    return " ".join(f'"{t}"*' for t in termos) or None
+
+def filtros_crm(status: Optional[str], empresa: Optional[str], q: Optional[str]):
+    """Condições SQL (e parâmetros) para os filtros da listagem/exportação do CRM."""
+    condicoes, params = [], []
+    if status:
+        condicoes.append("status = ?")
+        params.append(status)
+    if empresa:
+        condicoes.append("empresa = ?")
+        params.append(empresa)
+    if expressao_fts(q):
+        # Pesquisa por prefixo em nome/empresa via FTS5
+        condicoes.append("id IN (SELECT rowid FROM crm_fts WHERE crm_fts MATCH ?)")
+        params.append(expressao_fts(q))
+    return " AND ".join(condicoes), tuple(params)
+
 @app.get("/api/crm/listar")
-async def list_crm(token: Optional[str] = None):
-    return [
-        {"id": 1, "nome": "Cliente Exemplo", "tipo": "CLIENTE", "telefone": "+258 84 000 0000"},
-        {"id": 2, "nome": "Fornecedor Madeira", "tipo": "FORNECEDOR", "telefone": "+258 82 111 1111"}
-    ]
+async def list_crm(token: Optional[str] = None, status: Optional[str] = None, empresa: Optional[str] = None,
+                   q: Optional[str] = None, limit: Optional[int] = None, cursor: Optional[str] = None,
+                   fields: Optional[str] = None):
+    filtros, params = filtros_crm(status, empresa, q)
+    return await listar_keyset(LISTAGEM_CRM, limit, cursor, fields, filtros, params)
+
+CRM_IMPORTACAO_MAX_ERROS = 100  # linhas com problemas listadas na resposta
+
+def _importar_crm_csv(ficheiro) -> dict:
+    """Lê o CSV linha a linha e insere em lotes, cada lote numa transação com executemany.
+
+    Os lotes já gravados ficam: se o ficheiro se tornar ilegível a meio, grava-se o que foi
+    lido até aí e a resposta diz quantas linhas entraram e onde parou.
+    """
+    leitor = csv.DictReader(io.TextIOWrapper(ficheiro, encoding="utf-8-sig", newline=""))
+    importados, ignorados, lote, erros = 0, 0, [], []
+
+    def gravar():
+        with transacao() as conn:
+            conn.executemany(
+                "INSERT INTO crm (nome, email, telefone, empresa, status) VALUES (?, ?, ?, ?, ?)", lote
+            )
+
+    try:
+        for linha in leitor:
+            linha = {(k or "").strip().lower(): (v or "").strip() for k, v in linha.items()}
+            if not linha.get("nome"):
+                ignorados += 1
+                if len(erros) < CRM_IMPORTACAO_MAX_ERROS:
+                    erros.append({"linha": leitor.line_num, "erro": "sem nome (ignorada)"})
+                continue
+            lote.append((linha["nome"], linha.get("email") or None, linha.get("telefone") or None,
+                         linha.get("empresa") or None, linha.get("status") or linha.get("tipo") or "Lead"))
+            if len(lote) >= CRM_LOTE_IMPORTACAO:
+                gravar()
+                importados += len(lote)
+                lote = []
+        interrompido = None
+    except (UnicodeDecodeError, csv.Error) as e:
+        interrompido = {"linha": leitor.line_num + 1, "erro": f"CSV inválido: {e}"}
+        erros.append(interrompido)
+    if lote:
+        gravar()
+        importados += len(lote)
+    return {"importados": importados, "ignorados": ignorados, "erros": erros, "interrompido": interrompido}
+
+@app.post("/api/crm/importar")
+async def api_crm_importar(file: UploadFile = File(...)):
+    resultado = await na_thread_db(_importar_crm_csv, file.file)
+    interrompido = resultado.pop("interrompido")
+    if interrompido is None:
+        return {"success": True, **resultado}
+    if not resultado["importados"]:
+        return JSONResponse(status_code=400, content={"error": interrompido["erro"], **resultado})
+    # Importação parcial: as linhas antes do erro já estão gravadas
+    return {"success": False, "parcial": True,
+            "message": f"Importadas {resultado['importados']} linhas; parou na linha {interrompido['linha']}.",
+            **resultado}
+
+@app.get("/api/crm/exportar")
+async def api_crm_exportar(status: Optional[str] = None, empresa: Optional[str] = None, q: Optional[str] = None):
+    """Exporta o CRM em CSV, lote a lote por id (nunca carrega a tabela toda em memória)."""
+    filtros, params = filtros_crm(status, empresa, q)
+
+    async def gerar():
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        escritor.writerow(CRM_COLUNAS_CSV)
+        ultimo_id = 0
+        while True:
+            where = " AND ".join(c for c in ("id > ?", filtros) if c)
+            linhas = await consultar(
+                f"SELECT {', '.join(CRM_COLUNAS_CSV)} FROM crm WHERE {where} ORDER BY id LIMIT ?",
+                (ultimo_id, *params, CRM_LOTE_IMPORTACAO)
+            )
+            escritor.writerows(linhas)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            if len(linhas) < CRM_LOTE_IMPORTACAO:
+                break
+            ultimo_id = linhas[-1][0]
+
+    nome = f"crm_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
+    return StreamingResponse(gerar(), media_type="text/csv; charset=utf-8",
+                             headers={"Content-Disposition": f'attachment; filename="{nome}"'})
 
 # Documentos / Oficina
 @app.get("/api/docs/listar")
-async def list_docs():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT filename, titulo, categoria FROM documentos ORDER BY atualizado_em DESC")
-    docs = [{"filename": r[0], "titulo": r[1], "categoria": r[2]} for r in cursor.fetchall()]
-    conn.close()
-    if not docs:
+async def list_docs(limit: Optional[int] = None, cursor: Optional[str] = None, fields: Optional[str] = None):
+    if not cursor and (await consultar_um("SELECT valor FROM contadores WHERE nome = 'documentos_total'"))[0] == 0:
         return [
             {"filename": "exemplo.txt", "titulo": "Primeiro Projeto", "categoria": "Geral"}
         ]
-    return docs
+    return await listar_keyset(LISTAGEM_DOCUMENTOS, limit, cursor, fields)
+
+def _gravar_documento(filename, titulo, conteudo, categoria, metadata, base_revisao=None):
+    with transacao() as conn:
+        conn.execute("BEGIN IMMEDIATE")  # ler a versão atual e escrever a nova sem corrida
+        return revisoes.gravar_documento(conn, filename, titulo, conteudo, categoria, metadata, base_revisao)
 
 @app.post("/api/docs/guardar")
 async def save_doc(doc: DocSave):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     filename = doc.filename
     if not filename:
         filename = f"doc_{datetime.now().strftime('%Y%m%d%H%M%S')}.txt"
     
-    cursor.execute('''
-        INSERT INTO documentos (filename, titulo, conteudo, categoria, metadata, atualizado_em)
-        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ON CONFLICT(filename) DO UPDATE SET
-            titulo=excluded.titulo,
-            conteudo=excluded.conteudo,
-            categoria=excluded.categoria,
-            metadata=excluded.metadata,
-            atualizado_em=CURRENT_TIMESTAMP
-    ''', (filename, doc.titulo, doc.conteudo, doc.categoria, doc.metadata))
-    
-    conn.commit()
-    conn.close()
-    return {"success": True, "filename": filename}
+    resultado = await na_thread_db(
+        _gravar_documento, filename, doc.titulo, doc.conteudo, doc.categoria, doc.metadata
+    )
+    return {"success": True, "filename": filename, "revisao": resultado["revisao"]}
+
+def _aplicar_patch(patch: DocPatch):
+    with transacao() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        atual = conn.execute(
+            "SELECT titulo, conteudo_z, categoria, metadata, revisao_atual FROM documentos WHERE filename = ?",
+            (patch.filename,)
+        ).fetchone()
+        if atual is None:
+            return None
+        titulo, conteudo_z, categoria, metadata, revisao_atual = atual
+        if revisao_atual != patch.base_revisao:
+            raise revisoes.ConflitoRevisao(revisao_atual)
+        novo, inverso = revisoes.aplicar_edicoes(
+            revisoes.descomprimir(conteudo_z), [(e.pos, e.apagar, e.inserir) for e in patch.edicoes]
+        )
+        resultado = revisoes.gravar_documento(
+            conn, patch.filename, patch.titulo or titulo, novo, patch.categoria or categoria,
+            patch.metadata if patch.metadata is not None else metadata, patch.base_revisao, inverso
+        )
+        return {**resultado, "tamanho": len(novo.encode("utf-8"))}
+
+@app.post("/api/docs/patch")
+async def patch_doc(patch: DocPatch):
+    """Autosave por edições: só viajam (e só se guardam no histórico) os trechos alterados."""
+    try:
+        resultado = await na_thread_db(_aplicar_patch, patch)
+    except revisoes.ConflitoRevisao as e:
+        return JSONResponse(status_code=409, content={
+            "error": "O documento foi alterado noutra sessão", "revisao_atual": e.args[0]
+        })
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if resultado is None:
+        raise HTTPException(status_code=404, detail="Documento não encontrado")
+    return {"success": True, "filename": patch.filename, **resultado}
+
+def _ler_documento(filename: str, revisao: Optional[int] = None):
+    conn = obter_conexao()
+    res = conn.execute(
+        "SELECT id, titulo, conteudo_z, categoria, metadata, revisao_atual FROM documentos WHERE filename = ?", (filename,)
+    ).fetchone()
+    if res is None:
+        return None
+    doc_id, titulo, conteudo_z, categoria, metadata, revisao_atual = res
+    if revisao is None or revisao == revisao_atual:
+        conteudo = revisoes.descomprimir(conteudo_z)
+    else:
+        conteudo = revisoes.ler_revisao(conn, doc_id, revisao)
+        if conteudo is None:
+            return None
+    return {
+        "titulo": titulo,
+        "conteudo": conteudo,
+        "categoria": categoria,
+        "metadata": json.loads(metadata if metadata else "{}"),
+        "revisao": revisao or revisao_atual
+    }
+
+# Leituras parciais: metadados sem corpo, intervalos de bytes/linhas e streaming do corpo
+def _metadados_documento(conn, filename: str):
+    res = conn.execute('''
+        SELECT id, titulo, categoria, metadata, tamanho, revisao_atual, atualizado_em
+        FROM documentos WHERE filename = ?
+    ''', (filename,)).fetchone()
+    if res is None:
+        return None
+    return {
+        "id": res[0], "titulo": res[1], "categoria": res[2], "metadata": json.loads(res[3] if res[3] else "{}"),
+        "tamanho": res[4] or 0, "revisao": res[5], "atualizado_em": res[6]
+    }
+
+def _abrir_leitura(doc_id: int):
+    """Ligação dedicada + leitor do BLOB (a ligação da thread fica livre para os outros pedidos)."""
+    conn = abrir_conexao()
+    try:
+        return conn, revisoes.LeitorCorpo(conn, doc_id)
+    except Exception:
+        conn.close()
+        raise
+
+def _fechar_leitura(conn, leitor):
+    if leitor is not None:
+        leitor.fechar()
+    if conn is not None:
+        conn.close()
+
+async def pedacos_documento(doc_id: int):
+    """Corpo atual aos pedaços. A ligação só é aberta no primeiro pedaço pedido, dentro do
+    try: um cliente que desliga antes de a resposta começar não deixa nada aberto."""
+    conn = leitor = None
+    try:
+        conn, leitor = await na_thread_db(_abrir_leitura, doc_id)
+        while True:
+            pedaco = await na_thread_db(leitor.ler)
+            if not pedaco:
+                break
+            yield pedaco
+    finally:
+        await na_thread_db(_fechar_leitura, conn, leitor)
+
+async def _texto_em_pedacos(texto: str):
+    yield texto.encode("utf-8")
+
+async def recortar_bytes(pedacos, inicio: int, fim: Optional[int]):
+    """Só os bytes [inicio, fim) do texto; pára de ler assim que passa o fim."""
+    pos = 0
+    try:
+        async for pedaco in pedacos:
+            a, b = max(inicio - pos, 0), len(pedaco) if fim is None else min(fim - pos, len(pedaco))
+            if a < b:
+                yield pedaco[a:b]
+            pos += len(pedaco)
+            if fim is not None and pos >= fim:
+                break
+    finally:
+        await pedacos.aclose()
+
+async def recortar_linhas(pedacos, inicio: int, fim: Optional[int]):
+    """Só as linhas [inicio, fim) (contadas a partir de 0)."""
+    linha = 0
+    try:
+        async for pedaco in pedacos:
+            partes, pos = [], 0
+            while pos < len(pedaco):
+                nl = pedaco.find(b"\n", pos)
+                fim_seg = len(pedaco) if nl < 0 else nl + 1
+                if linha >= inicio:
+                    partes.append(pedaco[pos:fim_seg])
+                if nl < 0:
+                    break
+                linha += 1
+                pos = fim_seg
+                if fim is not None and linha >= fim:
+                    break
+            if partes:
+                yield b"".join(partes)
+            if fim is not None and linha >= fim:
+                break
+    finally:
+        await pedacos.aclose()
+
+def _intervalo(valor):
+    """[ini, fim] ou "ini-fim" (fim opcional, exclusivo) -> (ini, fim)."""
+    if valor is None:
+        return None
+    try:
+        if isinstance(valor, str):
+            ini, _, fim = valor.partition("-")
+            valor = [ini, fim or None]
+        ini, fim = int(valor[0] or 0), (int(valor[1]) if len(valor) > 1 and valor[1] not in (None, "") else None)
+    except (ValueError, TypeError, IndexError):
+        raise HTTPException(status_code=400, detail=f"Intervalo inválido: {valor}")
+    if ini < 0 or (fim is not None and fim < ini):
+        raise HTTPException(status_code=400, detail=f"Intervalo inválido: {valor}")
+    return ini, fim
+
+def recortar(pedacos, bytes_: Optional[tuple] = None, linhas: Optional[tuple] = None):
+    """Aplica o intervalo de bytes ou de linhas (se houver) a um gerador de pedaços."""
+    if bytes_:
+        return recortar_bytes(pedacos, *bytes_)
+    if linhas:
+        return recortar_linhas(pedacos, *linhas)
+    return pedacos
+
+async def abrir_corpo(filename: str, bytes_: Optional[tuple] = None, linhas: Optional[tuple] = None):
+    """(metadados, gerador de pedaços já recortados) do corpo atual, ou (None, None)."""
+    meta = await na_thread_db(lambda: _metadados_documento(obter_conexao(), filename))
+    if meta is None:
+        return None, None
+    return meta, recortar(pedacos_documento(meta["id"]), bytes_, linhas)
 
 @app.post("/api/docs/ler")
 async def read_doc(req: Request):
     data = await req.json()
     filename = data.get("filename")
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT titulo, conteudo, categoria, metadata FROM documentos WHERE filename = ?", (filename,))
-    res = cursor.fetchone()
-    conn.close()
+    revisao = data.get("revisao")
+    bytes_, linhas = _intervalo(data.get("bytes")), _intervalo(data.get("linhas"))
+    if data.get("corpo") is False:
+        meta = await na_thread_db(lambda: _metadados_documento(obter_conexao(), filename))
+        if meta is None:
+            raise HTTPException(status_code=404, detail="Documento não encontrado")
+        meta.pop("id")
+        return meta
+    if bytes_ or linhas:
+        meta, pedacos = await abrir_corpo(filename, bytes_, linhas)
+        if meta is None:
+            raise HTTPException(status_code=404, detail="Documento não encontrado")
+        # A revisão atual (sem número ou pedida pelo número) lê-se aos pedaços do BLOB
+        if not revisao or revisao == meta["revisao"]:
+            meta.pop("id")
+            # Um intervalo de bytes pode cortar um carácter a meio: as pontas saem como U+FFFD
+            meta["conteudo"] = b"".join([p async for p in pedacos]).decode("utf-8", errors="replace")
+            return meta
+    res = await na_thread_db(_ler_documento, filename, revisao)
     
     if res:
-        return {
-            "titulo": res[0],
-            "conteudo": res[1],
-            "categoria": res[2],
-            "metadata": json.loads(res[3] if res[3] else "{}")
-        }
+        if bytes_ or linhas:
+            # Revisão antiga: é reconstruída inteira em memória e recortada da mesma forma
+            pedacos = recortar(_texto_em_pedacos(res["conteudo"]), bytes_, linhas)
+            res["conteudo"] = b"".join([p async for p in pedacos]).decode("utf-8", errors="replace")
+        return res
+    if revisao:
+        raise HTTPException(status_code=404, detail="Revisão não encontrada")
     return {"titulo": "Novo", "conteudo": "", "categoria": "Geral", "metadata": {}}
 
+@app.get("/api/docs/stream")
+async def stream_doc(filename: str, bytes: Optional[str] = None, linhas: Optional[str] = None):
+    """Corpo atual em texto, enviado aos pedaços à medida que é descomprimido."""
+    meta, pedacos = await abrir_corpo(filename, _intervalo(bytes), _intervalo(linhas))
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Documento não encontrado")
+    return StreamingResponse(pedacos, media_type="text/plain; charset=utf-8", headers={
+        "X-Revisao": str(meta["revisao"]), "X-Tamanho": str(meta["tamanho"])
+    })
+
+# Pesquisa na Oficina (FTS5 sobre titulo, conteudo e categoria)
+BUSCA_POR_PAGINA_MAX = 50
+BUSCA_PESOS = (10.0, 1.0, 2.0)  # bm25 por coluna: o título pesa mais do que o corpo
+_INICIO_DESTAQUE, _FIM_DESTAQUE = "\x02", "\x03"
+
+def _destaques(trecho: str):
+    """Tira os marcadores do snippet e devolve (texto, [[início, fim], ...]) dos termos encontrados."""
+    texto, destaques, inicio = [], [], None
+    pos = 0
+    for ch in trecho:
+        if ch == _INICIO_DESTAQUE:
+            inicio = pos
+        elif ch == _FIM_DESTAQUE:
+            destaques.append([inicio, pos])
+        else:
+            texto.append(ch)
+            pos += 1
+    return "".join(texto), destaques
+
+def _buscar_documentos(expressao: str, categoria: Optional[str], pagina: int, por_pagina: int):
+    conn = obter_conexao()
+    pesos = ", ".join(str(p) for p in BUSCA_PESOS)
+    filtro = "WHERE d.categoria = ?" if categoria else ""
+    # Uma só query: facetas (sobre todos os resultados) + ids da página, ordenados por relevância
+    linhas = conn.execute(f'''
+        WITH resultados AS MATERIALIZED (
+            SELECT f.rowid AS id, bm25(documentos_fts, {pesos}) AS score, d.categoria
+            FROM documentos_fts f JOIN documentos d ON d.id = f.rowid
+            WHERE documentos_fts MATCH ?
+        ),
+        pagina AS (
+            SELECT id, score FROM resultados d {filtro} ORDER BY score, id LIMIT ? OFFSET ?
+        )
+        SELECT 'faceta', categoria, COUNT(*) FROM resultados GROUP BY categoria
+        UNION ALL
+        SELECT 'resultado', id, score FROM pagina
+    ''', (expressao, *((categoria,) if categoria else ()), por_pagina, pagina * por_pagina)).fetchall()
+    facetas = {l[1] or "Sem categoria": l[2] for l in linhas if l[0] == "faceta"}
+    ordem = [(l[1], l[2]) for l in linhas if l[0] == "resultado"]
+    if not ordem:
+        return facetas, []
+    # Snippets só para as linhas da página (descomprime apenas estes corpos)
+    marcadores = ", ".join("?" * len(ordem))
+    detalhes = {r[0]: r[1:] for r in conn.execute(f'''
+        SELECT f.rowid, d.filename, d.titulo, d.categoria, d.atualizado_em,
+               snippet(documentos_fts, 1, '{_INICIO_DESTAQUE}', '{_FIM_DESTAQUE}', '…', 24)
+        FROM documentos_fts f JOIN documentos d ON d.id = f.rowid
+        WHERE documentos_fts MATCH ? AND f.rowid IN ({marcadores})
+    ''', (expressao, *(i for i, _ in ordem)))}
+    resultados = []
+    for id_, score in ordem:
+        if id_ not in detalhes:
+            continue
+        filename, titulo, cat, atualizado_em, trecho = detalhes[id_]
+        trecho, destaques = _destaques(trecho or "")
+        resultados.append({
+            "filename": filename, "titulo": titulo, "categoria": cat, "atualizado_em": atualizado_em,
+            "score": round(-score, 3), "snippet": trecho, "destaques": destaques
+        })
+    return facetas, resultados
+
+@app.get("/api/docs/buscar")
+async def search_docs(q: str, categoria: Optional[str] = None, pagina: int = 0, por_pagina: int = 20):
+    expressao = expressao_fts(q)
+    if not expressao:
+        raise HTTPException(status_code=400, detail="Pesquisa vazia")
+    por_pagina = min(max(por_pagina, 1), BUSCA_POR_PAGINA_MAX)
+    pagina = max(pagina, 0)
+    facetas, resultados = await na_thread_db(_buscar_documentos, expressao, categoria, pagina, por_pagina)
+    total = facetas.get(categoria, 0) if categoria else sum(facetas.values())
+    return {
+        "total": total,
+        "pagina": pagina,
+        "por_pagina": por_pagina,
+        "mais": (pagina + 1) * por_pagina < total,
+        "facetas": facetas,
+        "resultados": resultados
+    }
+
+@app.get("/api/docs/revisoes")
+async def list_revisoes(filename: str, limit: int = 50):
+    linhas = await consultar('''
+        SELECT r.id, r.numero, r.tipo, LENGTH(r.dados), r.criado_em FROM documentos_revisoes r
+        JOIN documentos d ON d.id = r.documento_id
+        WHERE d.filename = ? ORDER BY r.id DESC LIMIT ?
+    ''', (filename, min(max(limit, 1), 500)))
+    return [
+        {"revisao": r[0], "numero": r[1], "tipo": r[2], "bytes": r[3] or 0, "criado_em": r[4]}
+        for r in linhas
+    ]
+
+@app.post("/api/docs/restaurar")
+async def restore_doc(req: Request):
+    """Repõe uma revisão antiga como nova versão (o histórico intermédio mantém-se)."""
+    data = await req.json()
+    filename = data.get("filename")
+    antigo = await na_thread_db(_ler_documento, filename, data.get("revisao"))
+    if antigo is None:
+        raise HTTPException(status_code=404, detail="Revisão não encontrada")
+    resultado = await na_thread_db(
+        _gravar_documento, filename, antigo["titulo"], antigo["conteudo"], antigo["categoria"],
+        json.dumps(antigo["metadata"])
+    )
+    return {"success": True, "filename": filename, "revisao": resultado["revisao"]}
+
 # Outros Módulos (Txiling, Negocios, Saúde, Academia, Backup, Sync, Faturação)
+# --- BACKUPS ---
+# Correm numa thread própria (asyncio.to_thread), não no pool da BD: uma cópia longa não tira vez às queries
 @app.get("/api/backup/stats")
-async def backup_stats(): return {"ultimo_backup": "2026-01-27 10:00", "total_backups": 15}
+async def backup_stats():
+    return await asyncio.to_thread(backups.estatisticas)
+
+@app.get("/api/backup/listar")
+async def backup_listar():
+    return await asyncio.to_thread(backups.listar_backups)
+
+@app.post("/api/backup/run")
+async def backup_run():
+    try:
+        return {"success": True, "backup": await asyncio.to_thread(backups.criar_backup)}
+    except (backups.ErroBackup, sqlite3.Error, OSError) as e:
+        return {"success": False, "message": str(e)}
+
+@app.post("/api/backup/restaurar")
+async def backup_restaurar(req: Request):
+    data = await req.json()
+    marca = await na_thread_db(_marca_sync)
+    try:
+        resultado = await asyncio.to_thread(backups.restaurar_backup, data.get("nome", ""))
+    except (backups.ErroBackup, FileNotFoundError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Um backup antigo pode ter um schema anterior: aplica as migrações em falta
+    resultado["migracoes"] = await na_thread_db(aplicar_migracoes, MIGRACOES)
+    resultado["sync_purgado"] = await na_thread_db(_avancar_sync, marca)
+    return {"success": True, **resultado}
+
+async def _agendar_backups():
+    while True:
+        await asyncio.sleep(backups.BACKUP_INTERVALO_HORAS * 3600)
+        try:
+            meta = await asyncio.to_thread(backups.criar_backup, "agendado")
+            print(f"Backup agendado: {meta['nome']} ({meta['bytes_comprimido']} bytes, {meta['duracao_ms']}ms)")
+        except Exception as e:
+            print(f"Erro no backup agendado: {e}")
+
+# --- SINCRONIZAÇÃO INCREMENTAL (PWA) ---
+SYNC_LOTE = 500
+SYNC_MAX_ALTERACOES = int(os.environ.get("SYNC_MAX_ALTERACOES", "5000"))  # por pedido; o resto vem no seguinte
+SYNC_RETENCAO_DIAS = int(os.environ.get("SYNC_RETENCAO_DIAS", "30"))      # tombstones mais antigas são purgadas
+SYNC_PURGA_HORAS = float(os.environ.get("SYNC_PURGA_HORAS", "24"))         # intervalo da purga (0 = só no arranque)
+
+def _purgar_tombstones():
+    """Apaga tombstones antigas e regista a maior seq purgada (clientes abaixo dela refazem o sync completo)."""
+    with transacao() as conn:
+        limite = conn.execute(
+            "SELECT MAX(seq) FROM alteracoes WHERE operacao = 'd' AND em < datetime('now', ?)",
+            (f"-{SYNC_RETENCAO_DIAS} days",)
+        ).fetchone()[0]
+        if limite is None:
+            return 0
+        apagadas = conn.execute("DELETE FROM alteracoes WHERE operacao = 'd' AND seq <= ?", (limite,)).rowcount
+        conn.execute("UPDATE contadores SET valor = MAX(valor, ?) WHERE nome = '_sync_purgado'", (limite,))
+    return apagadas
+
+async def _agendar_purga_sync():
+    """Purga as tombstones no arranque e depois a cada SYNC_PURGA_HORAS (um worker de longa
+    duração nunca reinicia, e sem isto 'alteracoes' crescia até ao próximo arranque)."""
+    while True:
+        try:
+            apagadas = await na_thread_db(_purgar_tombstones)
+            if apagadas:
+                print(f"Sync: {apagadas} tombstones com mais de {SYNC_RETENCAO_DIAS} dias purgadas")
+        except Exception as e:
+            print(f"Erro na purga de tombstones do sync: {e}")
+        if SYNC_PURGA_HORAS <= 0:
+            return
+        await asyncio.sleep(SYNC_PURGA_HORAS * 3600)
+
+def _marca_sync() -> int:
+    """Maior seq alguma vez atribuída (inclui as já substituídas ou purgadas)."""
+    conn = obter_conexao()
+    seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM alteracoes").fetchone()[0]
+    atribuida = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'alteracoes'").fetchone()
+    return max(seq, atribuida[0] if atribuida else 0)
+
+def _avancar_sync(marca: int) -> int:
+    """Depois de um restauro: a seq nunca anda para trás e todos os clientes refazem o sync.
+
+    As alterações do backup são renumeradas para depois de `marca` (a última seq antes do
+    restauro) e '_sync_purgado' passa para lá dela: qualquer marca guardada por um cliente
+    pertence à linha temporal descartada e recebe {"reset": true}, enquanto o sync completo
+    que se segue já só vê seqs novas (e não volta a pedir reset a meio).
+    """
+    with transacao() as conn:
+        deslocamento = max(marca, _marca_sync())  # sem colisões mesmo que o backup tenha seqs mais altas
+        conn.execute("UPDATE alteracoes SET seq = seq + ?", (deslocamento,))
+        topo = max(_marca_sync(), deslocamento + 1)
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'alteracoes'")
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('alteracoes', ?)", (topo,))
+        conn.execute("UPDATE contadores SET valor = MAX(valor, ?) WHERE nome = '_sync_purgado'", (deslocamento + 1,))
+    return deslocamento + 1
+
+def _lote_alteracoes(desde: int, quantos: int):
+    """Próximas alterações depois de `desde`, já com os dados atuais das linhas alteradas."""
+    conn = obter_conexao()
+    alteracoes = conn.execute(
+        "SELECT seq, tabela, linha_id, operacao FROM alteracoes WHERE seq > ? ORDER BY seq LIMIT ?", (desde, quantos)
+    ).fetchall()
+    dados = {}
+    for tabela, campos in SYNC_TABELAS.items():
+        ids = [a[2] for a in alteracoes if a[1] == tabela and a[3] == "u"]
+        if ids:
+            marcadores = ", ".join("?" * len(ids))
+            for linha in conn.execute(f"SELECT {', '.join(campos)} FROM {tabela} WHERE id IN ({marcadores})", ids):
+                dados[(tabela, linha[0])] = dict(zip(campos[1:], linha[1:]))
+    lote = []
+    for seq, tabela, linha_id, operacao in alteracoes:
+        linha = dados.get((tabela, linha_id))
+        # Apagada entre o registo e esta leitura: a própria tombstone chega num lote seguinte
+        if operacao == "u" and linha is None:
+            continue
+        lote.append((seq, tabela, linha_id, operacao, linha))
+    return lote, (alteracoes[-1][0] if alteracoes else desde)
+
+@app.get("/api/sync/changes")
+async def sync_changes(since: int = 0, tabelas: Optional[str] = None):
+    """Alterações desde a marca `since`, em NDJSON compacto.
+
+    Uma linha por registo alterado: {"s": seq, "t": tabela, "id": id, "d": campos} ou, para
+    apagados, {"s": seq, "t": tabela, "id": id, "x": 1}. A última linha traz {"fim": seq, "mais": bool}
+    — o cliente guarda `fim` e volta a pedir se `mais`. {"reset": true} na primeira linha pede um
+    sync completo (a marca é anterior a tombstones já purgadas).
+    """
+    filtro = set(t.strip() for t in tabelas.split(",")) if tabelas else set(SYNC_TABELAS)
+    desconhecidas = filtro - set(SYNC_TABELAS)
+    if desconhecidas:
+        raise HTTPException(status_code=400, detail=f"Tabelas desconhecidas: {', '.join(sorted(desconhecidas))}")
+    purgado = (await consultar_um("SELECT valor FROM contadores WHERE nome = '_sync_purgado'"))[0]
+    reset = 0 < since < purgado
+
+    async def gerar():
+        desde, enviadas, mais = (0 if reset else since), 0, True
+        if reset:
+            yield json.dumps({"reset": True}) + "\n"
+        while enviadas < SYNC_MAX_ALTERACOES:
+            lote, ultima = await na_thread_db(_lote_alteracoes, desde, min(SYNC_LOTE, SYNC_MAX_ALTERACOES - enviadas))
+            if ultima == desde:
+                mais = False
+                break
+            linhas = []
+            for seq, tabela, linha_id, operacao, dados in lote:
+                if tabela not in filtro:
+                    continue
+                item = {"s": seq, "t": tabela, "id": linha_id}
+                if operacao == "d":
+                    item["x"] = 1
+                else:
+                    item["d"] = dados
+                linhas.append(json.dumps(item, ensure_ascii=False, separators=(",", ":")))
+            if linhas:
+                yield "\n".join(linhas) + "\n"
+            enviadas += len(lote)
+            desde = ultima
+        yield json.dumps({"fim": desde, "mais": mais}) + "\n"
+
+    return StreamingResponse(gerar(), media_type="application/x-ndjson")
 
 @app.get("/api/sync/status")
-async def sync_status(token: Optional[str] = None): return {"online": True, "last_sync": "Agora"}
+async def sync_status(token: Optional[str] = None, since: Optional[int] = None):
+    seq, ultima = await consultar_um("SELECT MAX(seq), MAX(em) FROM alteracoes")
+    estado = {"online": True, "last_sync": ultima or "Agora", "seq": seq or 0}
+    if since is not None:
+        estado["pendentes"] = (await consultar_um("SELECT COUNT(*) FROM alteracoes WHERE seq > ?", (since,)))[0]
+    return estado
 
 @app.get("/api/faturacao/estatisticas")
 async def fat_stats(token: Optional[str] = None): return {"receita_mes": "150.000 MT", "receita_total": "1.200.000 MT"}
@@ -565,13 +2202,8 @@ async def academia_cursos(token: Optional[str] = None): return []
 
 # Forja de Conhecimento (RAG) Endpoints
 @app.get("/api/conhecimento/listar")
-async def list_conhecimento():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, titulo, tipo, criado_em FROM conhecimento ORDER BY criado_em DESC")
-    items = [{"id": r[0], "titulo": r[1], "tipo": r[2], "data": r[3]} for r in cursor.fetchall()]
-    conn.close()
-    return items
+async def list_conhecimento(limit: Optional[int] = None, cursor: Optional[str] = None, fields: Optional[str] = None):
+    return await listar_keyset(LISTAGEM_CONHECIMENTO, limit, cursor, fields)
 
 @app.post("/api/conhecimento/upload")
 async def upload_file_knowledge(file: UploadFile = File(...)):
@@ -581,7 +2213,7 @@ async def upload_file_knowledge(file: UploadFile = File(...)):
 
     try:
         if content_type == "application/pdf":
-            pdf_reader = PyPDF2.PdfReader(BytesIO(await file.read()))
+            pdf_reader = carregar("PyPDF2").PdfReader(BytesIO(await file.read()))
             for page in pdf_reader.pages:
                 extracted_text += page.extract_text() + "\n"
         elif "text" in content_type:
@@ -596,14 +2228,10 @@ async def upload_file_knowledge(file: UploadFile = File(...)):
         embedding = await get_embedding(extracted_text[:2000]) # Limite para embedding inicial
         embedding_json = json.dumps(embedding) if embedding else None
 
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(
+        await fila_escrita.escrever(
             "INSERT INTO conhecimento (titulo, conteudo, tipo, embedding) VALUES (?, ?, ?, ?)",
             (filename, extracted_text, "manual", embedding_json)
         )
-        conn.commit()
-        conn.close()
         return {"success": True, "filename": filename}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
@@ -619,30 +2247,176 @@ async def upload_knowledge(req: Request):
     embedding = await get_embedding(conteudo)
     embedding_json = json.dumps(embedding) if embedding else None
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
+    await fila_escrita.escrever(
         "INSERT INTO conhecimento (titulo, conteudo, tipo, embedding) VALUES (?, ?, ?, ?)",
         (titulo, conteudo, tipo, embedding_json)
     )
-    conn.commit()
-    conn.close()
     return {"success": True}
 
 @app.delete("/api/conhecimento/apagar/{item_id}")
 async def delete_knowledge(item_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM conhecimento WHERE id = ?", (item_id,))
-    conn.commit()
-    conn.close()
+    await executar("DELETE FROM conhecimento WHERE id = ?", (item_id,))
     return {"success": True}
 
+# --- OLLAMA WARM POOL ---
+_ollama_ultimo_uso = {}  # modelo -> timestamp do último uso (para despejo LRU)
+
+def _nome_modelo_ollama(model: str) -> str:
+    """Normaliza o nome do modelo como o /api/ps o reporta (ex: llama3 -> llama3:latest)."""
+    model = model.removeprefix("ollama/")
+    return model if ":" in model else f"{model}:latest"
+
+async def ollama_residentes():
+    """Lista os modelos carregados em memória segundo o /api/ps."""
+    try:
+        async with cliente_http() as client:
+            res = await client.get(f"{OLLAMA_URL}/api/ps", timeout=5.0)
+            if res.status_code == 200:
+                return res.json().get("models", [])
+    except Exception as e:
+        print(f"Erro ao consultar /api/ps: {e}")
+    return []
+
+async def _tamanho_modelo_ollama(model: str) -> int:
+    """Estimativa do tamanho em bytes do modelo a partir do /api/tags."""
+    try:
+        async with cliente_http() as client:
+            res = await client.get(f"{OLLAMA_URL}/api/tags", timeout=5.0)
+            if res.status_code == 200:
+                for m in res.json().get("models", []):
+                    if m.get("name") == model:
+                        return m.get("size", 0)
+    except Exception as e:
+        print(f"Erro ao consultar /api/tags: {e}")
+    return 0
+
+async def ollama_despejar(model: str) -> bool:
+    """Remove um modelo da RAM (keep_alive=0)."""
+    model = _nome_modelo_ollama(model)
+    try:
+        async with cliente_http() as client:
+            res = await client.post(
+                f"{OLLAMA_URL}/api/generate",
+                json={"model": model, "keep_alive": 0},
+                timeout=30.0
+            )
+            _ollama_ultimo_uso.pop(model, None)
+            return res.status_code == 200
+    except Exception as e:
+        print(f"Erro ao despejar modelo {model}: {e}")
+        return False
+
+async def _libertar_memoria(model: str):
+    """Despeja modelos não fixados (LRU) até o novo modelo caber em OLLAMA_MAX_RAM_GB."""
+    if OLLAMA_MAX_RAM_GB <= 0:
+        return []
+    limite = OLLAMA_MAX_RAM_GB * 1024 ** 3
+    residentes = await ollama_residentes()
+    if any(r.get("name") == model for r in residentes):
+        return []
+    necessario = await _tamanho_modelo_ollama(model)
+    em_uso = sum(r.get("size", 0) for r in residentes)
+    fixos = {_nome_modelo_ollama(m) for m in OLLAMA_WARM_MODELS}
+    candidatos = sorted(
+        (r for r in residentes if r.get("name") not in fixos),
+        key=lambda r: _ollama_ultimo_uso.get(r.get("name"), 0)
+    )
+    despejados = []
+    for r in candidatos:
+        if em_uso + necessario <= limite:
+            break
+        if await ollama_despejar(r["name"]):
+            em_uso -= r.get("size", 0)
+            despejados.append(r["name"])
+    return despejados
+
+async def ollama_aquecer(model: str, keep_alive: Optional[str] = None) -> dict:
+    """Carrega um modelo na RAM com um pedido vazio, libertando espaço se necessário."""
+    model = _nome_modelo_ollama(model)
+    despejados = await _libertar_memoria(model)
+    try:
+        async with cliente_http() as client:
+            res = await client.post(
+                f"{OLLAMA_URL}/api/generate",
+                json={"model": model, "keep_alive": keep_alive or OLLAMA_KEEP_ALIVE},
+                timeout=120.0
+            )
+            if res.status_code == 200:
+                _ollama_ultimo_uso[model] = datetime.now().timestamp()
+            return {"model": model, "success": res.status_code == 200, "despejados": despejados}
+    except Exception as e:
+        print(f"Erro ao aquecer modelo {model}: {e}")
+        return {"model": model, "success": False, "despejados": despejados, "error": str(e)}
+
+async def _manter_warm_pool():
+    """Recarrega periodicamente os modelos fixados que o Ollama tenha descarregado."""
+    while True:
+        residentes = {r.get("name") for r in await ollama_residentes()}
+        for m in OLLAMA_WARM_MODELS:
+            if _nome_modelo_ollama(m) not in residentes:
+                await ollama_aquecer(m)
+        await asyncio.sleep(OLLAMA_WARM_INTERVAL)
+
+@app.on_event("startup")
+async def iniciar_registo_uso():
+    em_fundo(registo_uso.ciclo())
+
+@app.on_event("startup")
+async def iniciar_backups():
+    # Com vários workers só o que ficar com o lock agenda backups
+    if backups.BACKUP_INTERVALO_HORAS > 0 and not SERVERLESS and adquirir_lider("backups"):
+        em_fundo(_agendar_backups())
+
+@app.on_event("startup")
+async def purgar_tombstones_sync():
+    # Com vários workers só o que ficar com o lock purga
+    if adquirir_lider("sync-purga"):
+        em_fundo(_agendar_purga_sync())
+
+@app.on_event("shutdown")
+async def terminar_registo_uso():
+    await fila_escrita.parar()
+    await registo_uso.despejar()
+    versao_bd.fechar()
+    fechar_conexoes()
+
+@app.on_event("startup")
+async def iniciar_warm_pool():
+    if OLLAMA_WARM_MODELS and adquirir_lider("warm-pool"):
+        em_fundo(_manter_warm_pool())
+
 # --- OLLAMA FORGE ENDPOINTS ---
+@app.get("/api/sistema/fila-escrita")
+async def fila_escrita_status():
+    return fila_escrita.estado()
+
+@app.get("/api/sistema/coerencia")
+async def coerencia_status():
+    """Estado das caches deste worker (o pid mostra qual dos workers respondeu)."""
+    return {
+        **versao_bd.estado(),
+        "recalculos": {"contadores": _cache_contadores.recalculos, "embeddings": _indice_embeddings.recalculos},
+        "paginas_em_cache": len(_cache_paginas),
+        "lider": sorted(base_dados._lideres)
+    }
+
+@app.get("/api/sistema/dependencias")
+async def dependencias_status():
+    """Estado das dependências opcionais sem as importar (só as já usadas aparecem como carregadas)."""
+    return {
+        modulo: {
+            "uso": uso,
+            "disponivel": dependencia_disponivel(modulo),
+            "carregado": modulo in sys.modules,
+            "import_ms": _tempos_import.get(modulo)
+        }
+        for modulo, uso in DEPENDENCIAS_OPCIONAIS.items()
+    }
+
 @app.get("/api/ollama/status")
 async def ollama_status():
     try:
-        async with httpx.AsyncClient() as client:
+        async with cliente_http() as client:
             res = await client.get(OLLAMA_URL)
             return {"online": res.status_code == 200}
     except:
@@ -651,7 +2425,7 @@ async def ollama_status():
 @app.get("/api/ollama/models")
 async def ollama_models():
     try:
-        async with httpx.AsyncClient() as client:
+        async with cliente_http() as client:
             res = await client.get(f"{OLLAMA_URL}/api/tags")
             if res.status_code == 200:
                 return res.json()
@@ -669,23 +2443,41 @@ async def ollama_pull(req: Request):
     # Executa de forma assíncrona para não bloquear
     async def run_pull():
         try:
-            async with httpx.AsyncClient(timeout=None) as client:
+            async with cliente_http(timeout=None) as client:
                 async with client.stream("POST", f"{OLLAMA_URL}/api/pull", json={"name": model}) as response:
                     async for line in response.aiter_lines():
                         print(f"Ollama Pull [{model}]: {line}")
         except Exception as e:
             print(f"Erro ao baixar modelo {model}: {str(e)}")
-    asyncio.create_task(run_pull())
+    em_fundo(run_pull())
     return {"success": True, "message": f"Download de {model} iniciado em background."}
 
+@app.get("/api/ollama/residentes")
+async def ollama_residentes_status():
+    return {
+        "models": await ollama_residentes(),
+        "fixos": [_nome_modelo_ollama(m) for m in OLLAMA_WARM_MODELS],
+        "keep_alive": OLLAMA_KEEP_ALIVE
+    }
+
+@app.post("/api/ollama/aquecer")
+async def ollama_aquecer_endpoint(req: Request):
+    data = await req.json()
+    model = data.get("model")
+    if not model:
+        raise HTTPException(status_code=400, detail="Modelo não especificado")
+    return await ollama_aquecer(model, data.get("keep_alive"))
+
+@app.post("/api/ollama/despejar")
+async def ollama_despejar_endpoint(req: Request):
+    data = await req.json()
+    model = data.get("model")
+    if not model:
+        raise HTTPException(status_code=400, detail="Modelo não especificado")
+    return {"model": _nome_modelo_ollama(model), "success": await ollama_despejar(model)}
+
 # --- ATELIÊ DE DESIGN (IMAGE PROXY) ---
-@app.post("/api/atelie/roteirizar")
-async def api_roteirizar(req: dict):
-    conteudo = req.get("conteudo", "")
-    provider = req.get("provider", "local").lower()
-    model = req.get("model", "tinyllama")
-    
-    prompt = f"""
+ROTEIRO_PROMPT = """
     Transforma o seguinte conteúdo numa aula curta e animada (estilo whiteboard).
     Cria um diálogo entre um 'Mestre' (experiente) e um 'Aprendiz' (curioso).
     
@@ -701,28 +2493,165 @@ async def api_roteirizar(req: dict):
     }}
     Limitado a 5-8 falas.
     """
-    
-    if provider == "local":
-        async with httpx.AsyncClient() as client:
-            res = await client.post(
-                f"{OLLAMA_URL}/api/generate",
-                json={"model": model, "prompt": prompt, "stream": False, "format": "json"},
-                timeout=60.0
-            )
-            if res.status_code == 200:
+ROTEIRO_ERRO = {"aula": [{"personagem": "mestre", "texto": "Erro ao forjar roteiro.", "acao": "triste"}]}
+ROTEIRO_MOCK = {
+    "aula": [
+        {"personagem": "mestre", "texto": "Bem-vindo à aula automática, Aprendiz!", "acao": "saudar"},
+        {"personagem": "aprendiz", "texto": "Obrigado, Mestre! O que vamos aprender?", "acao": "curioso"},
+        {"personagem": "mestre", "texto": "Sobre como a IA poupa o teu trabalho de desenhista.", "acao": "apontar"}
+    ]
+}
+ROTEIRO_LOTE_MAX_CONCORRENCIA = int(os.environ.get("ROTEIRO_LOTE_MAX_CONCORRENCIA", "4"))
+ROTEIRO_MODELO_PADRAO = os.environ.get("ROTEIRO_MODELO_PADRAO", "tinyllama")
+
+def validar_roteiro(dados) -> Optional[str]:
+    """Verifica o esquema {"aula": [{personagem, texto, acao}]}. Devolve o erro ou None."""
+    if not isinstance(dados, dict) or not isinstance(dados.get("aula"), list):
+        return 'o objeto deve ter a chave "aula" com uma lista de falas'
+    if not dados["aula"]:
+        return 'a lista "aula" está vazia'
+    for i, fala in enumerate(dados["aula"]):
+        if not isinstance(fala, dict):
+            return f"a fala {i} não é um objeto"
+        if fala.get("personagem") not in ("mestre", "aprendiz"):
+            return f'a fala {i} tem personagem inválido (usa "mestre" ou "aprendiz")'
+        if not isinstance(fala.get("texto"), str) or not fala["texto"].strip():
+            return f'a fala {i} não tem "texto"'
+        if not isinstance(fala.get("acao"), str):
+            return f'a fala {i} não tem "acao"'
+    return None
+
+def _hash_roteiro(provider: str, model: str, conteudo: str) -> str:
+    return hashlib.sha256(f"{provider}|{model}|{conteudo}".encode("utf-8")).hexdigest()
+
+def _ler_roteiro_cache(chave: str):
+    conn = obter_conexao()
+    cursor = conn.cursor()
+    cursor.execute("SELECT roteiro FROM roteiros_cache WHERE hash = ?", (chave,))
+    res = cursor.fetchone()
+    return json.loads(res[0]) if res else None
+
+def _gravar_roteiro_cache(chave: str, model: str, roteiro: dict):
+    with transacao() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO roteiros_cache (hash, model, roteiro) VALUES (?, ?, ?)",
+            (chave, model, json.dumps(roteiro, ensure_ascii=False))
+        )
+
+async def _gerar_roteiro_ollama(model: str, conteudo: str, agente: str):
+    """Pede o roteiro ao Ollama; se o JSON vier inválido, tenta uma vez com o erro concreto."""
+    prompt = ROTEIRO_PROMPT.format(conteudo=conteudo)
+    async with agendador_llm.admitir(agente):
+        async with cliente_http() as client:
+            for tentativa in range(2):
+                res = await client.post(
+                    f"{OLLAMA_URL}/api/generate",
+                    json={"model": model, "prompt": prompt, "stream": False, "format": "json",
+                          "keep_alive": OLLAMA_KEEP_ALIVE},
+                    timeout=60.0
+                )
+                if res.status_code != 200:
+                    return None
+                resposta = res.json().get("response", "{}")
                 try:
-                    return json.loads(res.json().get("response", "{}"))
-                except:
-                    return {"aula": [{"personagem": "mestre", "texto": "Erro ao forjar roteiro.", "acao": "triste"}]}
-    
-    # Mock para cloud se necessário
-    return {
-        "aula": [
-            {"personagem": "mestre", "texto": "Bem-vindo à aula automática, Aprendiz!", "acao": "saudar"},
-            {"personagem": "aprendiz", "texto": "Obrigado, Mestre! O que vamos aprender?", "acao": "curioso"},
-            {"personagem": "mestre", "texto": "Sobre como a IA poupa o teu trabalho de desenhista.", "acao": "apontar"}
-        ]
-    }
+                    dados = json.loads(resposta)
+                    erro = validar_roteiro(dados)
+                except json.JSONDecodeError as e:
+                    dados, erro = None, f"JSON inválido ({e.msg})"
+                if erro is None:
+                    return dados
+                print(f"Roteiro inválido (tentativa {tentativa + 1}): {erro}")
+                prompt = (f"{ROTEIRO_PROMPT.format(conteudo=conteudo)}\n"
+                          f"A tua resposta anterior foi rejeitada porque {erro}:\n{resposta[:1000]}\n"
+                          f"Corrige e responde apenas com o JSON.")
+    return ROTEIRO_ERRO
+
+async def forjar_roteiro(conteudo: str, provider: str = "local", model: str = ROTEIRO_MODELO_PADRAO,
+                         agente: str = "atelie") -> dict:
+    """Roteiro de aula para um conteúdo, reaproveitando a cache por hash do conteúdo."""
+    if provider != "local":
+        # Mock para cloud se necessário
+        return ROTEIRO_MOCK
+    chave = _hash_roteiro(provider, model, conteudo)
+    em_cache = await na_thread_db(_ler_roteiro_cache, chave)
+    if em_cache is not None:
+        return em_cache
+    roteiro = await _gerar_roteiro_ollama(model, conteudo, agente)
+    if roteiro is None:
+        return ROTEIRO_MOCK
+    if roteiro is not ROTEIRO_ERRO:
+        await na_thread_db(_gravar_roteiro_cache, chave, model, roteiro)
+    return roteiro
+
+@app.post("/api/atelie/roteirizar")
+async def api_roteirizar(req: dict):
+    conteudo = req.get("conteudo", "")
+    provider = req.get("provider", "local").lower()
+    model = req.get("model", ROTEIRO_MODELO_PADRAO)
+    return await forjar_roteiro(conteudo, provider, model)
+
+@app.post("/api/atelie/roteirizar/lote")
+async def api_roteirizar_lote(req: dict):
+    """Roteiriza um módulo inteiro (lista de conteúdos) em paralelo, pela ordem recebida."""
+    conteudos = req.get("conteudos") or []
+    provider = req.get("provider", "local").lower()
+    model = req.get("model", ROTEIRO_MODELO_PADRAO)
+    try:
+        concorrencia = int(req.get("concorrencia", ROTEIRO_LOTE_MAX_CONCORRENCIA))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="'concorrencia' tem de ser um número inteiro")
+    semaforo = asyncio.Semaphore(max(1, min(concorrencia, ROTEIRO_LOTE_MAX_CONCORRENCIA)))
+
+    async def um(conteudo):
+        # Um erro num conteúdo (fila cheia, Ollama em baixo, timeout) fica só no seu resultado
+        async with semaforo:
+            try:
+                return await forjar_roteiro(conteudo, provider, model)
+            except HTTPException as e:
+                return {"erro": e.detail}
+            except carregar("httpx").HTTPError as e:
+                return {"erro": f"Falha no pedido ao modelo: {type(e).__name__} {e}".strip()}
+
+    return {"roteiros": await asyncio.gather(*(um(c) for c in conteudos))}
+
+# Pré-cálculo em background dos roteiros do catálogo (Forja de Conhecimento)
+_precomputacao_roteiros = {"ativo": False, "total": 0, "feitos": 0, "em_cache": 0, "falhas": 0}
+
+async def precomputar_roteiros(model: str = ROTEIRO_MODELO_PADRAO):
+    estado = _precomputacao_roteiros
+    linhas = await consultar("SELECT conteudo FROM conhecimento WHERE conteudo IS NOT NULL AND conteudo != ''")
+    conteudos = [r[0] for r in linhas]
+    estado.update(ativo=True, total=len(conteudos), feitos=0, em_cache=0, falhas=0, model=model)
+    try:
+        for conteudo in conteudos:
+            if await na_thread_db(_ler_roteiro_cache, _hash_roteiro("local", model, conteudo)) is not None:
+                estado["em_cache"] += 1
+                continue
+            try:
+                roteiro = await forjar_roteiro(conteudo, "local", model, agente="precomputacao")
+                estado["falhas" if roteiro in (ROTEIRO_ERRO, ROTEIRO_MOCK) else "feitos"] += 1
+            except HTTPException:
+                # Fila LLM ocupada: o pré-cálculo cede a vez ao tráfego real
+                estado["falhas"] += 1
+                await asyncio.sleep(5)
+            except Exception as e:
+                # Ollama em baixo, timeout, ...: regista e segue para o próximo conteúdo
+                print(f"Pré-cálculo de roteiro falhou: {type(e).__name__} {e}")
+                estado["falhas"] += 1
+    finally:
+        estado["ativo"] = False
+
+@app.post("/api/atelie/roteirizar/precomputar")
+async def api_precomputar_roteiros(req: dict):
+    if _precomputacao_roteiros["ativo"]:
+        return {"success": False, "message": "Pré-cálculo já em curso.", **_precomputacao_roteiros}
+    em_fundo(precomputar_roteiros(req.get("model", ROTEIRO_MODELO_PADRAO)))
+    return {"success": True, "message": "Pré-cálculo de roteiros iniciado em background."}
+
+@app.get("/api/atelie/roteirizar/precomputar")
+async def api_precomputar_roteiros_status():
+    return _precomputacao_roteiros
+
 @app.post("/api/atelie/gerar")
 async def atelie_gerar_imagem(req: Request):
     data = await req.json()
@@ -738,14 +2667,17 @@ async def atelie_gerar_imagem(req: Request):
     return {"success": True, "url": url}
 
 # --- AGENTIAL CODE TOOLS (MÃO DO CARPINTEIRO) ---
-@app.post("/api/tools/execute")
-async def tool_execute_python(req: Request):
-    data = await req.json()
-    code = data.get("code")
-    if not code:
-        return {"error": "Nenhum código fornecido"}
-    
-    # Execução controlada (Sandbox Simples)
+FERRAMENTAS_MAX_EXECUCOES = int(os.environ.get("FERRAMENTAS_MAX_EXECUCOES", "2"))
+_pool_execucoes = ThreadPoolExecutor(max_workers=FERRAMENTAS_MAX_EXECUCOES, thread_name_prefix="carpinteiro-exec")
+
+# Marcadores que o prompt do agente dev ensina o modelo a emitir
+MARCADOR_FERRAMENTA = re.compile(
+    r"@@(?P<tipo>EXECUTE_PYTHON|WRITE_FILE|READ_FILE)\[(?P<arg>.*?)\]@@",
+    re.DOTALL
+)
+
+def executar_python(code: str) -> dict:
+    """Execução controlada (Sandbox Simples) de um script Python com limite de 10s."""
     with tempfile.NamedTemporaryFile(suffix=".py", mode="w", delete=False) as f:
         f.write(code)
         temp_name = f.name
@@ -767,12 +2699,7 @@ async def tool_execute_python(req: Request):
         if os.path.exists(temp_name):
             os.remove(temp_name)
 
-@app.post("/api/tools/write")
-async def tool_write_file(req: Request):
-    data = await req.json()
-    path = data.get("path")
-    content = data.get("content")
-    
+def escrever_ficheiro(path: str, content: str) -> dict:
     # Garante que escreve apenas na pasta de projetos para segurança
     safe_path = os.path.join("projetos", os.path.basename(path))
     os.makedirs("projetos", exist_ok=True)
@@ -784,11 +2711,10 @@ async def tool_write_file(req: Request):
     except Exception as e:
         return {"error": str(e), "success": False}
 
-@app.get("/api/tools/read/{filename}")
-async def tool_read_file(filename: str):
+def ler_ficheiro(filename: str) -> dict:
     safe_path = os.path.join("projetos", os.path.basename(filename))
     if not os.path.exists(safe_path):
-        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+        return {"error": "Arquivo não encontrado", "success": False}
     
     try:
         with open(safe_path, "r", encoding="utf-8") as f:
@@ -797,5 +2723,98 @@ async def tool_read_file(filename: str):
     except Exception as e:
         return {"error": str(e), "success": False}
 
+def extrair_marcadores(texto: str) -> list:
+    """Lista as ferramentas pedidas no texto, pela ordem em que aparecem."""
+    marcadores = []
+    for m in MARCADOR_FERRAMENTA.finditer(texto or ""):
+        tipo, arg = m.group("tipo"), m.group("arg")
+        if tipo == "WRITE_FILE":
+            path, _, content = arg.partition("|||")
+            marcadores.append({"tipo": "write_file", "path": path.strip(), "content": content})
+        elif tipo == "READ_FILE":
+            marcadores.append({"tipo": "read_file", "path": arg.strip()})
+        else:
+            marcadores.append({"tipo": "execute_python", "code": arg})
+    return marcadores
+
+async def executar_marcadores(texto: str) -> list:
+    """Executa todos os marcadores de uma resposta numa só ida ao servidor.
+
+    Leituras e escritas de ficheiros diferentes correm em paralelo; as do mesmo
+    ficheiro respeitam a ordem do texto. As execuções de Python vêm depois (podem
+    depender dos ficheiros escritos) e partilham um pool limitado de workers.
+    """
+    marcadores = extrair_marcadores(texto)
+    resultados = [None] * len(marcadores)
+    loop = asyncio.get_running_loop()
+
+    async def correr(indice: int, funcao, *args, executor=None):
+        inicio = time.perf_counter()
+        res = await loop.run_in_executor(executor, funcao, *args)
+        alvo = marcadores[indice].get("path")
+        resultados[indice] = {"tipo": marcadores[indice]["tipo"], **({"alvo": alvo} if alvo else {}), **res,
+                              "duracao_ms": round((time.perf_counter() - inicio) * 1000, 1)}
+
+    por_ficheiro = {}
+    for i, m in enumerate(marcadores):
+        if m["tipo"] != "execute_python":
+            por_ficheiro.setdefault(os.path.basename(m["path"]), []).append(i)
+
+    async def sequencia(indices):
+        for i in indices:
+            m = marcadores[i]
+            if m["tipo"] == "write_file":
+                await correr(i, escrever_ficheiro, m["path"], m["content"])
+            else:
+                await correr(i, ler_ficheiro, m["path"])
+
+    await asyncio.gather(*(sequencia(indices) for indices in por_ficheiro.values()))
+    await asyncio.gather(*(
+        correr(i, executar_python, m["code"], executor=_pool_execucoes)
+        for i, m in enumerate(marcadores) if m["tipo"] == "execute_python"
+    ))
+    return resultados
+
+@app.post("/api/tools/execute")
+async def tool_execute_python(req: Request):
+    data = await req.json()
+    code = data.get("code")
+    if not code:
+        return {"error": "Nenhum código fornecido"}
+    return await asyncio.get_running_loop().run_in_executor(_pool_execucoes, executar_python, code)
+
+@app.post("/api/tools/write")
+async def tool_write_file(req: Request):
+    data = await req.json()
+    return escrever_ficheiro(data.get("path"), data.get("content"))
+
+@app.get("/api/tools/read/{filename}")
+async def tool_read_file(filename: str):
+    res = ler_ficheiro(filename)
+    if res.get("error") == "Arquivo não encontrado":
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    return res
+
+@app.post("/api/tools/marcadores")
+async def tool_run_markers(req: Request):
+    data = await req.json()
+    return {"ferramentas": await executar_marcadores(data.get("texto", ""))}
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if "--profile-startup" in sys.argv:
+        import perfil_arranque
+        print(perfil_arranque.relatorio("main", cwd=os.path.dirname(os.path.abspath(__file__))))
+        print("\nDependências opcionais (não importadas no arranque):")
+        for modulo, uso in DEPENDENCIAS_OPCIONAIS.items():
+            estado = "disponível" if dependencia_disponivel(modulo) else "INDISPONÍVEL"
+            print(f"  {modulo:16} {estado:13} {uso}")
+    elif "--gerar-semente" in sys.argv:
+        gerar_semente()
+    else:
+        import uvicorn
+        workers = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else WEB_WORKERS
+        if workers > 1:
+            # Cada worker importa "main" no seu processo; as migrações já correram aqui
+            uvicorn.run("main:app", host="0.0.0.0", port=WEB_PORTA, workers=workers)
+        else:
+            uvicorn.run(app, host="0.0.0.0", port=WEB_PORTA)
@@ -0,0 +1,61 @@
+# perfil_arranque.py
+"""Perfil do tempo de import de um módulo, construído sobre `python -X importtime`.
+
+O import é feito num processo novo (caches do interpretador frias, como num
+worker acabado de arrancar) e o relatório mostra o custo de cada import feito
+diretamente pelo módulo e os módulos com mais tempo próprio.
+"""
+import os
+import sys
+import subprocess
+
+def correr_import(modulo: str, env: dict = None, cwd: str = None, importtime: bool = True):
+    """Importa `modulo` num processo novo; devolve (ms do import sem contar o interpretador, stderr)."""
+    sonda = (
+        "import time\n"
+        "inicio = time.perf_counter()\n"
+        f"import {modulo}\n"
+        "print(f'TOTAL_MS={(time.perf_counter() - inicio) * 1000:.1f}')\n"
+    )
+    opcoes = ["-X", "importtime"] if importtime else []
+    res = subprocess.run([sys.executable, *opcoes, "-c", sonda], cwd=cwd, env=dict(os.environ, **(env or {})),
+                         capture_output=True, text=True, timeout=300)
+    if res.returncode != 0:
+        raise RuntimeError(f"Falhou o import de {modulo}:\n{res.stderr[-2000:]}")
+    total = next(float(l.split("=", 1)[1]) for l in res.stdout.splitlines() if l.startswith("TOTAL_MS="))
+    return total, res.stderr
+
+def analisar_importtime(stderr: str):
+    """Linhas do -X importtime -> [(profundidade, self_ms, cumulativo_ms, nome)] pela ordem do relatório."""
+    entradas = []
+    for linha in stderr.splitlines():
+        if not linha.startswith("import time:") or "cumulative" in linha:
+            continue
+        _, proprio, cumulativo, nome = (p for p in linha.replace("import time:", "|", 1).split("|"))
+        entradas.append(((len(nome) - len(nome.lstrip())) // 2, int(proprio) / 1000, int(cumulativo) / 1000, nome.strip()))
+    return entradas
+
+def imports_diretos(entradas: list, modulo: str):
+    """(cumulativo_ms, nome) de cada import feito diretamente por `modulo`, do mais caro para o mais barato."""
+    # O importtime escreve os filhos antes do pai: recua a partir da linha do módulo
+    i = next(i for i, e in enumerate(entradas) if e[3] == modulo)
+    nivel, filhos = entradas[i][0], []
+    for profundidade, _, cumulativo, nome in reversed(entradas[:i]):
+        if profundidade <= nivel:
+            break
+        if profundidade == nivel + 1:
+            filhos.append((cumulativo, nome))
+    return entradas[i][2], sorted(filhos, reverse=True)
+
+def relatorio(modulo: str, env: dict = None, cwd: str = None, top: int = 20) -> str:
+    total, stderr = correr_import(modulo, env, cwd)
+    entradas = analisar_importtime(stderr)
+    cumulativo, filhos = imports_diretos(entradas, modulo)
+    linhas = [f"--- Perfil de arranque: import {modulo} ---",
+              f"Total (com instrumentação): {total:.0f}ms; {modulo} cumulativo: {cumulativo:.0f}ms", "",
+              f"Imports diretos de {modulo} (cumulativo):"]
+    linhas += [f"  {ms:8.1f}ms  {nome}" for ms, nome in filhos[:top]]
+    linhas += ["", "Maior tempo próprio (qualquer nível):"]
+    proprios = sorted(((e[1], e[3]) for e in entradas), reverse=True)[:top]
+    linhas += [f"  {ms:8.1f}ms  {nome}" for ms, nome in proprios]
+    return "\n".join(linhas)
@@ -0,0 +1,214 @@
+# revisoes.py
+"""Armazenamento comprimido dos documentos da Oficina com histórico de revisões.
+
+O corpo atual de cada documento vive comprimido (zlib) em documentos.conteudo_z.
+O histórico é uma cadeia de deltas inversos: quando chega uma versão nova, a
+anterior passa a ser guardada só como as diferenças em relação à nova (por
+linhas, ou pelas próprias edições quando o autosave as envia). De DOCS_SNAPSHOT_CADA em DOCS_SNAPSHOT_CADA revisões fica uma cópia
+completa, para que reconstruir uma versão antiga nunca percorra mais do que
+esse número de deltas. DOCS_MAX_REVISOES (0 = sem limite) descarta as mais
+antigas; como os deltas apontam sempre para versões mais novas, cortar a
+cauda nunca parte a cadeia.
+"""
+import os
+import json
+import zlib
+import difflib
+
+DOCS_ZLIB_NIVEL = int(os.environ.get("DOCS_ZLIB_NIVEL", "6"))
+DOCS_SNAPSHOT_CADA = int(os.environ.get("DOCS_SNAPSHOT_CADA", "20"))
+DOCS_MAX_REVISOES = int(os.environ.get("DOCS_MAX_REVISOES", "200"))
+DOCS_PEDACO_LEITURA = int(os.environ.get("DOCS_PEDACO_LEITURA", str(64 * 1024)))
+
+# Tipos de revisão: 'atual' (corpo em documentos.conteudo_z), 'completa' e 'delta'
+ATUAL, COMPLETA, DELTA = "atual", "completa", "delta"
+
+class ConflitoRevisao(Exception):
+    """A revisão base indicada já não é a atual do documento."""
+
+def comprimir(texto: str) -> bytes:
+    return zlib.compress(texto.encode("utf-8"), DOCS_ZLIB_NIVEL)
+
+def descomprimir(dados: bytes) -> str:
+    return zlib.decompress(dados).decode("utf-8") if dados else ""
+
+# --- DELTAS ---
+def calcular_delta(novo: str, antigo: str) -> list:
+    """Operações que reconstroem `antigo` a partir de `novo`: ["c", ini, fim] copia linhas, ["i", texto] insere."""
+    linhas_novo = novo.splitlines(keepends=True)
+    linhas_antigo = antigo.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, linhas_novo, linhas_antigo, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(["c", i1, i2])
+        elif j2 > j1:  # replace/insert: o texto antigo tem de ir no delta
+            ops.append(["i", "".join(linhas_antigo[j1:j2])])
+    return ops
+
+def aplicar_edicoes(texto: str, edicoes: list):
+    """Aplica edições [pos, apagar, inserir] em sequência; devolve (novo texto, delta inverso).
+
+    O delta inverso usa operações ["r", ini, fim, texto] (substituições por caracteres),
+    já pela ordem certa para refazer o texto original a partir do novo.
+    """
+    inverso = []
+    for pos, apagar, inserir in edicoes:
+        if pos < 0 or apagar < 0 or pos + apagar > len(texto):
+            raise ValueError(f"Edição fora do texto: pos={pos}, apagar={apagar}, tamanho={len(texto)}")
+        inverso.append(["r", pos, pos + len(inserir), texto[pos:pos + apagar]])
+        texto = texto[:pos] + inserir + texto[pos + apagar:]
+    return texto, inverso[::-1]
+
+def aplicar_delta(base: str, ops: list) -> str:
+    if ops and ops[0][0] == "r":
+        for _, ini, fim, texto in ops:
+            base = base[:ini] + texto + base[fim:]
+        return base
+    linhas = base.splitlines(keepends=True)
+    partes = []
+    for op in ops:
+        if op[0] == "c":
+            partes.extend(linhas[op[1]:op[2]])
+        else:
+            partes.append(op[1])
+    return "".join(partes)
+
+# --- ESCRITA ---
+def gravar_documento(conn, filename, titulo, conteudo, categoria, metadata, base_revisao=None, delta=None) -> dict:
+    """Grava uma nova versão do documento (numa transação aberta pelo chamador).
+
+    Se `base_revisao` vier indicada e não for a revisão atual, lança ConflitoRevisao.
+    Conteúdo igual ao atual só atualiza os metadados, sem criar revisão. `delta` permite
+    passar o delta inverso já conhecido (autosave por edições) em vez de o calcular.
+    """
+    atual = conn.execute(
+        "SELECT id, conteudo_z, revisao_atual FROM documentos WHERE filename = ?", (filename,)
+    ).fetchone()
+    if atual and base_revisao is not None and atual[2] != base_revisao:
+        raise ConflitoRevisao(atual[2])
+    conteudo_z = comprimir(conteudo)
+
+    if atual is None:
+        doc_id = conn.execute('''
+            INSERT INTO documentos (filename, titulo, categoria, metadata, conteudo_z, tamanho, atualizado_em)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (filename, titulo, categoria, metadata, conteudo_z, len(conteudo.encode("utf-8")))).lastrowid
+        revisao = _nova_revisao(conn, doc_id, 1)
+        conn.execute("UPDATE documentos SET revisao_atual = ? WHERE id = ?", (revisao, doc_id))
+        return {"revisao": revisao, "numero": 1, "alterado": True}
+
+    doc_id, antigo_z, revisao_antiga = atual
+    if antigo_z == conteudo_z:
+        conn.execute(
+            "UPDATE documentos SET titulo = ?, categoria = ?, metadata = ?, atualizado_em = CURRENT_TIMESTAMP WHERE id = ?",
+            (titulo, categoria, metadata, doc_id)
+        )
+        numero = conn.execute("SELECT numero FROM documentos_revisoes WHERE id = ?", (revisao_antiga,)).fetchone()
+        return {"revisao": revisao_antiga, "numero": numero[0] if numero else None, "alterado": False}
+
+    numero_antigo = conn.execute(
+        "SELECT numero FROM documentos_revisoes WHERE id = ?", (revisao_antiga,)
+    ).fetchone()[0]
+    revisao = _nova_revisao(conn, doc_id, numero_antigo + 1)
+
+    # A versão que sai de 'atual' fica como delta contra a nova (ou completa, a cada N revisões)
+    dados, tipo = antigo_z, COMPLETA
+    if numero_antigo % DOCS_SNAPSHOT_CADA != 0:
+        if delta is None:
+            delta = calcular_delta(conteudo, descomprimir(antigo_z))
+        delta_z = zlib.compress(json.dumps(delta).encode("utf-8"), DOCS_ZLIB_NIVEL)
+        if len(delta_z) < len(antigo_z):
+            dados, tipo = delta_z, DELTA
+    conn.execute(
+        "UPDATE documentos_revisoes SET tipo = ?, dados = ?, base_id = ? WHERE id = ?",
+        (tipo, dados, revisao, revisao_antiga)
+    )
+    conn.execute('''
+        UPDATE documentos SET titulo = ?, categoria = ?, metadata = ?, conteudo_z = ?, tamanho = ?,
+            revisao_atual = ?, atualizado_em = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (titulo, categoria, metadata, conteudo_z, len(conteudo.encode("utf-8")), revisao, doc_id))
+    compactar(conn, doc_id)
+    return {"revisao": revisao, "numero": numero_antigo + 1, "alterado": True}
+
+def _nova_revisao(conn, doc_id: int, numero: int) -> int:
+    return conn.execute(
+        "INSERT INTO documentos_revisoes (documento_id, numero, tipo) VALUES (?, ?, ?)", (doc_id, numero, ATUAL)
+    ).lastrowid
+
+def compactar(conn, doc_id: int, manter: int = None) -> int:
+    """Apaga as revisões mais antigas para além das `manter` mais recentes; devolve quantas saíram."""
+    manter = DOCS_MAX_REVISOES if manter is None else manter
+    if manter <= 0:
+        return 0
+    return conn.execute('''
+        DELETE FROM documentos_revisoes WHERE documento_id = ? AND id < (
+            SELECT MIN(id) FROM (
+                SELECT id FROM documentos_revisoes WHERE documento_id = ? ORDER BY id DESC LIMIT ?
+            )
+        )
+    ''', (doc_id, doc_id, manter)).rowcount
+
+# --- LEITURA ---
+def ler_revisao(conn, doc_id: int, revisao: int):
+    """Reconstrói o texto de uma revisão: sobe a cadeia até uma cópia completa e aplica os deltas de volta."""
+    deltas = []
+    atual = revisao
+    while True:
+        linha = conn.execute(
+            "SELECT tipo, dados, base_id FROM documentos_revisoes WHERE id = ? AND documento_id = ?", (atual, doc_id)
+        ).fetchone()
+        if linha is None:
+            return None
+        tipo, dados, base_id = linha
+        if tipo == ATUAL:
+            texto = descomprimir(conn.execute("SELECT conteudo_z FROM documentos WHERE id = ?", (doc_id,)).fetchone()[0])
+            break
+        if tipo == COMPLETA:
+            texto = descomprimir(dados)
+            break
+        deltas.append(json.loads(zlib.decompress(dados)))
+        atual = base_id
+    for ops in reversed(deltas):
+        texto = aplicar_delta(texto, ops)
+    return texto
+
+class LeitorCorpo:
+    """Lê o corpo atual aos pedaços com BLOB I/O incremental, descomprimindo à medida.
+
+    Nunca tem em memória mais do que um pedaço comprimido e o texto que dele sai
+    (limitado a 4x DOCS_PEDACO_LEITURA por chamada).
+    """
+    def __init__(self, conn, doc_id: int, pedaco: int = None):
+        self.pedaco = pedaco or DOCS_PEDACO_LEITURA
+        self.blob = conn.blobopen("documentos", "conteudo_z", doc_id, readonly=True)
+        self.zlib = zlib.decompressobj()
+        self.terminado = False
+
+    def ler(self) -> bytes:
+        """Próximo pedaço de texto (UTF-8); b"" no fim."""
+        while not self.terminado:
+            dados = self.zlib.unconsumed_tail or self.blob.read(self.pedaco)
+            if not dados:
+                self.terminado = True
+                return self.zlib.flush()
+            saida = self.zlib.decompress(dados, self.pedaco * 4)
+            if saida:
+                return saida
+        return b""
+
+    def fechar(self):
+        self.blob.close()
+
+def migrar_documentos(conn):
+    """Passo de migração: comprime o conteudo em texto das linhas antigas e cria-lhes a revisão inicial."""
+    for doc_id, conteudo in conn.execute(
+        "SELECT id, conteudo FROM documentos WHERE conteudo_z IS NULL"
+    ).fetchall():
+        conteudo = conteudo or ""
+        revisao = _nova_revisao(conn, doc_id, 1)
+        conn.execute(
+            "UPDATE documentos SET conteudo_z = ?, tamanho = ?, revisao_atual = ?, conteudo = NULL WHERE id = ?",
+            (comprimir(conteudo), len(conteudo.encode("utf-8")), revisao, doc_id)
+        )
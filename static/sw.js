@@ -1,4 +1,5 @@
-const CACHE_NAME = 'carpintaria-os-v4.6';
+const CACHE_NAME = 'carpintaria-os-v4.7';
+const SYNC_CACHE = 'carpintaria-sync';
 const ASSETS_TO_CACHE = [
     '/',
     '/store',
@@ -32,7 +33,7 @@ self.addEventListener('activate', (event) => {
         caches.keys().then((cacheNames) => {
             return Promise.all(
                 cacheNames.map((cache) => {
-                    if (cache !== CACHE_NAME) {
+                    if (cache !== CACHE_NAME && cache !== SYNC_CACHE) {
                         console.log('Removing old cache:', cache);
                         return caches.delete(cache);
                     }
@@ -46,6 +47,8 @@ self.addEventListener('activate', (event) => {
 self.addEventListener('fetch', (event) => {
     // Apenas interceptar requisições GET
     if (event.request.method !== 'GET') return;
+    // O sync incremental gere a sua própria marca d'água: nunca servir deltas da cache
+    if (new URL(event.request.url).pathname.startsWith('/api/sync/')) return;
 
     event.respondWith(
         fetch(event.request)
@@ -70,3 +73,44 @@ self.addEventListener('fetch', (event) => {
             })
     );
 });
+
+// Sync incremental: pede só as alterações desde a última marca (seq) e entrega-as às páginas
+async function lerMarca() {
+    const cache = await caches.open(SYNC_CACHE);
+    const res = await cache.match('/__marca_sync');
+    return res ? Number(await res.text()) : 0;
+}
+
+async function guardarMarca(seq) {
+    const cache = await caches.open(SYNC_CACHE);
+    await cache.put('/__marca_sync', new Response(String(seq)));
+}
+
+async function sincronizar() {
+    let since = await lerMarca();
+    let mais = true;
+    while (mais) {
+        const res = await fetch(`/api/sync/changes?since=${since}`);
+        if (!res.ok) return;
+        const alteracoes = [];
+        let reset = false;
+        for (const linha of (await res.text()).split('\n')) {
+            if (!linha) continue;
+            const item = JSON.parse(linha);
+            if (item.reset) reset = true;
+            else if (item.fim !== undefined) { since = item.fim; mais = item.mais; }
+            else alteracoes.push(item);
+        }
+        const paginas = await self.clients.matchAll();
+        paginas.forEach((p) => p.postMessage({ tipo: 'sync', reset, alteracoes, seq: since }));
+        await guardarMarca(since);
+    }
+}
+
+self.addEventListener('sync', (event) => {
+    if (event.tag === 'carpintaria-sync') event.waitUntil(sincronizar());
+});
+
+self.addEventListener('message', (event) => {
+    if (event.data === 'sincronizar') event.waitUntil(sincronizar());
+});
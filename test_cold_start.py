@@ -0,0 +1,48 @@
+import os
+import sys
+import sqlite3
+import tempfile
+import subprocess
+import perfil_arranque
+
+# Arranque a frio do modo serverless (api/index.py): /tmp vazio, processo Python novo.
+# Corre sozinho (python test_cold_start.py) ou com pytest; falha se passar do orçamento.
+ORCAMENTO_MS = float(os.environ.get("COLD_START_ORCAMENTO_MS", "800"))
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+# Módulos que não podem ser importados no arranque (só nos endpoints que os usam)
+PROIBIDOS = ("numpy", "PyPDF2", "smolagents", "litellm", "uvicorn", "httpx")
+
+def test_cold_start_dentro_do_orcamento():
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {"CARPINTARIA_SERVERLESS": "1", "DB_PATH": os.path.join(tmp, "carpintaria.db")}
+        total, _ = perfil_arranque.correr_import("api.index", env, RAIZ, importtime=False)
+        _, stderr = perfil_arranque.correr_import("api.index", env, RAIZ)
+    entradas = perfil_arranque.analisar_importtime(stderr)
+    cumulativo, filhos = perfil_arranque.imports_diretos(entradas, "main")
+    print(f"Arranque a frio de api/index.py: {total:.0f}ms (orçamento {ORCAMENTO_MS:.0f}ms)")
+    for ms, nome in filhos[:15]:
+        print(f"  {ms:8.1f}ms  {nome}")
+    carregados = sorted({e[3].split(".")[0] for e in entradas} & set(PROIBIDOS))
+    assert not carregados, f"Importados no arranque: {carregados}"
+    assert total <= ORCAMENTO_MS, f"Arranque a frio {total:.0f}ms acima do orçamento de {ORCAMENTO_MS:.0f}ms"
+
+def test_semente_tem_todas_as_migracoes():
+    # Uma semente desatualizada obriga cada arranque a frio a correr as migrações em falta
+    # (a do FTS reconstrói o índice todo): regenerar com python main.py --gerar-semente
+    with tempfile.TemporaryDirectory() as tmp:
+        ultima = int(subprocess.run(
+            [sys.executable, "-c", "import main; print(max(m[0] for m in main.MIGRACOES))"],
+            cwd=RAIZ, env={**os.environ, "DB_PATH": os.path.join(tmp, "carpintaria.db")},
+            capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1])
+    # immutable=1: só lê, sem criar -wal/-shm ao lado da semente
+    conn = sqlite3.connect(f"file:{os.path.join(RAIZ, 'api', 'carpintaria_seed.db')}?immutable=1", uri=True)
+    try:
+        semente = conn.execute("SELECT MAX(versao) FROM schema_versao").fetchone()[0]
+    finally:
+        conn.close()
+    assert semente >= ultima, f"Semente na migração {semente}, última é {ultima}: correr python main.py --gerar-semente"
+
+if __name__ == "__main__":
+    test_cold_start_dentro_do_orcamento()
+    test_semente_tem_todas_as_migracoes()
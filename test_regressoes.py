@@ -0,0 +1,356 @@
+import os
+import sys
+import time
+import types
+import asyncio
+import tempfile
+import json
+
+# Regressões encontradas em revisão. Importa main com uma BD temporária (nunca a carpintaria.db
+# real); corre sozinho (python test_regressoes.py) ou com pytest.
+_TMP = tempfile.mkdtemp(prefix="carpintaria-teste-")
+os.environ.setdefault("DB_PATH", os.path.join(_TMP, "carpintaria.db"))
+os.environ.setdefault("BACKUP_DIR", os.path.join(_TMP, "backups"))
+os.environ.setdefault("BACKUP_INTERVALO_HORAS", "0")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+cliente = TestClient(main.app)
+
+def ndjson(resposta) -> list:
+    return [json.loads(linha) for linha in resposta.text.splitlines() if linha]
+
+# --- TRADUÇÃO ---
+class _TradutorPartilhado:
+    """Imita o deep_translator: translate() guarda o texto no objeto antes do pedido HTTP."""
+    def __init__(self, source, target):
+        self.target = target
+        self.params = {}
+
+    def translate(self, texto):
+        self.params["q"] = texto
+        time.sleep(0.005)  # o pedido: outra thread pode escrever em params entretanto
+        return f"{self.params['q']} [{self.target}]"
+
+def test_google_concorrente_nao_troca_traducoes():
+    anterior_modulo = sys.modules.get("deep_translator")
+    anterior_backend = main.backend_traducao
+    sys.modules["deep_translator"] = types.SimpleNamespace(GoogleTranslator=_TradutorPartilhado)
+    main.backend_traducao = main.BackendGoogle()
+    try:
+        async def correr():
+            lotes = [[f"texto {n}-{i}" for i in range(5)] for n in range(8)]
+            return lotes, await asyncio.gather(*(main.traduzir_textos(l, "pt", "en") for l in lotes))
+        lotes, resultados = asyncio.run(correr())
+        for lote, traduzidos in zip(lotes, resultados):
+            assert traduzidos == [f"{t} [en]" for t in lote], traduzidos
+    finally:
+        main.backend_traducao = anterior_backend
+        if anterior_modulo is None:
+            sys.modules.pop("deep_translator", None)
+        else:
+            sys.modules["deep_translator"] = anterior_modulo
+
+def test_cache_de_traducoes_respeita_o_backend():
+    anterior_modulo = sys.modules.get("deep_translator")
+    anterior_backend = main.backend_traducao
+    dicionario = main.BackendDicionario()
+    dicionario.entradas = {"pt>fr": {"mesa": "table (dicionário)"}}
+    try:
+        main.backend_traducao = dicionario
+        assert asyncio.run(main.traduzir_textos(["mesa", "cadeira"], "pt", "fr")) == ["table (dicionário)", "cadeira"]
+        gravadas = main.obter_conexao().execute(
+            "SELECT backend, COUNT(*) FROM traducoes_cache WHERE target = 'fr' GROUP BY backend"
+        ).fetchall()
+        assert gravadas == [("dicionario", 1)], gravadas  # "cadeira" voltou igual: não é tradução
+
+        # Com o Google de volta, nada do que o dicionário gravou é servido
+        sys.modules["deep_translator"] = types.SimpleNamespace(GoogleTranslator=_TradutorPartilhado)
+        main.backend_traducao = main.BackendGoogle()
+        assert asyncio.run(main.traduzir_textos(["mesa", "cadeira"], "pt", "fr")) == ["mesa [fr]", "cadeira [fr]"]
+        # ...e o dicionário passa a aproveitar as traduções melhores
+        main.backend_traducao = dicionario
+        assert asyncio.run(main.traduzir_textos(["mesa", "cadeira"], "pt", "fr")) == ["mesa [fr]", "cadeira [fr]"]
+    finally:
+        main.backend_traducao = anterior_backend
+        if anterior_modulo is None:
+            sys.modules.pop("deep_translator", None)
+        else:
+            sys.modules["deep_translator"] = anterior_modulo
+
+# --- BACKUPS + SYNC ---
+def test_restauro_obriga_clientes_a_refazer_o_sync():
+    cliente.post("/api/crm/novo", json={"nome": "Antes do backup"})
+    backup = cliente.post("/api/backup/run").json()["backup"]["nome"]
+    cliente.post("/api/crm/novo", json={"nome": "Perdido no restauro"})
+    marca = ndjson(cliente.get("/api/sync/changes?since=0"))[-1]["fim"]
+
+    assert cliente.post("/api/backup/restaurar", json={"nome": backup}).json()["success"]
+    cliente.post("/api/crm/novo", json={"nome": "Depois do restauro"})
+
+    linhas = ndjson(cliente.get(f"/api/sync/changes?since={marca}"))
+    assert linhas[0] == {"reset": True}, linhas
+    nomes = [l["d"]["nome"] for l in linhas if l.get("t") == "crm" and "d" in l]
+    assert "Depois do restauro" in nomes and "Perdido no restauro" not in nomes, nomes
+    fim = linhas[-1]["fim"]
+    assert fim > marca and not linhas[-1]["mais"]
+    # O sync completo leva a uma marca nova: o pedido seguinte já não é reset
+    assert ndjson(cliente.get(f"/api/sync/changes?since={fim}")) == [{"fim": fim, "mais": False}]
+
+def test_backup_recusa_sem_espaco_para_a_copia_descomprimida():
+    original = main.backups.shutil.disk_usage
+    main.backups.shutil.disk_usage = lambda caminho: types.SimpleNamespace(total=0, used=0, free=1024)
+    try:
+        res = cliente.post("/api/backup/run").json()
+    finally:
+        main.backups.shutil.disk_usage = original
+    assert not res["success"] and "Espaço insuficiente" in res["message"], res
+    assert not [f for f in os.listdir(main.backups.BACKUP_DIR) if f.endswith(".tmp")]
+
+def test_purga_de_tombstones_repete_se_sem_reiniciar():
+    def tombstone_antiga(linha_id):
+        with main.transacao() as conn:
+            conn.execute("INSERT OR REPLACE INTO alteracoes (tabela, linha_id, operacao, em) "
+                         "VALUES ('crm', ?, 'd', datetime('now', '-400 days'))", (linha_id,))
+    restantes = lambda: main.obter_conexao().execute(
+        "SELECT COUNT(*) FROM alteracoes WHERE operacao = 'd' AND em < datetime('now', '-300 days')").fetchone()[0]
+
+    async def correr():
+        tombstone_antiga(-1)
+        tarefa = main.em_fundo(main._agendar_purga_sync())
+        await asyncio.sleep(0.2)
+        primeira = restantes()
+        tombstone_antiga(-2)  # aparece com o worker já a correr
+        await asyncio.sleep(0.3)
+        tarefa.cancel()
+        return primeira, restantes()
+
+    anterior = main.SYNC_PURGA_HORAS
+    main.SYNC_PURGA_HORAS = 0.1 / 3600
+    try:
+        assert asyncio.run(correr()) == (0, 0)
+    finally:
+        main.SYNC_PURGA_HORAS = anterior
+
+# --- ROTEIROS ---
+async def _forjar_com_falhas(conteudo, *args, **kwargs):
+    if conteudo.startswith("falha"):
+        raise main.carregar("httpx").ConnectError("Ollama em baixo")
+    return {"titulo": conteudo}
+
+def test_roteiros_em_lote_isolam_erros_de_ligacao():
+    original = main.forjar_roteiro
+    main.forjar_roteiro = _forjar_com_falhas
+    try:
+        res = cliente.post("/api/atelie/roteirizar/lote", json={"conteudos": ["a", "falha b", "c"]})
+        assert res.status_code == 200, res.text
+        roteiros = res.json()["roteiros"]
+        assert roteiros[0] == {"titulo": "a"} and roteiros[2] == {"titulo": "c"}
+        assert "ConnectError" in roteiros[1]["erro"]
+        assert cliente.post("/api/atelie/roteirizar/lote", json={"conteudos": ["a"], "concorrencia": "muita"}).status_code == 400
+
+        with main.transacao() as conn:
+            conn.execute("INSERT INTO conhecimento (titulo, conteudo, tipo) VALUES ('f', 'falha no meio', 'manual')")
+            conn.execute("INSERT INTO conhecimento (titulo, conteudo, tipo) VALUES ('o', 'outro conteúdo', 'manual')")
+        asyncio.run(main.precomputar_roteiros("modelo-teste"))
+        estado = main._precomputacao_roteiros
+        assert estado["falhas"] >= 1 and estado["feitos"] >= 1, estado  # continuou depois da falha
+    finally:
+        main.forjar_roteiro = original
+
+# --- LEITURAS PARCIAIS ---
+def test_intervalos_aplicam_se_a_revisoes_antigas():
+    primeira = cliente.post("/api/docs/guardar", json={
+        "filename": "intervalos.txt", "titulo": "Intervalos", "categoria": "Teste", "conteudo": "linha 0\nlinha 1\nlinha 2\n"
+    }).json()["revisao"]
+    cliente.post("/api/docs/guardar", json={"filename": "intervalos.txt", "titulo": "Intervalos", "categoria": "Teste", "conteudo": "outra\n"})
+    ler = lambda **extra: cliente.post("/api/docs/ler", json={"filename": "intervalos.txt", **extra}).json()
+    assert ler(revisao=primeira, bytes=[0, 5])["conteudo"] == "linha"
+    assert ler(revisao=primeira, linhas=[1, 2])["conteudo"] == "linha 1\n"
+    assert ler(bytes=[0, 3])["conteudo"] == "out"
+
+def test_intervalos_na_revisao_atual_pelo_numero_nao_descomprimem_tudo():
+    atual = cliente.post("/api/docs/guardar", json={
+        "filename": "atual.txt", "titulo": "Atual", "categoria": "Teste", "conteudo": "linha 0\nlinha 1\n"
+    }).json()["revisao"]
+    original = main._ler_documento
+    main._ler_documento = lambda *a: (_ for _ in ()).throw(AssertionError("documento lido inteiro"))
+    try:
+        res = cliente.post("/api/docs/ler", json={"filename": "atual.txt", "revisao": atual, "linhas": [1, 2]}).json()
+    finally:
+        main._ler_documento = original
+    assert res["conteudo"] == "linha 1\n" and res["revisao"] == atual, res
+
+def test_patch_devolve_o_tamanho_em_bytes():
+    revisao = cliente.post("/api/docs/guardar", json={
+        "filename": "acentos.txt", "titulo": "Acentos", "categoria": "Teste", "conteudo": "Orçamento"
+    }).json()["revisao"]
+    res = cliente.post("/api/docs/patch", json={
+        "filename": "acentos.txt", "base_revisao": revisao, "edicoes": [{"pos": 9, "inserir": " não aprovado"}]
+    }).json()
+    meta = cliente.post("/api/docs/ler", json={"filename": "acentos.txt", "corpo": False}).json()
+    assert res["tamanho"] == meta["tamanho"] == len("Orçamento não aprovado".encode("utf-8")), (res, meta)
+
+def test_stream_nao_abre_ligacao_antes_do_primeiro_pedaco():
+    cliente.post("/api/docs/guardar", json={"filename": "stream.txt", "titulo": "Stream", "categoria": "Teste", "conteudo": "abc" * 1000})
+    abertas = []
+    original = main.abrir_conexao
+    main.abrir_conexao = lambda *a: abertas.append(1) or original(*a)
+    try:
+        async def desligar_antes():
+            meta, pedacos = await main.abrir_corpo("stream.txt", (0, 10))
+            del pedacos  # cliente desligou: o gerador nunca chega a correr
+            return meta
+        assert asyncio.run(desligar_antes())["revisao"]
+        assert abertas == []
+        async def ler_tudo():
+            _, pedacos = await main.abrir_corpo("stream.txt", (0, 10))
+            return b"".join([p async for p in pedacos])
+        assert asyncio.run(ler_tudo()) == b"abcabcabca" and abertas == [1]
+    finally:
+        main.abrir_conexao = original
+
+# --- SEGMENTAÇÃO ---
+def test_segmentacao_crlf_e_frases_longas():
+    casos = {
+        "Primeiro parágrafo.\r\n\r\nSegundo parágrafo.\r\n": ["Primeiro parágrafo.", "Segundo parágrafo."],
+        "Um.\n\nDois.\n": ["Um.", "Dois."],
+    }
+    for texto, esperados in casos.items():
+        pedacos = main.segmentar_documento(texto)
+        assert "".join(p for p, _ in pedacos) == texto
+        assert [p for p, traduzir in pedacos if traduzir] == esperados, pedacos
+
+    limite = main.TRADUTOR_MAX_SEGMENTO
+    sem_pontuacao = " ".join(f"palavra{i}" for i in range(limite // 4))   # uma só "frase" acima do limite
+    colado = "x" * (limite * 2 + 7)                                        # sem espaços: corte a seco
+    for texto in (sem_pontuacao, f"Antes.\r\n\r\n{colado}"):
+        pedacos = main.segmentar_documento(texto)
+        assert "".join(p for p, _ in pedacos) == texto
+        assert all(len(p) <= limite for p, traduzir in pedacos if traduzir)
+
+# --- CRM ---
+def test_importacao_crm_parcial_diz_o_que_entrou():
+    antes = main.obter_conexao().execute("SELECT COUNT(*) FROM crm").fetchone()[0]
+    original = main.CRM_LOTE_IMPORTACAO
+    main.CRM_LOTE_IMPORTACAO = 100
+    try:
+        # Bytes inválidos depois de vários lotes já gravados (o leitor descodifica aos blocos de 8KB)
+        linhas = "".join(f"Cliente {i},Umbila\n" for i in range(3000))
+        csv_ = ("nome,empresa\n,Sem nome\n" + linhas).encode() + b"\xff\xfe\n" * 10
+        res = cliente.post("/api/crm/importar", files={"file": ("crm.csv", csv_, "text/csv")})
+    finally:
+        main.CRM_LOTE_IMPORTACAO = original
+    corpo = res.json()
+    depois = main.obter_conexao().execute("SELECT COUNT(*) FROM crm").fetchone()[0]
+    assert res.status_code == 200 and corpo["parcial"] and not corpo["success"], corpo
+    assert 0 < corpo["importados"] == depois - antes, corpo
+    assert corpo["ignorados"] == 1 and {"linha": 2, "erro": "sem nome (ignorada)"} in corpo["erros"]
+    assert corpo["erros"][-1]["erro"].startswith("CSV inválido")
+
+    res = cliente.post("/api/crm/importar", files={"file": ("crm.csv", b"\xff\xfe" * 3000, "text/csv")})
+    assert res.status_code == 400 and res.json()["importados"] == 0
+
+# --- FILA LLM ---
+def test_fila_llm_cheia_admite_sac_a_custa_de_trabalho_de_fundo():
+    async def correr():
+        agendador = main.AgendadorLLM(max_concorrencia=1, max_fila=2, prazo=60)
+        ocupado, libertar, ordem = asyncio.Event(), asyncio.Event(), []
+
+        async def pedido(agente, segurar=False):
+            try:
+                async with agendador.admitir(agente):
+                    ordem.append(agente)
+                    if segurar:
+                        ocupado.set()
+                        await libertar.wait()
+                return "ok"
+            except main.HTTPException as e:
+                return e.status_code
+
+        dono = asyncio.create_task(pedido("dev", segurar=True))
+        await ocupado.wait()
+        fundo = [asyncio.create_task(pedido("precomputacao")) for _ in range(2)]
+        await asyncio.sleep(0)
+        sac = asyncio.create_task(pedido("sac"))
+        await asyncio.sleep(0)
+        # Outro pedido de fundo com a fila cheia continua a ser rejeitado
+        assert await pedido("precomputacao") == 503
+        libertar.set()
+        return await asyncio.gather(dono, sac, *fundo), ordem, agendador.stats
+
+    (dono, sac, primeiro, segundo), ordem, stats = asyncio.run(correr())
+    assert sac == "ok" and dono == "ok"
+    assert (primeiro, segundo) == (503, "ok"), (primeiro, segundo, ordem)  # saiu o mais antigo dos de fundo
+    assert ordem == ["dev", "sac", "precomputacao"]
+    assert stats["desalojados"] == 1
+
+# --- REGISTO DE USO ---
+def test_despejo_do_registo_de_uso_fica_referenciado():
+    async def correr():
+        registo = main.RegistoUso(max_buffer=1)
+        registo.registar({"provider": "teste", "agente": "despejo"})
+        pendentes = set(main._tarefas_fundo)
+        await asyncio.gather(*pendentes)
+        return pendentes
+    assert asyncio.run(correr()), "despejo lançado sem referência forte"
+    assert main.obter_conexao().execute("SELECT COUNT(*) FROM uso_llm WHERE agente = 'despejo'").fetchone()[0] == 1
+
+# --- CONTADORES ---
+def test_contador_de_projetos_com_status_null():
+    conn = main.obter_conexao()
+    ativos = lambda: conn.execute("SELECT valor FROM contadores WHERE nome = 'projetos_ativos'").fetchone()[0]
+    reais = lambda: conn.execute("SELECT COUNT(*) FROM projetos WHERE status IS NOT 'Concluído'").fetchone()[0]
+    with main.transacao() as c:
+        projeto = c.execute("INSERT INTO projetos (titulo, status) VALUES ('Sem status', NULL)").lastrowid
+    assert ativos() == reais()
+    for status in ("Concluído", None, "Em curso", "Concluído"):
+        with main.transacao() as c:
+            c.execute("UPDATE projetos SET status = ? WHERE id = ?", (status, projeto))
+        assert ativos() == reais(), status
+    with main.transacao() as c:
+        c.execute("DELETE FROM projetos WHERE id = ?", (projeto,))
+    assert ativos() == reais()
+    # O índice parcial antigo (status != 'Concluído') deixava de fora os NULL e já não é usado
+    assert not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_projetos_ativos'").fetchone()
+
+# --- GROUP COMMIT ---
+def test_grupo_de_escritas_faz_um_so_commit():
+    original = main.base_dados._gravar_grupo
+    vistos = []
+
+    def gravar_com_trace(escritas):
+        conn = main.obter_conexao()
+        conn.set_trace_callback(lambda sql: vistos.append((sql.split()[0].upper(), conn.in_transaction)))
+        try:
+            return original(escritas)
+        finally:
+            conn.set_trace_callback(None)
+
+    async def correr():
+        fila = main.FilaEscrita(ativo=True, janela_ms=200, maximo=10, ack="commit")
+        pedidos = [fila.escrever("INSERT INTO crm (nome) VALUES (?)", (f"Grupo {i}",)) for i in range(5)]
+        pedidos.insert(2, fila.escrever("INSERT INTO tabela_que_nao_existe VALUES (1)"))
+        resultados = await asyncio.gather(*pedidos, return_exceptions=True)
+        await fila.parar()
+        return resultados, fila.grupos
+
+    main.base_dados._gravar_grupo = gravar_com_trace
+    try:
+        resultados, grupos = asyncio.run(correr())
+    finally:
+        main.base_dados._gravar_grupo = original
+    assert grupos == 1
+    assert isinstance(resultados[2], main.sqlite3.Error) and all(isinstance(r, int) for i, r in enumerate(resultados) if i != 2)
+    assert [c for c, _ in vistos].count("COMMIT") == 1, vistos
+    assert all(em_transacao for c, em_transacao in vistos if c in ("SAVEPOINT", "RELEASE")), vistos
+    nomes = {n for (n,) in main.obter_conexao().execute("SELECT nome FROM crm WHERE nome LIKE 'Grupo %'")}
+    assert nomes == {f"Grupo {i}" for i in range(5)}
+
+if __name__ == "__main__":
+    for nome, teste in list(globals().items()):
+        if nome.startswith("test_") and callable(teste):
+            teste()
+            print(f"ok  {nome}")
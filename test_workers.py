@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import tempfile
+import subprocess
+import urllib.request
+from contextlib import contextmanager
+
+# Modo multi-worker (python main.py --workers N): uma escrita confirmada num worker (ou por
+# outro processo qualquer) tem de aparecer nas caches de todos os workers em <= DB_COERENCIA_MS.
+# Um restauro de backup feito por um worker também chega aos outros (ligações e caches).
+# Corre sozinho (python test_workers.py) ou com pytest; arranca um servidor real numa porta livre.
+WORKERS = int(os.environ.get("TESTE_WORKERS", "2"))
+COERENCIA_MS = float(os.environ.get("DB_COERENCIA_MS", "100"))
+MARGEM_MS = 50      # ida e volta HTTP local
+LEITURAS = 40       # pedidos (cada um numa ligação nova) feitos depois do limite
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+def porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def pedir(base, caminho, dados=None):
+    corpo = json.dumps(dados).encode() if dados is not None else None
+    pedido = urllib.request.Request(base + caminho, data=corpo, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(pedido, timeout=10) as resposta:
+        return json.loads(resposta.read())
+
+def contactos(base) -> int:
+    return pedir(base, "/api/dashboard/stats")["total_contactos"]
+
+def esperar_por(base, esperado: int, inicio: float) -> float:
+    """ms desde `inicio` até um pedido ver o valor esperado."""
+    while contactos(base) != esperado:
+        assert time.perf_counter() - inicio < 5, "escrita nunca ficou visível"
+    return (time.perf_counter() - inicio) * 1000
+
+def verificar_limite(base, esperado: int, commit: float):
+    atraso = COERENCIA_MS + MARGEM_MS - (time.perf_counter() - commit) * 1000
+    if atraso > 0:
+        time.sleep(atraso / 1000)
+    vistos = [contactos(base) for _ in range(LEITURAS)]
+    obsoletos = sum(v != esperado for v in vistos)
+    assert not obsoletos, f"{obsoletos}/{LEITURAS} leituras obsoletas após {COERENCIA_MS + MARGEM_MS:.0f}ms"
+
+@contextmanager
+def servidor_workers():
+    """Servidor real com WORKERS processos sobre uma BD temporária; devolve (base, db, pids)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        porta = porta_livre()
+        base = f"http://127.0.0.1:{porta}"
+        db = os.path.join(tmp, "carpintaria.db")
+        env = {**os.environ, "DB_PATH": db, "BACKUP_DIR": os.path.join(tmp, "backups"), "WEB_PORTA": str(porta),
+               "DB_COERENCIA_MS": str(COERENCIA_MS), "BACKUP_INTERVALO_HORAS": "0", "PYTHONUNBUFFERED": "1"}
+        servidor = subprocess.Popen([sys.executable, "main.py", "--workers", str(WORKERS)], cwd=RAIZ, env=env,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            pids = set()
+            limite = time.time() + 30
+            while len(pids) < WORKERS:
+                assert time.time() < limite, f"só responderam {len(pids)} de {WORKERS} workers"
+                try:
+                    pids.add(pedir(base, "/api/sistema/coerencia")["pid"])
+                except OSError:
+                    time.sleep(0.2)
+            # Aquece a cache de contadores em todos os workers
+            for _ in range(LEITURAS):
+                contactos(base)
+            yield base, db, pids
+        finally:
+            servidor.terminate()
+            servidor.wait(timeout=15)
+
+def test_escritas_visiveis_em_todos_os_workers():
+    with servidor_workers() as (base, db, pids):
+        antes = contactos(base)
+
+        # 1) Escrita feita por um dos workers (ack só depois do COMMIT)
+        pedir(base, "/api/crm/novo", {"nome": "Teste Workers", "empresa": "Coerência"})
+        commit = time.perf_counter()
+        primeiro_ms = esperar_por(base, antes + 1, commit)
+        verificar_limite(base, antes + 1, commit)
+
+        # 2) Escrita feita por outro processo diretamente na BD
+        conn = sqlite3.connect(db)
+        conn.execute("INSERT INTO crm (nome) VALUES ('Escrita externa')")
+        conn.commit()
+        commit = time.perf_counter()
+        conn.close()
+        externo_ms = esperar_por(base, antes + 2, commit)
+        verificar_limite(base, antes + 2, commit)
+
+        print(f"{WORKERS} workers (pids {sorted(pids)}), limite {COERENCIA_MS:.0f}ms: "
+              f"escrita via API vista em {primeiro_ms:.1f}ms, escrita externa em {externo_ms:.1f}ms")
+
+def test_restauro_chega_a_todos_os_workers():
+    with servidor_workers() as (base, db, pids):
+        pedir(base, "/api/crm/novo", {"nome": "Antes do backup"})
+        time.sleep((COERENCIA_MS + MARGEM_MS) / 1000)  # o outro worker pode ainda ter a cache antiga
+        antes = contactos(base)
+        backup = pedir(base, "/api/backup/run", {})["backup"]["nome"]
+        for i in range(3):
+            pedir(base, "/api/crm/novo", {"nome": f"Perdido no restauro {i}"})
+        esperar_por(base, antes + 3, time.perf_counter())
+
+        # O restauro corre num só worker; os outros têm de largar caches e ligações
+        assert pedir(base, "/api/backup/restaurar", {"nome": backup})["success"]
+        commit = time.perf_counter()
+        esperar_por(base, antes, commit)
+        verificar_limite(base, antes, commit)
+
+        renovados = {}
+        limite = time.time() + 5
+        while set(renovados) != pids:
+            assert time.time() < limite, f"workers que não viram o restauro: {pids - set(renovados)}"
+            contactos(base)
+            estado = pedir(base, "/api/sistema/coerencia")
+            if estado["restauro"] == 1 and estado["geracao_ligacoes"] >= 1:
+                renovados[estado["pid"]] = estado["geracao_ligacoes"]
+
+        # Escritas em qualquer worker continuam a funcionar sobre a BD restaurada
+        for i in range(LEITURAS // 4):
+            pedir(base, "/api/crm/novo", {"nome": f"Depois do restauro {i}"})
+        esperar_por(base, antes + LEITURAS // 4, time.perf_counter())
+
+if __name__ == "__main__":
+    test_escritas_visiveis_em_todos_os_workers()
+    test_restauro_chega_a_todos_os_workers()